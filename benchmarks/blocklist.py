@@ -0,0 +1,96 @@
+"""
+Memory-mapped blocklist against a Python set of the same entries.
+
+Generates --entries random card numbers, builds the blocklist file of
+fraud_detection/build_blocklist.py from them and a set of the normalized
+numbers, then reports the time to have each ready in a fresh service, the
+memory each takes and the time of a lookup of a listed and of an unlisted
+card.
+
+Usage:
+
+python benchmarks/blocklist.py [--entries 1000000] [--lookups 100000]
+"""
+import argparse
+import gc
+import random
+import sys
+import os
+import tempfile
+import time
+import tracemalloc
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+ROOT = os.path.abspath(os.path.join(FILE, '../..'))
+for path in ('utils/other', 'fraud_detection/src', 'fraud_detection'):
+    sys.path.insert(0, os.path.join(ROOT, path))
+import blocklist  # noqa
+import build_blocklist  # noqa
+
+
+def per_lookup(contains, keys):
+    started = time.perf_counter()
+    for key in keys:
+        contains(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cards = [str(rng.randrange(10**15, 10**16)) for _ in range(args.entries)]
+    listed = rng.sample(cards, min(args.lookups, len(cards)))
+    unlisted = [str(rng.randrange(10**15, 10**16)) for _ in range(args.lookups)]
+    normalize, _ = blocklist.KINDS['card']
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'card.blk')
+        started = time.perf_counter()
+        build_blocklist.build('card', cards, path)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        mapped = blocklist.Blocklist(path)
+        mapped_ready = time.perf_counter() - started
+        mapped_size = os.path.getsize(path)
+
+        # The set has to read and normalize the whole list in every service
+        with open(os.path.join(directory, 'cards.txt'), 'w') as f:
+            f.write('\n'.join(cards))
+
+        def load_set():
+            with open(os.path.join(directory, 'cards.txt')) as f:
+                return {normalize(line) for line in f}
+
+        started = time.perf_counter()
+        entries = load_set()
+        set_ready = time.perf_counter() - started
+        del entries
+        gc.collect()
+        tracemalloc.start()  # slows loading down, so measured on a second load
+        entries = load_set()
+        set_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        def mapped_contains(key):
+            return normalize(key) in mapped
+
+        def set_contains(key):
+            return normalize(key) in entries
+
+        print(f"{args.entries} cards, file built in {built:.1f} s")
+        print(f"{'':<14}{'ready (ms)':>12}{'memory (MiB)':>14}{'listed (µs)':>13}{'unlisted (µs)':>15}")
+        for label, ready, size, contains in (
+                ('mmap + Bloom', mapped_ready, mapped_size, mapped_contains),
+                ('set', set_ready, set_size, set_contains)):
+            print(f"{label:<14}{ready * 1000:>12.2f}{size / 2**20:>14.1f}"
+                  f"{per_lookup(contains, listed):>13.2f}{per_lookup(contains, unlisted):>15.2f}")
+        del mapped
+
+
+if __name__ == '__main__':
+    main()
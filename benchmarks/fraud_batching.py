@@ -0,0 +1,135 @@
+"""
+Throughput and latency of SayFraud with and without micro-batching.
+
+Runs fraud_detection's FraudService on localhost with a stand-in for the
+LLM that answers after --llm-delay-ms plus --llm-per-order-ms per order in
+the prompt, and sends it --requests orders of the synthetic set of
+fraud_detection/train_model.py from --concurrency client threads, once per
+batching setting: (score batch size, score wait ms, LLM batch size, LLM
+wait ms), a size of 1 meaning no batching.
+
+Usage:
+
+python benchmarks/fraud_batching.py [--requests 2000] [--concurrency 32] [--llm-delay-ms 200]
+"""
+import argparse
+import statistics
+import sys
+import os
+import threading
+import time
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+ROOT = os.path.abspath(os.path.join(FILE, '../..'))
+for path in ('utils/pb', 'utils/other', 'fraud_detection/src', 'fraud_detection'):
+    sys.path.insert(0, os.path.join(ROOT, path))
+import common_pb2 as common  # noqa
+import fraud_detection_pb2_grpc as fraud_detection_grpc  # noqa
+import app as fraud_detection  # noqa
+import train_model  # noqa
+
+import grpc  # noqa
+from concurrent import futures  # noqa
+
+SETTINGS = [
+    (1, 0, 1, 0),
+    (32, 2, 1, 0),
+    (32, 2, 8, 20),
+    (32, 2, 8, 50),
+    (64, 5, 16, 100),
+]
+
+
+def stub_agent(delay, per_order, calls):
+    # Stands in for pydantic_ai.Agent, says no order is a fraud
+    class StubAgent:
+        def __init__(self, model, output_type=None):
+            self.output_type = output_type
+
+        def run_sync(self, prompt, **kwargs):
+            orders = max(prompt.count('\nOrder '), 1)
+            calls.append(orders)
+            time.sleep(delay + per_order * orders)
+            if self.output_type is fraud_detection.FraudBatchResponse:
+                output = self.output_type(verdicts=[
+                    fraud_detection.FraudVerdict(order=index, is_fraud=False, message='Stubbed')
+                    for index in range(orders)])
+            else:
+                output = self.output_type(is_fraud=False, message='Stubbed')
+            return type('Result', (), {'output': output})()
+
+    return StubAgent
+
+
+def run(args, orders, setting):
+    calls = []
+    fraud_detection.Agent = stub_agent(
+        args.llm_delay_ms / 1000, args.llm_per_order_ms / 1000, calls)
+    batch_size, batch_wait, llm_batch_size, llm_batch_wait = setting
+    service = fraud_detection.FraudService(
+        batch_size=batch_size, batch_wait=batch_wait / 1000,
+        llm_batch_size=llm_batch_size, llm_batch_wait=llm_batch_wait / 1000)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=args.concurrency + 8))
+    fraud_detection_grpc.add_FraudServiceServicer_to_server(service, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    stub = fraud_detection_grpc.FraudServiceStub(grpc.insecure_channel(f'127.0.0.1:{port}'))
+    for index, data in enumerate(orders):
+        service.InitVerification(common.InitAllInfoRequest(order_id=str(index), request=data))
+
+    latencies = []
+    next_order = iter(range(len(orders)))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                index = next(next_order, None)
+            if index is None:
+                return
+            started = time.perf_counter()
+            stub.SayFraud(common.Request(
+                order_id=str(index), vector_clock=common.VectorClock(clocks=[0, 0, 0])),
+                timeout=30)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.stop(None)
+    latencies.sort()
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        'llm_calls': len(calls),
+        'llm_orders': sum(calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--llm-delay-ms', type=float, default=200)
+    parser.add_argument('--llm-per-order-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    orders, _ = train_model.synthetic_set(args.requests, 0.1, 0.02, seed=7)
+    print(f"{args.requests} SayFraud calls, {args.concurrency} concurrent, LLM "
+          f"{args.llm_delay_ms} ms + {args.llm_per_order_ms} ms per order")
+    print(f"{'batching (N/T ms, LLM N/T ms)':<30}{'req/s':>8}{'p50':>9}{'p99':>9}"
+          f"{'LLM calls':>11}{'orders':>8}")
+    for setting in SETTINGS:
+        result = run(args, orders, setting)
+        label = '{}/{}, {}/{}'.format(*setting)
+        print(f"{label:<30}{result['rps']:>8.1f}{result['p50']:>9.2f}{result['p99']:>9.2f}"
+              f"{result['llm_calls']:>11}{result['llm_orders']:>8}")
+
+
+if __name__ == '__main__':
+    main()
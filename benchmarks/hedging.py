@@ -0,0 +1,126 @@
+"""
+Tail latency of BooksDatabase.Read with and without hedging.
+
+Starts --replicas books_database stand-ins on localhost. Each answers Read
+after --delay-ms, except for a --slow-ratio share of the requests that take
+--slow-ms longer, the odd GC pause or noisy neighbour of a real replica.
+The same reads are then sent round-robin to the replicas, once without
+hedging and once through hedging.HedgedClient.
+
+Usage:
+
+python benchmarks/hedging.py [--requests 2000] [--concurrency 4] [--slow-ratio 0.03]
+"""
+import argparse
+import random
+import statistics
+import sys
+import os
+import threading
+import time
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+grpc_path = os.path.abspath(os.path.join(FILE, '../../utils/pb'))
+sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../utils/other'))
+sys.path.insert(0, utils_path)
+import books_database_pb2 as books_database  # noqa
+import books_database_pb2_grpc as books_database_grpc  # noqa
+import channel_pool  # noqa
+import hedging  # noqa
+
+import grpc  # noqa
+from concurrent import futures  # noqa
+
+
+class SlowReplica(books_database_grpc.BooksDatabaseServicer):
+    def __init__(self, delay, slow_delay, slow_ratio, seed):
+        self.delay = delay
+        self.slow_delay = slow_delay
+        self.slow_ratio = slow_ratio
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def Read(self, request, context):
+        with self._lock:
+            self.requests += 1
+            slow = self._rng.random() < self.slow_ratio
+        time.sleep(self.delay + (self.slow_delay if slow else 0))
+        return books_database.ReadResponse(stock=100)
+
+
+def start_replica(replica):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    books_database_grpc.add_BooksDatabaseServicer_to_server(replica, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, f'127.0.0.1:{port}'
+
+
+def measure(client, requests, concurrency):
+    request = books_database.ReadRequest(title='1984 by George Orwell')
+    samples = []
+
+    def reader(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            client.call(request, timeout=5)
+            samples.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=reader, args=(requests // concurrency,))
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    samples.sort()
+    return {
+        'mean': statistics.fmean(samples),
+        'p50': samples[len(samples) // 2],
+        'p95': samples[int(len(samples) * 0.95)],
+        'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--replicas', type=int, default=3)
+    parser.add_argument('--delay-ms', type=float, default=2.0,
+                        help='service time of a normal read')
+    parser.add_argument('--slow-ms', type=float, default=50.0,
+                        help='extra service time of a slow read')
+    parser.add_argument('--slow-ratio', type=float, default=0.03)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--max-extra-load', type=float,
+                        default=hedging.HEDGE_MAX_EXTRA_LOAD)
+    args = parser.parse_args()
+
+    replicas = [SlowReplica(args.delay_ms / 1000, args.slow_ms / 1000,
+                            args.slow_ratio, seed) for seed in range(args.replicas)]
+    servers, targets = zip(*(start_replica(replica) for replica in replicas))
+
+    print(f"BooksDatabase.Read latency, {args.replicas} replicas, {args.delay_ms} ms "
+          f"per read, {args.slow_ratio:.0%} of reads {args.slow_ms} ms slower, "
+          f"{args.requests} reads, {args.concurrency} concurrent (ms)")
+    print(f"{'mode':<10}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'extra load':>12}")
+    modes = (('plain', 0.0, 0), ('hedged', args.max_extra_load, hedging.HEDGE_BURST))
+    for name, max_extra_load, burst in modes:
+        client = hedging.HedgedClient(targets, books_database_grpc.BooksDatabaseStub,
+                                      'Read', max_extra_load=max_extra_load, burst=burst)
+        measure(client, 200, args.concurrency)  # warm-up, learns the delay
+        before = sum(replica.requests for replica in replicas)
+        result = measure(client, args.requests, args.concurrency)
+        sent = sum(replica.requests for replica in replicas) - before
+        calls = args.requests // args.concurrency * args.concurrency
+        print(f"{name:<10}{result['mean']:>8.2f}{result['p50']:>8.2f}"
+              f"{result['p95']:>8.2f}{result['p99']:>8.2f}{sent / calls - 1:>12.1%}")
+
+    channel_pool.close()
+    for server in servers:
+        server.stop(None)
+
+
+if __name__ == '__main__':
+    main()
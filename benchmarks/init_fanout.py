@@ -0,0 +1,133 @@
+"""
+Latency of the checkout init stage: three serial init RPCs versus the
+concurrent fan-out used by the orchestrator.
+
+Starts fraud_detection, transaction_verification and suggestions stand-ins on
+localhost that answer their init RPC after an artificial delay, which plays
+the part of the network round-trip between containers.
+
+Usage:
+
+python benchmarks/init_fanout.py [--delay-ms 5] [--iterations 200]
+"""
+import argparse
+import statistics
+import sys
+import os
+import time
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+grpc_path = os.path.abspath(os.path.join(FILE, '../../utils/pb'))
+sys.path.insert(0, grpc_path)
+import common_pb2 as common  # noqa
+import fraud_detection_pb2_grpc as fraud_detection_grpc  # noqa
+import transaction_verification_pb2_grpc as transaction_verification_grpc  # noqa
+import suggestions_pb2_grpc as suggestions_grpc  # noqa
+
+import grpc  # noqa
+from concurrent import futures  # noqa
+
+
+class DelayedFraudService(fraud_detection_grpc.FraudServiceServicer):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def InitVerification(self, request, context):
+        time.sleep(self.delay)
+        return common.Empty()
+
+
+class DelayedVerificationService(transaction_verification_grpc.VerificationServiceServicer):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def initVerification(self, request, context):
+        time.sleep(self.delay)
+        return common.Empty()
+
+
+class DelayedSuggestionsService(suggestions_grpc.SuggestionServiceServicer):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def initSuggestion(self, request, context):
+        time.sleep(self.delay)
+        return common.Empty()
+
+
+def start_server(delay):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    fraud_detection_grpc.add_FraudServiceServicer_to_server(
+        DelayedFraudService(delay), server)
+    transaction_verification_grpc.add_VerificationServiceServicer_to_server(
+        DelayedVerificationService(delay), server)
+    suggestions_grpc.add_SuggestionServiceServicer_to_server(
+        DelayedSuggestionsService(delay), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, port
+
+
+def init_serial(stubs, general_request, suggestions_request):
+    fraud_stub, verification_stub, suggestions_stub = stubs
+    fraud_stub.InitVerification(general_request)
+    verification_stub.initVerification(general_request)
+    suggestions_stub.initSuggestion(suggestions_request)
+
+
+def init_concurrent(stubs, general_request, suggestions_request):
+    fraud_stub, verification_stub, suggestions_stub = stubs
+    init_futures = [
+        fraud_stub.InitVerification.future(general_request),
+        verification_stub.initVerification.future(general_request),
+        suggestions_stub.initSuggestion.future(suggestions_request),
+    ]
+    for future in init_futures:
+        future.result()
+
+
+def measure(fn, stubs, iterations):
+    items = [common.Item(name='1984 by George Orwell', quantity=1)]
+    general_request = common.InitAllInfoRequest(
+        order_id='bench', request=common.AllInfoRequest(items=items))
+    suggestions_request = common.ItemsInitRequest(order_id='bench', items=items)
+    fn(stubs, general_request, suggestions_request)  # warm-up
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(stubs, general_request, suggestions_request)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'mean': statistics.fmean(samples),
+        'p50': samples[len(samples) // 2],
+        'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--delay-ms', type=float, default=5.0,
+                        help='artificial per-RPC service delay')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    server, port = start_server(args.delay_ms / 1000)
+    channel = grpc.insecure_channel(f'127.0.0.1:{port}')
+    stubs = (fraud_detection_grpc.FraudServiceStub(channel),
+             transaction_verification_grpc.VerificationServiceStub(channel),
+             suggestions_grpc.SuggestionServiceStub(channel))
+
+    print(f"Init stage latency, {args.delay_ms} ms per RPC, "
+          f"{args.iterations} iterations (ms)")
+    print(f"{'mode':<12}{'mean':>8}{'p50':>8}{'p99':>8}")
+    for name, fn in (('serial', init_serial), ('concurrent', init_concurrent)):
+        result = measure(fn, stubs, args.iterations)
+        print(f"{name:<12}{result['mean']:>8.2f}{result['p50']:>8.2f}{result['p99']:>8.2f}")
+
+    channel.close()
+    server.stop(None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+"""
+Replay load generator for the orchestrator's /checkout endpoint.
+
+Sends checkout payloads, either replayed from a JSON-lines file (one order per
+line, see checkout_payloads.jsonl) or generated synthetically, at a fixed
+concurrency (closed loop) or a target request rate (open loop). Reports
+p50/p95/p99 latency, throughput and a breakdown of the outcomes by rejection
+reason or error.
+
+With --in-process, fraud_detection, transaction_verification, suggestions,
+order_queue, a books_database replica stocking the synthetic books and the
+orchestrator itself are started inside this process on free localhost ports, with the LLM calls replaced by a stub that answers
+after --llm-delay-ms. The whole checkout pipeline can then be measured on one
+machine without Docker or network access.
+
+Usage:
+
+python benchmarks/loadgen.py --in-process --concurrency 32 --requests 2000
+python benchmarks/loadgen.py --url http://localhost:8081 --rps 50 --duration 30 \\
+    --payloads benchmarks/checkout_payloads.jsonl
+"""
+import argparse
+import atexit
+import collections
+import http.client
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+from urllib.parse import urlsplit
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+ROOT = os.path.abspath(os.path.join(FILE, '../..'))
+
+BOOKS = [
+    '1984 by George Orwell',
+    'Brave New World by Aldous Huxley',
+    'The Hobbit by J.R.R. Tolkien',
+    'Dune by Frank Herbert',
+    'Neuromancer by William Gibson',
+    'Foundation by Isaac Asimov',
+]
+FIRST_NAMES = ['John', 'Jane', 'Alex', 'Maria', 'Ali', 'Sara']
+LAST_NAMES = ['Doe', 'Smith', 'Aliyev', 'Garcia', 'Kim', 'Novak']
+
+# Synthetic orders that fail verification, and what they break
+REJECTIONS = {
+    'empty_items': lambda order: order.update(items=[]),
+    'too_many_items': lambda order: order['items'][0].update(quantity=12),
+    'bad_card': lambda order: order['creditCard'].update(number='4111'),
+    'expired_card': lambda order: order['creditCard'].update(expirationDate='01/20'),
+    'bad_contact': lambda order: order['user'].update(contact='not-an-email'),
+    'out_of_stock': lambda order: order['items'][0].update(name='Out of Print by Nobody'),
+}
+
+
+def synthetic_order(rng, reject_ratio):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    order = {
+        'user': {
+            'name': f'{first} {last}',
+            'contact': f'{first.lower()}.{last.lower()}@example.com',
+        },
+        'creditCard': {
+            'number': ''.join(rng.choice('0123456789') for _ in range(16)),
+            'expirationDate': f'{rng.randint(1, 12):02d}/{rng.randint(30, 35)}',
+            'cvv': str(rng.randint(100, 999)),  # Sent as an int, no leading zeros
+        },
+        'userComment': '',
+        'items': [{'name': name, 'quantity': rng.randint(1, 2)}
+                  for name in rng.sample(BOOKS, rng.randint(1, 3))],
+        'billingAddress': {
+            'street': f'{rng.randint(1, 200)} Main St',
+            'city': 'Tartu',
+            'state': 'Tartumaa',
+            'zip': f'{rng.randint(10000, 99999)}',
+            'country': 'Estonia',
+        },
+        'shippingMethod': rng.choice(['Standard', 'Express']),
+        'giftWrapping': False,
+        'termsAccepted': True,
+    }
+    if rng.random() < reject_ratio:
+        REJECTIONS[rng.choice(sorted(REJECTIONS))](order)
+    return order
+
+
+def load_payloads(args):
+    if args.payloads:
+        with open(args.payloads) as f:
+            payloads = [line.strip() for line in f if line.strip()]
+        if not payloads:
+            sys.exit(f"No payloads in {args.payloads}")
+        return [payload.encode() for payload in payloads]
+    rng = random.Random(args.seed)
+    return [json.dumps(synthetic_order(rng, args.reject_ratio)).encode()
+            for _ in range(args.synthetic)]
+
+
+def outcome(status, body):
+    if status not in (200, 202):
+        return f'HTTP {status}'
+    try:
+        result = json.loads(body)['status']
+    except (ValueError, KeyError, TypeError):
+        return 'Unparseable response'
+    return result.replace('Order Rejected: ', 'Rejected: ')
+
+
+class Client:
+    # One keep-alive connection per sender thread
+    def __init__(self, url, respond_async=False):
+        parts = urlsplit(url)
+        self.path = parts.path.rstrip('/') + '/checkout'
+        self.headers = {'Content-Type': 'application/json'}
+        if respond_async:
+            # Answered with 202 once accepted, see /orders/<orderId>
+            self.headers['Prefer'] = 'respond-async'
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80,
+                                               timeout=30)
+
+    def post(self, payload):
+        try:
+            self.conn.request('POST', self.path, body=payload, headers=self.headers)
+            resp = self.conn.getresponse()
+            return outcome(resp.status, resp.read())
+        except (OSError, http.client.HTTPException) as e:
+            self.conn.close()
+            return f'Connection error ({type(e).__name__})'
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.outcomes = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, latency, result):
+        with self._lock:
+            self.latencies.append(latency)
+            self.outcomes[result] += 1
+
+
+def run_closed_loop(args, payloads, recorder):
+    # Every sender sends its next request as soon as the previous one is back
+    stop_at = time.perf_counter() + args.duration if args.duration else None
+    counter = iter(range(args.requests if not stop_at else sys.maxsize))
+    counter_lock = threading.Lock()
+
+    def sender():
+        client = Client(args.url, args.respond_async)
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None or (stop_at and time.perf_counter() >= stop_at):
+                return
+            start = time.perf_counter()
+            result = client.post(payloads[index % len(payloads)])
+            recorder.add(time.perf_counter() - start, result)
+
+    threads = [threading.Thread(target=sender) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open_loop(args, payloads, recorder):
+    # Requests are due at a fixed rate whether or not earlier ones are back.
+    # Latency counts from when a request was due, so a backed up orchestrator
+    # shows up as latency instead of a lower send rate
+    total = int(args.rps * args.duration) if args.duration else args.requests
+    clients = threading.local()
+
+    def send(index, due_at):
+        if not hasattr(clients, 'client'):
+            clients.client = Client(args.url, args.respond_async)
+        result = clients.client.post(payloads[index % len(payloads)])
+        recorder.add(time.perf_counter() - due_at, result)
+
+    with futures.ThreadPoolExecutor(max_workers=args.max_inflight) as senders:
+        origin = time.perf_counter()
+        for index in range(total):
+            due_at = origin + index / args.rps
+            delay = due_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            senders.submit(send, index, due_at)
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def report(args, recorder, elapsed):
+    samples = sorted(recorder.latencies)
+    if not samples:
+        sys.exit("No requests were sent")
+    load = (f'{args.rps} req/s target' if args.rps
+            else f'{args.concurrency} concurrent')
+    summary = {
+        'requests': len(samples),
+        'seconds': elapsed,
+        'throughput': len(samples) / elapsed,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': samples[-1] * 1000,
+        'outcomes': dict(recorder.outcomes.most_common()),
+    }
+    print(f"{summary['requests']} requests in {elapsed:.2f} s ({load}): "
+          f"{summary['throughput']:.1f} req/s")
+    print(f"latency (ms)  p50 {summary['p50_ms']:.2f}  p95 {summary['p95_ms']:.2f}  "
+          f"p99 {summary['p99_ms']:.2f}  max {summary['max_ms']:.2f}")
+    print("outcomes:")
+    for result, count in recorder.outcomes.most_common():
+        print(f"  {count:>7}  {count / len(samples):>6.1%}  {result}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class StubResult:
+    def __init__(self, output):
+        self.output = output
+
+
+def stub_agent(answer, delay):
+    # Stands in for pydantic_ai.Agent, answers without leaving the machine
+    class StubAgent:
+        def __init__(self, model, output_type=None):
+            self.output_type = output_type
+
+        def run_sync(self, prompt, **kwargs):
+            time.sleep(delay)
+            return StubResult(answer(self.output_type, prompt))
+
+    return StubAgent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_orchestrator_workers(args, port):
+    # The orchestrator under its production server, in a child process
+    env = dict(os.environ,
+               ORCHESTRATOR_MODE=args.orchestrator_mode,
+               ORCHESTRATOR_WORKERS=str(args.workers),
+               ORCHESTRATOR_STATE_DB=os.path.join(
+                   tempfile.mkdtemp(), 'orchestrator_state.db'),
+               PORT=str(port))
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'orchestrator/src/app.py')],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        if process.poll() is not None:
+            sys.exit(f'orchestrator exited with code {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    atexit.register(process.terminate)
+    return process
+
+
+def start_in_process(args):
+    # Returns the orchestrator URL, the servers must stay referenced
+    import grpc
+    delay = args.llm_delay_ms / 1000
+    sys.path.insert(0, os.path.join(ROOT, 'fraud_detection/src'))  # rules.py
+    fraud_detection = load_module(
+        'fraud_detection_app', 'fraud_detection/src/app.py')
+
+    def fraud_answer(output_type, prompt):
+        # No order is a fraud, one verdict per order of a batched prompt
+        if output_type is fraud_detection.FraudBatchResponse:
+            return output_type(verdicts=[
+                fraud_detection.FraudVerdict(order=index, is_fraud=False, message='Stubbed check')
+                for index in range(prompt.count('\nOrder '))])
+        return output_type(is_fraud=False, message='Stubbed check')
+
+    fraud_detection.Agent = stub_agent(fraud_answer, delay)
+    transaction_verification = load_module(
+        'transaction_verification_app', 'transaction_verification/src/app.py')
+    suggestions = load_module('suggestions_app', 'suggestions/src/app.py')
+    suggestions.Agent = stub_agent(
+        lambda output_type, prompt: [suggestions.BookSuggestion(
+            bookId='1', title='Stubbed suggestion', author='Stub')],
+        delay)
+    order_queue = load_module('order_queue_app', 'order_queue/src/app.py')
+    books_database = load_module('books_database_app', 'books_database/src/app.py')
+    catalogue = books_database.BooksDatabase()
+    catalogue.store.update((book, 10 ** 6) for book in BOOKS)
+
+    import fraud_detection_pb2_grpc
+    import transaction_verification_pb2_grpc
+    import suggestions_pb2_grpc
+    import order_queue_pb2_grpc
+    import books_database_pb2_grpc
+    queue_service = order_queue.OrderQueueService()
+    # env variable -> servicers sharing one server
+    services = {
+        'FRAUD_DETECTION_ADDR': [(
+            fraud_detection_pb2_grpc.add_FraudServiceServicer_to_server,
+            fraud_detection.FraudService())],
+        'TRANSACTION_VERIFICATION_ADDR': [(
+            transaction_verification_pb2_grpc.add_VerificationServiceServicer_to_server,
+            transaction_verification.VerificationService())],
+        'SUGGESTIONS_ADDR': [(
+            suggestions_pb2_grpc.add_SuggestionServiceServicer_to_server,
+            suggestions.SuggestionsService())],
+        'ORDER_QUEUE_ADDR': [
+            (order_queue_pb2_grpc.add_OrderQueueServiceServicer_to_server,
+             queue_service),
+            (order_queue_pb2_grpc.add_OrderStatusServiceServicer_to_server,
+             queue_service.statuses)],
+        'BOOKS_DATABASE_READ_ADDRS': [(
+            books_database_pb2_grpc.add_BooksDatabaseServicer_to_server, catalogue)],
+    }
+    servers = []
+    for env_name, servicers in services.items():
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=64))
+        for add_servicer, servicer in servicers:
+            add_servicer(servicer, server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        server.start()
+        servers.append(server)
+        # Read by the orchestrator when it is imported below
+        os.environ[env_name] = f'127.0.0.1:{port}'
+
+    port = free_port()
+    if args.workers:
+        servers.append(start_orchestrator_workers(args, port))
+        return f'http://127.0.0.1:{port}', servers
+    sys.path.insert(0, os.path.join(ROOT, 'orchestrator/src'))
+    if args.orchestrator_mode == 'async':
+        import asyncio
+        import uvicorn
+        import asgi_app
+        server = uvicorn.Server(uvicorn.Config(
+            asgi_app.app, host='127.0.0.1', port=port, log_level='warning',
+            access_log=False))
+        thread = threading.Thread(
+            target=lambda: asyncio.run(server.serve()), daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+    else:
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        orchestrator = load_module('app', 'orchestrator/src/app.py')
+        server = make_server('127.0.0.1', port, orchestrator.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    servers.append(server)
+    return f'http://127.0.0.1:{port}', servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8081',
+                        help='orchestrator base URL, ignored with --in-process')
+    parser.add_argument('--payloads', help='JSON-lines file of checkout orders')
+    parser.add_argument('--synthetic', type=int, default=500,
+                        help='number of generated orders when --payloads is not given')
+    parser.add_argument('--reject-ratio', type=float, default=0.2,
+                        help='share of generated orders that fail verification')
+    parser.add_argument('--seed', type=int, default=1)
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=int, default=16,
+                      help='requests in flight at any time (closed loop)')
+    load.add_argument('--rps', type=float,
+                      help='target request rate (open loop)')
+    parser.add_argument('--max-inflight', type=int, default=256,
+                        help='sender threads in open loop mode')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--duration', type=float,
+                        help='run for this many seconds instead of --requests')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='requests sent before measuring')
+    parser.add_argument('--in-process', action='store_true',
+                        help='start the services in this process with stubbed LLMs')
+    parser.add_argument('--orchestrator-mode', choices=['sync', 'async'],
+                        default='sync', help='orchestrator served with --in-process')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='with --in-process, run the orchestrator in a child process '
+                             'under its production server with this many workers')
+    parser.add_argument('--llm-delay-ms', type=float, default=0.0,
+                        help='latency of the stubbed LLM calls')
+    parser.add_argument('--respond-async', action='store_true',
+                        help='ask for 202 Accepted, measuring acceptance instead of verification')
+    parser.add_argument('--output', help='also write the summary to this JSON file')
+    args = parser.parse_args()
+
+    if args.in_process:
+        args.url, servers = start_in_process(args)  # noqa: F841
+        # The services print a line per call, keep the report readable
+        sys.stdout = open(os.devnull, 'w')
+    payloads = load_payloads(args)
+
+    client = Client(args.url, args.respond_async)
+    for index in range(args.warmup):
+        client.post(payloads[index % len(payloads)])
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    if args.rps:
+        run_open_loop(args, payloads, recorder)
+    else:
+        run_closed_loop(args, payloads, recorder)
+    elapsed = time.perf_counter() - start
+    sys.stdout = sys.__stdout__
+    report(args, recorder, elapsed)
+
+
+if __name__ == '__main__':
+    main()
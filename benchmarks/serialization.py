@@ -0,0 +1,78 @@
+"""
+Cost of turning an approved checkout into its JSON body.
+
+Builds the response of an approved order with --books suggested books from
+suggestions.Book messages and encodes it, the way each RESPONSE_SERIALIZER
+of the orchestrator does (see orchestrator/src/serialization.py):
+MessageToDict and the json module, book_to_dict and the json module, and
+book_to_dict and orjson when it is installed.
+
+Usage:
+
+python benchmarks/serialization.py [--books 3] [--iterations 20000]
+"""
+import argparse
+import json
+import sys
+import os
+import time
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+grpc_path = os.path.abspath(os.path.join(FILE, '../../utils/pb'))
+sys.path.insert(0, grpc_path)
+orchestrator_path = os.path.abspath(os.path.join(FILE, '../../orchestrator/src'))
+sys.path.insert(0, orchestrator_path)
+import suggestions_pb2 as suggestions  # noqa
+import serialization  # noqa
+
+from google.protobuf.json_format import MessageToDict  # noqa
+
+
+def response(books, to_dict):
+    order_id = '9f1c2b7e4d8a4f0e8b6a3c5d7e9f1a2b'
+    return {
+        'orderId': order_id,
+        'status': 'Order Approved',
+        'suggestedBooks': [to_dict(book) for book in books],
+        'statusUrl': f'/orders/{order_id}',
+    }
+
+
+def stdlib_dumps(obj):
+    # What Flask's default JSON provider does in production
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def measure(to_dict, dumps, books, iterations):
+    body = dumps(response(books, to_dict))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        dumps(response(books, to_dict))
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed, elapsed / iterations * 1e6, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    books = [suggestions.Book(bookId=str(index), title=f'Book number {index}',
+                              author='Some Author') for index in range(args.books)]
+    modes = [('protobuf', MessageToDict, stdlib_dumps),
+             ('fields', serialization.book_to_dict, stdlib_dumps)]
+    if serialization.orjson is not None:
+        modes.append(('orjson', serialization.book_to_dict, serialization.orjson.dumps))
+    else:
+        print("orjson is not installed, skipping it")
+
+    print(f"Approved response with {args.books} books, {args.iterations} iterations")
+    print(f"{'serializer':<12}{'per s':>10}{'us':>8}{'bytes':>7}")
+    for name, to_dict, dumps in modes:
+        per_second, micros, size = measure(to_dict, dumps, books, args.iterations)
+        print(f"{name:<12}{per_second:>10.0f}{micros:>8.2f}{size:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Cost of validating a checkout body against utils/api/bookstore.yaml.
+
+Validates the orders of checkout_payloads.jsonl, and the same orders with
+one field broken each, three ways: by walking the schema of the
+specification for every order, with the validator that validation.py
+compiles from it once, and by building the init request of the order as
+the orchestrator did before, which only catches what protobuf rejects.
+
+Usage:
+
+python benchmarks/validation.py [--iterations 20000]
+"""
+import argparse
+import copy
+import json
+import sys
+import os
+import re
+import time
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+grpc_path = os.path.abspath(os.path.join(FILE, '../../utils/pb'))
+sys.path.insert(0, grpc_path)
+orchestrator_path = os.path.abspath(os.path.join(FILE, '../../orchestrator/src'))
+sys.path.insert(0, orchestrator_path)
+import common_pb2 as common  # noqa
+import validation  # noqa
+
+PAYLOADS = os.path.abspath(os.path.join(FILE, '../checkout_payloads.jsonl'))
+TYPES = {'object': dict, 'array': list, 'string': str, 'boolean': bool,
+         'integer': int, 'number': (int, float)}
+
+
+def interpreted(spec):
+    # Walks the schema for every document, as a generic validator does
+    def check(schema, value, path):
+        while '$ref' in schema:
+            ref, schema = schema['$ref'], spec
+            for part in ref[2:].split('/'):
+                schema = schema[part]
+        if value is None and schema.get('nullable'):
+            return None
+        kind = schema.get('type')
+        if kind and (not isinstance(value, TYPES[kind]) or (
+                kind in ('integer', 'number') and isinstance(value, bool))):
+            return f'{path}: expected {kind}'
+        if 'pattern' in schema and re.search(schema['pattern'], value) is None:
+            return f'{path}: does not match {schema["pattern"]}'
+        if 'minimum' in schema and value < schema['minimum']:
+            return f'{path}: less than {schema["minimum"]}'
+        if 'maximum' in schema and value > schema['maximum']:
+            return f'{path}: greater than {schema["maximum"]}'
+        for key in schema.get('required', ()):
+            if key not in value:
+                return f'{path}.{key}: required'
+        for key, subschema in schema.get('properties', {}).items():
+            if key in value:
+                error = check(subschema, value[key], f'{path}.{key}')
+                if error:
+                    return error
+        if schema.get('additionalProperties') is False:
+            for key in value:
+                if key not in schema.get('properties', {}):
+                    return f'{path}.{key}: unexpected property'
+        if 'items' in schema:
+            for index, item in enumerate(value):
+                error = check(schema['items'], item, f'{path}[{index}]')
+                if error:
+                    return error
+        return None
+
+    root = {'$ref': '#/components/schemas/CheckoutRequest'}
+    return lambda data: check(root, data, 'body')
+
+
+def protobuf_probe(data):
+    # The init request the orchestrator builds, it fails on missing fields
+    # and non-numeric CVVs but not on e.g. a negative quantity
+    try:
+        address = data['billingAddress']
+        common.AllInfoRequest(
+            name=data['user']['name'],
+            contact=data['user']['contact'],
+            credit_card_number=data['creditCard']['number'],
+            expiration_date=data['creditCard']['expirationDate'],
+            cvv=int(data['creditCard']['cvv']),
+            billing_address=f"{address['street']}, {address['zip']}, {address['city']}, {address['state']}, {address['country']}",
+            quantity=sum(item['quantity'] for item in data['items']),
+            items=data.get('items', []))
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        return repr(e)
+    return None
+
+
+def broken(orders):
+    # One invalid variant per order, cycling through the kinds of mistakes
+    mistakes = [
+        lambda o: o['creditCard'].update(cvv='12a'),
+        lambda o: o.update(items=[{'name': '1984 by George Orwell', 'quantity': -1}]),
+        lambda o: o['billingAddress'].pop('zip'),
+        lambda o: o['user'].update(name=None),
+    ]
+    result = []
+    for index, order in enumerate(orders):
+        order = copy.deepcopy(order)
+        mistakes[index % len(mistakes)](order)
+        result.append(order)
+    return result
+
+
+def measure(validate, orders, iterations):
+    rejected = sum(validate(order) is not None for order in orders)
+    start = time.perf_counter()
+    for index in range(iterations):
+        validate(orders[index % len(orders)])
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed, elapsed / iterations * 1e6, rejected / len(orders)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(PAYLOADS) as f:
+        valid = [json.loads(line) for line in f if line.strip()]
+    invalid = broken(valid)
+    spec = validation.load_spec()
+    start = time.perf_counter()
+    compiled = validation.compile_schema(spec, 'CheckoutRequest')
+    print(f"Compiled CheckoutRequest in {(time.perf_counter() - start) * 1000:.2f} ms, "
+          f"{len(valid)} orders, {args.iterations} validations per row")
+    print(f"{'validator':<12}{'orders':<9}{'per s':>11}{'us':>8}{'rejected':>10}")
+    for name, validate in (('interpreted', interpreted(spec)), ('compiled', compiled),
+                           ('protobuf', protobuf_probe)):
+        for kind, orders in (('valid', valid), ('invalid', invalid)):
+            per_second, micros, rejected = measure(validate, orders, args.iterations)
+            print(f"{name:<12}{kind:<9}{per_second:>11.0f}{micros:>8.2f}{rejected:>9.0%}")
+
+
+if __name__ == '__main__':
+    main()
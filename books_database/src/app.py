@@ -5,6 +5,8 @@ import threading
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
 sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
 
 import common_pb2 as common  # noqa
 import common_pb2_grpc as common_grpc  # noqa
@@ -13,6 +15,8 @@ import books_database_pb2_grpc as books_database_grpc  # noqa
 from concurrent import futures  # noqa
 import docker  # noqa
 import grpc  # noqa
+import channel_pool  # noqa
+import tracing  # noqa
 
 
 class BooksDatabase(books_database_grpc.BooksDatabaseServicer, common_grpc.TransactionService):
@@ -40,6 +44,11 @@ class BooksDatabase(books_database_grpc.BooksDatabaseServicer, common_grpc.Trans
         stock = self.store.get(request.title, 0)
         return books_database.ReadResponse(stock=stock)
 
+    def ReadBatch(self, request, context):
+        # Stock of several titles in one round-trip, unknown titles have none
+        return books_database.ReadBatchResponse(
+            stock={title: self.store.get(title, 0) for title in request.titles})
+
     def Write(self, request, context):
         lock = self._get_lock_for_book(request.title)
         with lock:
@@ -154,13 +163,15 @@ def serve():
     is_primary = os.getenv('IS_PRIMARY', '').upper() == 'TRUE'
 
     # Create a gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor())
+    server = grpc.server(
+        futures.ThreadPoolExecutor(),
+        interceptors=[tracing.server_interceptor('books_database')])
 
     if is_primary:
         backup_stubs = []
         for backup_id in get_backup_ids():
-            channel = grpc.insecure_channel(f'{backup_id}:50051')
-            stub = books_database_grpc.BooksDatabaseStub(channel)
+            stub = channel_pool.get_stub(
+                f'{backup_id}:50051', books_database_grpc.BooksDatabaseStub)
             backup_stubs.append(stub)
         service = PrimaryReplica(backup_stubs)
     else:
@@ -0,0 +1,101 @@
+"""
+Builds a blocklist file of fraud_detection/src/blocklist.py.
+
+Reads the entries of one kind, card numbers, e-mail domains (or addresses,
+of which the domain is kept) or billing addresses, one per line from the
+given files or stdin, normalizes them as the fraud service does, and writes
+their sorted salted hashes behind a Bloom filter sized for
+--false-positive-rate. The file is written next to the output and renamed
+over it, so a running fraud service picks up either the old list or the
+new one, never half of it.
+
+Usage:
+
+python fraud_detection/build_blocklist.py card cards.txt [--output fraud_detection/blocklists/card.blk] [--false-positive-rate 0.01]
+"""
+import argparse
+import math
+import sys
+import os
+import tempfile
+import time
+
+import numpy as np
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+utils_path = os.path.abspath(os.path.join(FILE, '../../utils/other'))
+sys.path.insert(0, utils_path)
+src_path = os.path.abspath(os.path.join(FILE, '../src'))
+sys.path.insert(0, src_path)
+import blocklist  # noqa
+
+
+def read_entries(paths):
+    for path in paths or ['-']:
+        f = sys.stdin if path == '-' else open(path)
+        with f:
+            yield from f
+
+
+def bloom_filter(hashes, false_positive_rate):
+    # (hash count, bits) for the entries, bits a multiple of 64 so that the
+    # hashes behind the filter stay 8-byte aligned
+    entries = max(len(hashes), 1)
+    bits = -entries * math.log(false_positive_rate) / math.log(2) ** 2
+    bits = max(64, math.ceil(bits / 64) * 64)
+    count = max(1, round(bits / entries * math.log(2)))
+    first = hashes & np.uint64(0xFFFFFFFF)
+    step = (hashes >> np.uint64(32)) | np.uint64(1)
+    flags = np.zeros(bits, dtype=bool)
+    for index in range(count):
+        flags[(first + np.uint64(index) * step) % np.uint64(bits)] = True
+    return count, bits, np.packbits(flags, bitorder='little').tobytes()
+
+
+def build(kind, entries, output, false_positive_rate=0.01, salt=None):
+    # Writes the blocklist, returns its number of distinct entries
+    salt = salt or os.urandom(16)
+    normalize, _ = blocklist.KINDS[kind]
+    keys = (normalize(entry) for entry in entries)
+    hashes = np.unique(np.fromiter(
+        (blocklist.key_hash(key, salt) for key in keys if key), dtype=np.uint64))
+    count, bits, bloom = bloom_filter(hashes, false_positive_rate)
+
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=f'.{kind}.', delete=False) as f:
+        try:
+            f.write(blocklist.HEADER.pack(
+                blocklist.MAGIC, blocklist.VERSION, count, len(hashes), bits, salt))
+            f.write(bloom)
+            f.write(hashes.astype('<u8').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, output)
+    return len(hashes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('kind', choices=sorted(blocklist.KINDS))
+    parser.add_argument('files', nargs='*', help="one entry per line, '-' or none for stdin")
+    parser.add_argument('--output', help='default fraud_detection/blocklists/<kind>.blk')
+    parser.add_argument('--false-positive-rate', type=float, default=0.01,
+                        help='of the Bloom filter, listed keys are confirmed in the hashes')
+    args = parser.parse_args()
+
+    output = args.output or os.path.abspath(
+        os.path.join(FILE, f'../blocklists/{args.kind}.blk'))
+    started = time.perf_counter()
+    entries = build(args.kind, read_entries(args.files), output, args.false_positive_rate)
+    size = os.path.getsize(output)
+    print(f"Wrote {entries} {args.kind} entries to {output}, {size / 2**20:.1f} MiB, "
+          f"in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
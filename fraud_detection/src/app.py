@@ -1,20 +1,73 @@
 import sys
 import os
+import threading
 
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
 sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
 import common_pb2 as common  # noqa
 import fraud_detection_pb2 as fraud_detection  # noqa
 import fraud_detection_pb2_grpc as fraud_detection_grpc  # noqa
-import re  # noqa
-from datetime import datetime  # noqa
 
 import grpc  # noqa
 
 from pydantic import BaseModel  # noqa
 from concurrent import futures  # noqa
 from pydantic_ai import Agent  # noqa
+from order_store import OrderStore  # noqa
+import metrics  # noqa
+import tracing  # noqa
+from rules import RuleEngine  # noqa
+from scoring import FraudModel, features  # noqa
+from batching import MicroBatcher  # noqa
+from velocity import VelocityTracker  # noqa
+from blocklist import BlocklistSet  # noqa
+
+# Do not start an LLM call when the caller's deadline leaves less than this
+LLM_MIN_BUDGET = float(os.getenv('LLM_MIN_BUDGET_MS', '200')) / 1000
+# Thresholds of CheckUserData and CheckCreditCard, see rules.py
+FRAUD_RULES_FILE = os.getenv('FRAUD_RULES_FILE', os.path.abspath(
+    os.path.join(FILE, '../rules.json')))
+# Blocked cards, e-mail domains and addresses, see blocklist.py and
+# build_blocklist.py; a list without a file blocks nothing
+BLOCKLIST_DIR = os.getenv('BLOCKLIST_DIR', os.path.abspath(
+    os.path.join(FILE, '../../blocklists')))
+# Prometheus metrics, empty to not serve them
+METRICS_PORT = os.getenv('METRICS_PORT', '8000')
+# Local fraud score, see scoring.py and train_model.py: orders scoring
+# below FRAUD_PASS_BELOW pass and above FRAUD_REJECT_ABOVE are rejected
+# without asking the LLM
+FRAUD_MODEL_FILE = os.getenv('FRAUD_MODEL_FILE', os.path.abspath(
+    os.path.join(FILE, '../fraud_model.json')))
+FRAUD_PASS_BELOW = float(os.getenv('FRAUD_PASS_BELOW', '0.1'))
+FRAUD_REJECT_ABOVE = float(os.getenv('FRAUD_REJECT_ABOVE', '0.9'))
+LLM_MODEL = os.getenv('PYDANTIC_AI_MODEL', 'openai:gpt-4o')
+LLM_SETTINGS = {
+    'max_tokens': 1000,
+    'temperature': 0.5,
+    'top_p': 1.0,
+    'frequency_penalty': 0.0,
+    'presence_penalty': 0.0,
+}
+
+# Concurrent SayFraud calls are scored together, up to FRAUD_BATCH_SIZE orders
+# or FRAUD_BATCH_WAIT_MS after the first one; the orders left for the LLM go
+# into one prompt per LLM_BATCH_SIZE orders or LLM_BATCH_WAIT_MS, with at most
+# LLM_BATCH_WORKERS prompts at a time. A size of 1 turns batching off
+FRAUD_BATCH_SIZE = int(os.getenv('FRAUD_BATCH_SIZE', '32'))
+FRAUD_BATCH_WAIT = float(os.getenv('FRAUD_BATCH_WAIT_MS', '2')) / 1000
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', '8'))
+LLM_BATCH_WAIT = float(os.getenv('LLM_BATCH_WAIT_MS', '50')) / 1000
+LLM_BATCH_WORKERS = int(os.getenv('LLM_BATCH_WORKERS', '8'))
+# gRPC worker threads, every order waiting for its batch holds one
+FRAUD_SERVER_WORKERS = int(os.getenv('FRAUD_SERVER_WORKERS', '64'))
+
+FRAUD_DECISIONS = metrics.counter(
+    'fraud_decisions_total', 'SayFraud answers, by who decided', ['decision'])
+VELOCITY_KEYS = metrics.gauge(
+    'fraud_velocity_keys', 'Cards, contacts and addresses with velocity counters')
 
 
 class FraudDetectionResponse(BaseModel):
@@ -22,16 +75,76 @@ class FraudDetectionResponse(BaseModel):
     message: str
 
 
+class FraudVerdict(BaseModel):
+    order: int
+    is_fraud: bool
+    message: str
+
+
+class FraudBatchResponse(BaseModel):
+    verdicts: list[FraudVerdict]
+
+
 class FraudService(fraud_detection_grpc.FraudServiceServicer):
-    def __init__(self, svc_idx=0, total_svcs=3):
+    def __init__(self, svc_idx=0, total_svcs=3, rules_file=FRAUD_RULES_FILE,
+                 blocklist_dir=BLOCKLIST_DIR, model_file=FRAUD_MODEL_FILE,
+                 batch_size=FRAUD_BATCH_SIZE, batch_wait=FRAUD_BATCH_WAIT,
+                 llm_batch_size=LLM_BATCH_SIZE, llm_batch_wait=LLM_BATCH_WAIT):
         self.svc_idx = svc_idx
         self.total_svcs = total_svcs
-        self.orders = {}
+        self.orders = OrderStore()  # orderId -> {data, vc, velocity}
+        self.blocklists = BlocklistSet(blocklist_dir)
+        self.rules = RuleEngine(rules_file, blocklists=self.blocklists)
+        self.velocity = VelocityTracker()
+        VELOCITY_KEYS.set_function(self.velocity.size)
+        self.model = None
+        if os.path.exists(model_file):
+            self.model = FraudModel.load(model_file)
+        else:
+            print(f"FraudService - No fraud model at {model_file}, asking the LLM about every order")
+        self._agents = {}  # output type -> Agent
+        self._agent_lock = threading.Lock()
+        self.scorer = MicroBatcher(
+            self.score_batch, batch_size, batch_wait, name='score')
+        self.llm = MicroBatcher(
+            self.ask_llm, llm_batch_size, llm_batch_wait,
+            workers=LLM_BATCH_WORKERS, name='llm')
+
+    def agent(self, output_type):
+        # One agent per answer type for all orders, created on first use
+        with self._agent_lock:
+            if output_type not in self._agents:
+                self._agents[output_type] = Agent(LLM_MODEL, output_type=output_type)
+            return self._agents[output_type]
+
+    def score_batch(self, orders):
+        return self.model.scores([features(data) for data in orders]).tolist()
+
+    def ask_llm(self, orders):
+        # One prompt for all orders, one FraudDetectionResponse per order
+        if len(orders) == 1:
+            result = self.agent(FraudDetectionResponse).run_sync(
+                f"Is this order a fraud? {orders[0]}.", model_settings=LLM_SETTINGS)
+            print("FraudService - Result: " + str(result))
+            return [result.output]
+        listing = "\n".join(f"Order {index}: {data}" for index, data in enumerate(orders))
+        result = self.agent(FraudBatchResponse).run_sync(
+            "Which of these orders are frauds? Give one verdict per order, "
+            f"with its number.\n{listing}", model_settings=LLM_SETTINGS)
+        print("FraudService - Result: " + str(result))
+        verdicts = {verdict.order: verdict for verdict in result.output.verdicts}
+        return [FraudDetectionResponse(is_fraud=verdicts[index].is_fraud,
+                                       message=verdicts[index].message)
+                if index in verdicts else LookupError(f"No verdict for order {index}")
+                for index in range(len(orders))]
 
     def InitVerification(self, request: common.InitAllInfoRequest, context=None):
         order_id = request.order_id
         data = request.request
-        self.orders[order_id] = {"data": data, "vc": [0]*self.total_svcs}
+        # Every order counts towards the velocity of its card, contact and
+        # address, whatever its outcome
+        self.orders.put(order_id, {"data": data, "vc": [0]*self.total_svcs,
+                                   "velocity": self.velocity.record(data)})
         return common.Empty()
 
     def merge_and_incrment(self, local_vc, incoming_vc=0):
@@ -42,101 +155,91 @@ class FraudService(fraud_detection_grpc.FraudServiceServicer):
     def CheckUserData(self, request: common.Request, context):
         order_id = request.order_id
         incoming_vc = request.vector_clock.clocks
-        entry = self.orders.get(order_id)
-        data = entry["data"]
-        self.merge_and_incrment(entry["vc"], incoming_vc)
-        fail = False
-        message = ""
-        items = data.items
-        totalAmount = sum([item.quantity for item in items])
-        if (len(items) >= 10):
-            fail = True
-            message = "Ordered too many different items"
-        elif (totalAmount >= 10):
-            fail = True
-            message = "Ordered too many items total"
-        else:
-            valid = re.match(
-                r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$',
-                data.contact)
-            if valid is False:
-                fail = True
-                message = "Contact should be valid"
-
+        with self.orders.locked_or_abort(order_id, context) as entry:
+            data = entry["data"]
+            velocity = entry["velocity"]
+            self.merge_and_incrment(entry["vc"], incoming_vc)
+            vc = list(entry["vc"])
+        message = self.rules.evaluate('user_data', data, velocity)
         response = common.Response(
-            message=message,
-            fail=fail,
-            vector_clock=common.VectorClock(clocks=entry["vc"]))
+            message=message or "",
+            fail=message is not None,
+            vector_clock=common.VectorClock(clocks=vc))
         return response
 
     def CheckCreditCard(self, request: common.Request, context):
         order_id = request.order_id
         incoming_vc = request.vector_clock.clocks
-        entry = self.orders.get(order_id)
-        data = entry["data"]
-        self.merge_and_incrment(entry["vc"], incoming_vc)
-        if (entry["vc"][2] < 3 or entry["vc"][0] < 3):
+        with self.orders.locked_or_abort(order_id, context) as entry:
+            data = entry["data"]
+            velocity = entry["velocity"]
+            self.merge_and_incrment(entry["vc"], incoming_vc)
+            vc = list(entry["vc"])
+        # Join of both branches: transaction verification must have done
+        # all three of its events (a, b, c) and we must have done d
+        if (vc[2] < 3 or vc[0] < 2):
             response = common.Response(
-                message="Early stop",
-                fail=False,
-                vector_clock=common.VectorClock(clocks=entry["vc"]))
+                message="Credit card checked before its preceding events",
+                fail=True,
+                vector_clock=common.VectorClock(clocks=vc))
             return response
-        fail = False
-        message = "User data is OK"
-        if len(str(data.cvv)) != 3:
-            message = "CVV is wrong"
-            fail = True
-        if len(str(data.credit_card_number)) != 16:
-            message = "Credit card number is wrong"
-            fail = True
-        month = int(data.expiration_date.split('/')[0])
-        year = int(data.expiration_date.split('/')[1])
-        current_month = datetime.now().month
-        current_year = (datetime.now().year) % 100
-        if current_year > year:
-            message = "Credit card has expired"
-            fail = True
-        if current_year == year and current_month > month:
-            message = "Credit card has expired"
-            fail = True
+        message = self.rules.evaluate('credit_card', data, velocity)
         response = common.Response(
-            message=message,
-            fail=fail,
-            vector_clock=common.VectorClock(clocks=entry["vc"]))
+            message=message or "User data is OK",
+            fail=message is not None,
+            vector_clock=common.VectorClock(clocks=vc))
         return response
 
     def SayFraud(self, request: common.Request, context):
         order_id = request.order_id
         incoming_vc = request.vector_clock.clocks
-        entry = self.orders[order_id]
-        data = entry["data"]
-        self.merge_and_incrment(entry["vc"], incoming_vc)
+        with self.orders.locked_or_abort(order_id, context) as entry:
+            data = entry["data"]
+            self.merge_and_incrment(entry["vc"], incoming_vc)
 
         response = fraud_detection.OrderResponse()
-        model = os.getenv('PYDANTIC_AI_MODEL', 'openai:gpt-4o')
-        agent = Agent(model, output_type=FraudDetectionResponse)
-        result = agent.run_sync(
-            f"Is this order a fraud? {data}.",
-            max_tokens=1000,
-            temperature=0.5,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-        )
-        print("FraudService - Result: " + str(result))
-        response.is_fraud = result.output.is_fraud
-        response.message = result.output.message
+        if self.model is not None:
+            score = self.scorer.submit(data)
+            if score < FRAUD_PASS_BELOW or score > FRAUD_REJECT_ABOVE:
+                decision = 'reject' if score > FRAUD_REJECT_ABOVE else 'pass'
+                FRAUD_DECISIONS.inc(decision=decision)
+                response.is_fraud = decision == 'reject'
+                response.message = f"Fraud score {score:.2f}"
+                return response
+
+        time_remaining = context.time_remaining()
+        if time_remaining is not None and time_remaining < LLM_MIN_BUDGET:
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED,
+                          "Not enough time left for the fraud model")
+
+        FRAUD_DECISIONS.inc(decision='llm')
+        try:
+            answer = self.llm.submit(data, timeout=context.time_remaining())
+        except futures.TimeoutError:
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED,
+                          "The fraud model did not answer in time")
+        except LookupError as e:
+            # The batch answer left this order out
+            context.abort(grpc.StatusCode.UNAVAILABLE,
+                          f"The fraud model gave no verdict: {e}")
+        response.is_fraud = answer.is_fraud
+        response.message = answer.message
         return response
 
 
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor())
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=FRAUD_SERVER_WORKERS),
+        interceptors=[tracing.server_interceptor('fraud_detection')])
     fraud_detection_grpc.add_FraudServiceServicer_to_server(
         FraudService(), server)
     port = "50051"
     server.add_insecure_port("[::]:" + port)
     server.start()
     print("Server started. Listening on port 50051.")
+    if METRICS_PORT:
+        metrics.serve(int(METRICS_PORT))
+        print(f"Metrics on port {METRICS_PORT}.")
     server.wait_for_termination()
 
 
@@ -0,0 +1,90 @@
+"""
+Micro-batching of concurrent requests.
+
+Each gRPC worker thread hands its item to a MicroBatcher and blocks. A
+collector thread takes the first waiting item, then keeps collecting until
+it has max_size items or max_wait has passed since the first one, and
+passes the whole batch to process(), which returns one result per item in
+the same order; a result that is an exception is raised to its submitter.
+While a batch is processed the next one is collected, on `workers` threads
+batches are also processed concurrently, which is what a slow process()
+such as an LLM call needs.
+
+A max_size of 1 turns batching off: submit() calls process() right away.
+
+Usage:
+
+    batcher = MicroBatcher(lambda rows: model.scores(rows), max_size=32, max_wait=0.002)
+    score = batcher.submit(row)
+"""
+import queue
+import threading
+import time
+from concurrent import futures
+
+import metrics
+
+BATCH_SIZE = metrics.histogram(
+    'fraud_batch_size', 'Items processed together, by batcher', ['batcher'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+class MicroBatcher:
+    def __init__(self, process, max_size, max_wait, workers=1, name='batch'):
+        self.process = process
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.name = name
+        self.queue = queue.SimpleQueue()
+        self.executor = None
+        if workers > 1:
+            self.executor = futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=name)
+        if max_size > 1:
+            threading.Thread(target=self._collect, name=f'{name}-collector',
+                             daemon=True).start()
+
+    def submit(self, item, timeout=None):
+        # Result of process() for the item, or its exception
+        if self.max_size <= 1:
+            BATCH_SIZE.observe(1, batcher=self.name)
+            result = self.process([item])[0]
+            if isinstance(result, Exception):
+                raise result
+            return result
+        future = futures.Future()
+        self.queue.put((item, future))
+        return future.result(timeout)
+
+    def _collect(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if self.executor is None:
+                self._run(batch)
+            else:
+                self.executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        BATCH_SIZE.observe(len(batch), batcher=self.name)
+        try:
+            results = list(self.process([item for item, _ in batch]))
+            if len(results) != len(batch):
+                raise ValueError(f"{len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,162 @@
+"""
+Memory-mapped blocklists of card numbers, e-mail domains and addresses.
+
+fraud_detection/build_blocklist.py turns a list of entries into one file
+per kind, BLOCKLIST_DIR/<kind>.blk:
+
+    header    magic, version, Bloom hash count, entries, Bloom bits, salt
+    bloom     Bloom filter over the entries, about 10 bits per entry
+    hashes    the salted 64-bit BLAKE2 hashes of the entries, sorted
+
+Opening a file maps it and reads the header, nothing else, so it takes the
+same time for ten entries or ten million, and replicas on one host share
+the pages. A lookup hashes the key, checks the Bloom filter, which settles
+most keys that are not listed, and otherwise bisects the hashes.
+
+A new file is dropped in with a rename (the builder does so), and picked
+up at most BLOCKLIST_RELOAD_MS later: the new map replaces the old one in
+one assignment, lookups in flight finish on the old one. Files must not be
+rewritten in place, the map in use would change under the lookups.
+
+Usage:
+
+    blocklists = BlocklistSet('blocklists')
+    blocklists.contains('card', data)  # data is a common.AllInfoRequest
+"""
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import metrics
+
+BLOCKLIST_RELOAD = float(os.getenv('BLOCKLIST_RELOAD_MS', '1000')) / 1000
+
+MAGIC = b'BLKLST01'
+HEADER = struct.Struct('<8sIIQQ16s')  # magic, version, hashes, entries, bloom bits, salt
+VERSION = 1
+
+BLOCKLIST_ENTRIES = metrics.gauge(
+    'fraud_blocklist_entries', 'Entries of the blocklist in use', ['list'])
+BLOCKLIST_RELOADS = metrics.counter(
+    'fraud_blocklist_reloads_total', 'Blocklist files opened, by outcome', ['list', 'outcome'])
+
+
+def _card(value):
+    return ''.join(c for c in value if c.isdigit())
+
+
+def _domain(value):
+    # Of an e-mail address or of a listed domain
+    return value.strip().lower().rsplit('@', 1)[-1]
+
+
+def _address(value):
+    return ' '.join(value.lower().replace(',', ' ').split())
+
+
+# kind -> (normalization of an entry, AllInfoRequest field it is checked against)
+KINDS = {
+    'card': (_card, 'credit_card_number'),
+    'domain': (_domain, 'contact'),
+    'address': (_address, 'billing_address'),
+}
+
+
+def key_hash(key, salt):
+    return int.from_bytes(hashlib.blake2b(
+        key.encode(), digest_size=8, salt=salt).digest(), 'little')
+
+
+class Blocklist:
+    # One mapped file, immutable once opened
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise ValueError("Blocklist files are little-endian")
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise ValueError(f"{path} is too short for a blocklist")
+        magic, version, self.hashes, self.entries, self.bits, self.salt = \
+            HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} blocklist")
+        bloom_end = HEADER.size + self.bits // 8
+        if len(self.map) != bloom_end + 8 * self.entries:
+            raise ValueError(f"{path} is truncated")
+        view = memoryview(self.map)
+        self.bloom = view[HEADER.size:bloom_end]
+        self.sorted_hashes = view[bloom_end:].cast('Q')
+
+    def __len__(self):
+        return self.entries
+
+    def __contains__(self, key):
+        value = key_hash(key, self.salt)
+        # Bit positions by double hashing of the one hash, as the builder sets them
+        position, step, bits, bloom = value & 0xFFFFFFFF, (value >> 32) | 1, self.bits, self.bloom
+        for _ in range(self.hashes):
+            position %= bits
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        index = bisect.bisect_left(self.sorted_hashes, value)
+        return index < self.entries and self.sorted_hashes[index] == value
+
+
+class BlocklistSet:
+    def __init__(self, directory, reload_interval=BLOCKLIST_RELOAD):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.lists = {}  # kind -> Blocklist
+        self._files = {}  # kind -> (inode, mtime, size) of the file in use
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+        self.reload()
+
+    def path(self, kind):
+        return os.path.join(self.directory, f'{kind}.blk')
+
+    def reload(self):
+        for kind in KINDS:
+            try:
+                stat = os.stat(self.path(kind))
+            except FileNotFoundError:
+                if self.lists.pop(kind, None) is not None:
+                    print(f"FraudService - Blocklist {kind} removed")
+                self._files.pop(kind, None)
+                BLOCKLIST_ENTRIES.set(0, list=kind)
+                continue
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if self._files.get(kind) == signature:
+                continue
+            self._files[kind] = signature
+            try:
+                blocklist = Blocklist(self.path(kind))
+            except (OSError, ValueError) as e:
+                BLOCKLIST_RELOADS.inc(list=kind, outcome='failed')
+                print(f"FraudService - Keeping the current {kind} blocklist: {e!r}")
+                continue
+            self.lists[kind] = blocklist
+            BLOCKLIST_RELOADS.inc(list=kind, outcome='ok')
+            BLOCKLIST_ENTRIES.set(len(blocklist), list=kind)
+            print(f"FraudService - Blocklist {kind}: {len(blocklist)} entries")
+
+    def contains(self, kind, data):
+        now = time.monotonic()
+        if now - self._checked >= self.reload_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked = now
+                self.reload()
+            finally:
+                self._lock.release()
+        blocklist = self.lists.get(kind)
+        if blocklist is None:
+            return False
+        normalize, field = KINDS[kind]
+        key = normalize(getattr(data, field))
+        return bool(key) and key in blocklist
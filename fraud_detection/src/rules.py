@@ -0,0 +1,185 @@
+"""
+Rule engine of the fraud checks.
+
+The rules of CheckUserData and CheckCreditCard live in a JSON file, by
+group, each naming one of the CHECKS below with its parameters and the
+message an order gets when it breaks the rule:
+
+    {"user_data": [{"name": "total_quantity", "check": "max_quantity",
+                    "max": 9, "message": "Ordered too many items total"}]}
+
+Rules may also bound the velocity of the order's card, contact or address
+(see velocity.py), e.g. "check": "max_velocity", "feature": "card.1m.count",
+and reject the cards, e-mail domains and addresses of a blocklist (see
+blocklist.py), e.g. "check": "not_blocklisted", "list": "domain".
+
+A file is compiled once into a flat list of predicates per group, patterns
+included, sorted cheapest first by the cost in CHECKS or a rule's own
+"cost", so the first broken rule ends an evaluation before the expensive
+ones run. The file is checked for changes at most every
+FRAUD_RULES_RELOAD_MS and a new version replaces the rules without a
+restart; one that does not compile is reported and the rules in use are
+kept.
+
+Usage:
+
+    engine = RuleEngine('rules.json')
+    message = engine.evaluate('user_data', data, velocity)  # None if no rule is broken
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+FRAUD_RULES_RELOAD = float(os.getenv('FRAUD_RULES_RELOAD_MS', '1000')) / 1000
+
+RULE_EVALUATIONS = metrics.counter(
+    'fraud_rule_evaluations_total', 'Times a fraud rule was evaluated', ['rule'])
+RULE_HITS = metrics.counter(
+    'fraud_rule_hits_total', 'Orders rejected by a fraud rule', ['rule'])
+RULE_SECONDS = metrics.counter(
+    'fraud_rule_seconds_total', 'Time spent evaluating a fraud rule', ['rule'])
+RULE_RELOADS = metrics.counter(
+    'fraud_rule_reloads_total', 'Rule files loaded, by outcome', ['outcome'])
+
+
+def _max_items(rule, blocklists):
+    limit = rule['max']
+    return lambda data, velocity: len(data.items) <= limit
+
+
+def _max_quantity(rule, blocklists):
+    limit = rule['max']
+    return lambda data, velocity: sum(item.quantity for item in data.items) <= limit
+
+
+def _length(rule, blocklists):
+    field, low, high = rule['field'], rule.get('min', 0), rule.get('max', float('inf'))
+    return lambda data, velocity: low <= len(str(getattr(data, field))) <= high
+
+
+def _pattern(rule, blocklists):
+    field, match = rule['field'], re.compile(rule['pattern']).match
+    return lambda data, velocity: match(getattr(data, field)) is not None
+
+
+def _not_expired(rule, blocklists):
+    # MM/YY, the card is valid until the end of its month
+    field = rule['field']
+
+    def check(data, velocity):
+        try:
+            month, year = (int(part) for part in getattr(data, field).split('/'))
+        except ValueError:
+            return False
+        now = datetime.now()
+        return (year, month) >= (now.year % 100, now.month)
+    return check
+
+
+def _max_velocity(rule, blocklists):
+    # One of the totals of velocity.py, e.g. "card.1m.count"
+    feature, limit = rule['feature'], rule['max']
+    return lambda data, velocity: velocity.get(feature, 0) <= limit
+
+
+def _not_blocklisted(rule, blocklists):
+    # One of the lists of blocklist.py: "card", "domain" or "address"
+    kind = rule['list']
+    if blocklists is None:
+        return lambda data, velocity: True
+    return lambda data, velocity: not blocklists.contains(kind, data)
+
+
+# check -> (compiler, relative cost)
+CHECKS = {
+    'max_velocity': (_max_velocity, 1),
+    'max_items': (_max_items, 1),
+    'length': (_length, 1),
+    'max_quantity': (_max_quantity, 2),
+    'not_expired': (_not_expired, 3),
+    'not_blocklisted': (_not_blocklisted, 3),
+    'pattern': (_pattern, 4),
+}
+
+
+def compile_rules(config, blocklists=None):
+    # {group: [(name, predicate, message)]}, cheapest rule first
+    groups = {}
+    for group, rules in config.items():
+        compiled = []
+        for rule in rules:
+            if rule['check'] not in CHECKS:
+                raise ValueError(f"Unknown check {rule['check']} of rule {rule['name']}")
+            compiler, cost = CHECKS[rule['check']]
+            compiled.append((rule.get('cost', cost), rule['name'],
+                             compiler(rule, blocklists), rule['message']))
+        compiled.sort(key=lambda rule: rule[0])  # stable, ties keep the file order
+        groups[group] = [(name, predicate, message)
+                         for _, name, predicate, message in compiled]
+    return groups
+
+
+class RuleEngine:
+    def __init__(self, path, reload_interval=FRAUD_RULES_RELOAD, blocklists=None):
+        # A rule file that does not load at start-up is an error
+        self.path = path
+        self.blocklists = blocklists
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+        self._mtime = os.stat(path).st_mtime_ns
+        self.groups = self._load()
+        RULE_RELOADS.inc(outcome='ok')
+
+    def _load(self):
+        with open(self.path) as f:
+            return compile_rules(json.load(f), self.blocklists)
+
+    def reload(self):
+        # Loads the file if it changed, True if the rules were replaced
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            print(f"FraudService - Keeping the current rules: {e!r}")
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            groups = self._load()
+        except (OSError, ValueError, KeyError, TypeError, re.error) as e:
+            RULE_RELOADS.inc(outcome='failed')
+            print(f"FraudService - Keeping the current rules, {self.path} failed to load: {e!r}")
+            return False
+        self.groups = groups
+        RULE_RELOADS.inc(outcome='ok')
+        print(f"FraudService - Loaded {sum(map(len, groups.values()))} rules from {self.path}")
+        return True
+
+    def rules(self, group):
+        now = time.monotonic()
+        if now - self._checked >= self.reload_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked = now
+                self.reload()
+            finally:
+                self._lock.release()
+        return self.groups.get(group, ())
+
+    def evaluate(self, group, data, velocity=None):
+        # Message of the first broken rule, None if the order passes all
+        velocity = velocity or {}
+        for name, predicate, message in self.rules(group):
+            started = time.perf_counter()
+            passed = predicate(data, velocity)
+            RULE_SECONDS.inc(time.perf_counter() - started, rule=name)
+            RULE_EVALUATIONS.inc(rule=name)
+            if not passed:
+                RULE_HITS.inc(rule=name)
+                return message
+        return None
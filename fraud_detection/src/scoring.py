@@ -0,0 +1,90 @@
+"""
+Local fraud score of an order.
+
+A logistic regression over numeric features of the AllInfoRequest, trained
+offline by fraud_detection/train_model.py and stored as JSON next to this
+file. Scoring an order is a feature extraction and one dot product, some
+microseconds instead of the seconds of an LLM call, so SayFraud only asks
+the LLM about orders whose score falls between FRAUD_PASS_BELOW and
+FRAUD_REJECT_ABOVE.
+
+Usage:
+
+    model = FraudModel.load('fraud_model.json')
+    score = model.score(data)  # probability that the order is a fraud
+    scores = model.scores([features(data) for data in orders])
+"""
+import json
+import math
+import re
+from datetime import datetime
+
+import numpy as np
+
+FEATURES = [
+    'distinct_items', 'total_quantity', 'max_quantity', 'years_to_expiry',
+    'far_expiry', 'invalid_contact', 'name_not_in_contact', 'contact_digits',
+    'name_digits', 'missing_address_parts', 'wrong_cvv_length',
+    'wrong_card_length',
+]
+MAX_LOGIT = 50.0  # math.exp overflows past about 709
+EMAIL = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+
+def _years_to_expiry(expiration_date, now):
+    try:
+        month, year = (int(part) for part in expiration_date.split('/'))
+    except ValueError:
+        return -1.0
+    return ((2000 + year - now.year) * 12 + month - now.month) / 12
+
+
+def features(data, now=None):
+    # Feature vector of a common.AllInfoRequest, in the order of FEATURES
+    now = now or datetime.now()
+    quantities = [item.quantity for item in data.items] or [0]
+    contact = data.contact.lower()
+    local_part = contact.split('@', 1)[0]
+    names = [part for part in re.split(r'\W+', data.name.lower()) if len(part) > 1]
+    years = min(max(_years_to_expiry(data.expiration_date, now), -1.0), 10.0)
+    return [
+        len(data.items),
+        math.log1p(sum(quantities)),
+        math.log1p(max(quantities)),
+        years,
+        float(years > 6),
+        float(EMAIL.match(data.contact) is None),
+        1 - sum(name in local_part for name in names) / len(names) if names else 1.0,
+        sum(c.isdigit() for c in local_part) / max(len(local_part), 1),
+        float(any(c.isdigit() for c in data.name)),
+        sum(not part.strip() for part in data.billing_address.split(',')),
+        float(len(str(data.cvv)) != 3),
+        float(len(data.credit_card_number) != 16),
+    ]
+
+
+class FraudModel:
+    def __init__(self, weights, bias, mean, scale, features=FEATURES):
+        if list(features) != FEATURES:
+            raise ValueError(f"Model was trained on other features: {features}")
+        # Standardization folded into the weights: (x - mean) / scale . w + b
+        weights = np.asarray(weights, dtype=np.float64)
+        scale = np.asarray(scale, dtype=np.float64)
+        self.weights = weights / scale
+        self.bias = float(bias) - float(np.dot(np.asarray(mean), self.weights))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            model = json.load(f)
+        return cls(model['weights'], model['bias'], model['mean'], model['scale'],
+                   model['features'])
+
+    def scores(self, rows):
+        # Fraud probability of each feature vector
+        z = np.asarray(rows, dtype=np.float64) @ self.weights + self.bias
+        return 1 / (1 + np.exp(-np.clip(z, -MAX_LOGIT, MAX_LOGIT)))
+
+    def score(self, data):
+        z = float(np.dot(features(data), self.weights)) + self.bias
+        return 1 / (1 + math.exp(-min(max(z, -MAX_LOGIT), MAX_LOGIT)))
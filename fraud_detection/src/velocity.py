@@ -0,0 +1,147 @@
+"""
+Sliding-window velocity of cards, contacts and billing addresses.
+
+For every credit card number, contact e-mail and billing address seen, the
+number of orders and of copies ordered (orders carry no prices) over the
+last minute, hour and day. Each window is a ring of VELOCITY_BUCKETS
+buckets with a running total, so recording and reading are O(1): moving
+to a new bucket subtracts the buckets that fell out of the window. A
+window covers its length give or take one bucket.
+
+Keys are salted 64-bit BLAKE2 hashes, no card number is kept, and every
+key takes one flat array of doubles. At most VELOCITY_MAX_KEYS keys are
+kept per dimension, the least recently seen one is dropped first.
+
+Usage:
+
+    tracker = VelocityTracker()
+    velocity = tracker.record(data)  # counts this order too
+    velocity['card.1m.count'], velocity['address.24h.copies']
+"""
+import hashlib
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+VELOCITY_BUCKETS = int(os.getenv('VELOCITY_BUCKETS', '6'))
+VELOCITY_MAX_KEYS = int(os.getenv('VELOCITY_MAX_KEYS', '100000'))
+# Keys only need to be stable for the life of the process
+VELOCITY_KEY_SALT = os.getenv('VELOCITY_KEY_SALT', '').encode() or os.urandom(16)
+
+WINDOWS = (('1m', 60), ('1h', 3600), ('24h', 86400))
+
+
+def _address(data):
+    return ' '.join(data.billing_address.lower().replace(',', ' ').split())
+
+
+DIMENSIONS = {
+    'card': lambda data: data.credit_card_number.replace(' ', ''),
+    'contact': lambda data: data.contact.strip().lower(),
+    'address': _address,
+}
+
+
+class SlidingCounter:
+    # Per key and window, laid out in one array: the index of the newest
+    # bucket, the count and amount totals, then the counts and the amounts
+    # of the buckets
+    def __init__(self, windows=WINDOWS, buckets=VELOCITY_BUCKETS,
+                 max_keys=VELOCITY_MAX_KEYS, salt=VELOCITY_KEY_SALT):
+        self.widths = [seconds / buckets for _, seconds in windows]
+        self.buckets = buckets
+        self.stride = 3 + 2 * buckets
+        self.max_keys = max_keys
+        self.salt = salt[:hashlib.blake2b.SALT_SIZE]
+        self._keys = OrderedDict()  # hash -> array, least recently seen first
+        self._lock = threading.Lock()
+
+    def hash(self, key):
+        return int.from_bytes(hashlib.blake2b(
+            key.encode(), digest_size=8, salt=self.salt).digest(), 'little')
+
+    def _advance(self, slots, window, now):
+        # Empties the buckets that left the window since the last update
+        base = window * self.stride
+        newest = int(now // self.widths[window])
+        last = int(slots[base])
+        if newest == last:
+            return
+        buckets = self.buckets
+        if newest - last >= buckets:
+            slots[base + 1:base + self.stride] = array('d', bytes(8 * (self.stride - 1)))
+        else:
+            for index in range(last + 1, newest + 1):
+                bucket = index % buckets
+                count = base + 3 + bucket
+                slots[base + 1] -= slots[count]
+                slots[base + 2] -= slots[count + buckets]
+                slots[count] = slots[count + buckets] = 0.0
+        slots[base] = newest
+
+    def add(self, key, amount, now=None):
+        # Records one event of the given amount, returns the (count, amount)
+        # totals of every window including it
+        now = time.monotonic() if now is None else now
+        digest = self.hash(key)
+        with self._lock:
+            slots = self._keys.get(digest)
+            if slots is None:
+                slots = self._keys[digest] = array('d', bytes(8 * self.stride * len(self.widths)))
+                for window, width in enumerate(self.widths):
+                    slots[window * self.stride] = now // width
+                if len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+            else:
+                self._keys.move_to_end(digest)
+            totals = []
+            for window, width in enumerate(self.widths):
+                self._advance(slots, window, now)
+                base = window * self.stride
+                bucket = base + 3 + int(now // width) % self.buckets
+                slots[bucket] += 1
+                slots[bucket + self.buckets] += amount
+                slots[base + 1] += 1
+                slots[base + 2] += amount
+                totals.append((int(slots[base + 1]), slots[base + 2]))
+            return totals
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            slots = self._keys.get(self.hash(key))
+            if slots is None:
+                return [(0, 0.0)] * len(self.widths)
+            totals = []
+            for window in range(len(self.widths)):
+                self._advance(slots, window, now)
+                base = window * self.stride
+                totals.append((int(slots[base + 1]), slots[base + 2]))
+            return totals
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class VelocityTracker:
+    def __init__(self, **kwargs):
+        self.counters = {dimension: SlidingCounter(**kwargs) for dimension in DIMENSIONS}
+
+    def record(self, data, now=None):
+        # Counts the order and returns {'<dimension>.<window>.count|copies': total}
+        now = time.monotonic() if now is None else now
+        copies = sum(item.quantity for item in data.items)
+        velocity = {}
+        for dimension, key_of in DIMENSIONS.items():
+            key = key_of(data)
+            totals = (self.counters[dimension].add(key, copies, now) if key
+                      else [(0, 0.0)] * len(WINDOWS))
+            for (window, _), (count, amount) in zip(WINDOWS, totals):
+                velocity[f'{dimension}.{window}.count'] = count
+                velocity[f'{dimension}.{window}.copies'] = amount
+        return velocity
+
+    def size(self):
+        return sum(len(counter) for counter in self.counters.values())
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent import futures
+
+import pytest
+
+from batching import MicroBatcher
+
+
+class Recorder:
+    # process() of a MicroBatcher that doubles its items and remembers the batches
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            self.batches.append(list(items))
+        time.sleep(self.delay)
+        return [item * 2 for item in items]
+
+
+def submit_all(batcher, items, **kwargs):
+    with futures.ThreadPoolExecutor(max_workers=len(items)) as executor:
+        return list(executor.map(lambda item: batcher.submit(item, **kwargs), items))
+
+
+def test_size_one_calls_process_right_away():
+    process = Recorder()
+    batcher = MicroBatcher(process, max_size=1, max_wait=10)
+    assert batcher.submit(3) == 6
+    assert process.batches == [[3]]
+
+
+def test_concurrent_items_share_a_batch():
+    process = Recorder()
+    batcher = MicroBatcher(process, max_size=8, max_wait=0.5)
+    assert submit_all(batcher, list(range(8))) == [item * 2 for item in range(8)]
+    assert len(process.batches) == 1
+    assert sorted(process.batches[0]) == list(range(8))
+
+
+def test_batches_stop_at_max_size():
+    process = Recorder()
+    batcher = MicroBatcher(process, max_size=4, max_wait=0.5)
+    assert submit_all(batcher, list(range(10))) == [item * 2 for item in range(10)]
+    assert max(len(batch) for batch in process.batches) == 4
+    assert sorted(item for batch in process.batches for item in batch) == list(range(10))
+
+
+def test_lone_item_waits_at_most_max_wait():
+    batcher = MicroBatcher(Recorder(), max_size=32, max_wait=0.05)
+    started = time.monotonic()
+    assert batcher.submit(1) == 2
+    assert time.monotonic() - started < 1
+
+
+def test_exception_result_is_raised_to_its_submitter_only():
+    def process(items):
+        return [LookupError(item) if item == 'lost' else item for item in items]
+
+    batcher = MicroBatcher(process, max_size=3, max_wait=0.5)
+    with futures.ThreadPoolExecutor(max_workers=3) as executor:
+        results = {item: executor.submit(batcher.submit, item)
+                   for item in ('a', 'lost', 'b')}
+    assert results['a'].result() == 'a'
+    assert results['b'].result() == 'b'
+    with pytest.raises(LookupError):
+        results['lost'].result()
+
+
+def test_failed_batch_fails_every_item():
+    def process(items):
+        raise RuntimeError('model down')
+
+    batcher = MicroBatcher(process, max_size=4, max_wait=0.01)
+    with pytest.raises(RuntimeError, match='model down'):
+        batcher.submit(1)
+
+
+def test_wrong_number_of_results_fails_the_batch():
+    batcher = MicroBatcher(lambda items: items[:-1], max_size=4, max_wait=0.01)
+    with pytest.raises(ValueError, match='results for'):
+        batcher.submit(1)
+
+
+def test_submit_times_out():
+    batcher = MicroBatcher(Recorder(delay=0.5), max_size=4, max_wait=0.01)
+    with pytest.raises(futures.TimeoutError):
+        batcher.submit(1, timeout=0.05)
+
+
+def test_workers_process_batches_concurrently():
+    process = Recorder(delay=0.3)
+    batcher = MicroBatcher(process, max_size=2, max_wait=0.01, workers=4)
+    started = time.monotonic()
+    assert submit_all(batcher, list(range(8))) == [item * 2 for item in range(8)]
+    # Four batches of 0.3 s one after the other would take 1.2 s
+    assert time.monotonic() - started < 1.0
@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+import pytest
+
+import common_pb2 as common
+import build_blocklist
+from blocklist import Blocklist, BlocklistSet
+
+CARDS = ['4111 1111 1111 1111', '5500-0000-0000-0004', '4111111111111111', '']
+
+
+def order(card='4000000000000002', contact='jane@example.com',
+          address='Main 1, 10115, Berlin'):
+    return common.AllInfoRequest(
+        name='Jane', contact=contact, credit_card_number=card,
+        expiration_date='12/99', cvv=123, billing_address=address,
+        items=[common.Item(name='Book', quantity=1)])
+
+
+def test_build_counts_distinct_normalized_entries(tmp_path):
+    path = tmp_path / 'card.blk'
+    assert build_blocklist.build('card', CARDS, str(path)) == 2
+    blocklist = Blocklist(str(path))
+    assert len(blocklist) == 2
+    assert '4111111111111111' in blocklist
+    assert '5500000000000004' in blocklist
+    assert '4000000000000002' not in blocklist
+
+
+def test_build_replaces_the_output(tmp_path):
+    path = tmp_path / 'domain.blk'
+    build_blocklist.build('domain', ['spam.example'], str(path))
+    build_blocklist.build('domain', ['fraud.example'], str(path))
+    blocklist = Blocklist(str(path))
+    assert 'fraud.example' in blocklist
+    assert 'spam.example' not in blocklist
+    assert os.listdir(tmp_path) == ['domain.blk']
+
+
+def test_lookups_are_exact(tmp_path):
+    # The Bloom filter lets about 1% of the other keys through, the hashes
+    # behind it turn them away
+    path = tmp_path / 'card.blk'
+    listed = [f'4{index:015d}' for index in range(0, 20000, 2)]
+    build_blocklist.build('card', listed, str(path), false_positive_rate=0.01)
+    blocklist = Blocklist(str(path))
+    assert all(card in blocklist for card in listed)
+    assert not any(f'4{index:015d}' in blocklist for index in range(1, 20000, 2))
+
+
+def test_bloom_filter_is_sized_for_its_rate():
+    hashes = np.arange(1, 10001, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    count, bits, _ = build_blocklist.bloom_filter(hashes, 0.01)
+    assert bits % 64 == 0
+    assert 9 * 10000 <= bits <= 10 * 10000
+    assert count == 7
+
+
+def test_empty_list_blocks_nothing(tmp_path):
+    path = tmp_path / 'address.blk'
+    assert build_blocklist.build('address', [], str(path)) == 0
+    assert 'main 1 10115 berlin' not in Blocklist(str(path))
+
+
+@pytest.mark.parametrize('content', [b'', b'BLKLST01', b'NOTALIST' + bytes(40)])
+def test_broken_files_are_rejected(tmp_path, content):
+    path = tmp_path / 'card.blk'
+    path.write_bytes(content)
+    with pytest.raises(ValueError):
+        Blocklist(str(path))
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    path = tmp_path / 'card.blk'
+    build_blocklist.build('card', CARDS, str(path))
+    path.write_bytes(path.read_bytes()[:-8])
+    with pytest.raises(ValueError, match='truncated'):
+        Blocklist(str(path))
+
+
+def test_set_checks_the_fields_of_an_order(tmp_path):
+    build_blocklist.build('card', CARDS, str(tmp_path / 'card.blk'))
+    build_blocklist.build('domain', ['fraud@Spam.example'], str(tmp_path / 'domain.blk'))
+    build_blocklist.build('address', ['Main 1 10115 Berlin'], str(tmp_path / 'address.blk'))
+    blocklists = BlocklistSet(str(tmp_path), reload_interval=3600)
+    assert blocklists.contains('card', order(card='4111-1111-1111-1111'))
+    assert not blocklists.contains('card', order())
+    assert blocklists.contains('domain', order(contact='someone@spam.EXAMPLE'))
+    assert not blocklists.contains('domain', order())
+    assert blocklists.contains('address', order())
+    assert not blocklists.contains('address', order(address='Elm 2, 10115, Berlin'))
+
+
+def test_set_without_files_blocks_nothing(tmp_path):
+    blocklists = BlocklistSet(str(tmp_path / 'missing'))
+    assert not blocklists.contains('card', order())
+    assert blocklists.lists == {}
+
+
+def test_set_picks_up_new_and_removed_files(tmp_path):
+    blocklists = BlocklistSet(str(tmp_path), reload_interval=0)
+    assert not blocklists.contains('card', order())
+    build_blocklist.build('card', ['4000000000000002'], str(tmp_path / 'card.blk'))
+    assert blocklists.contains('card', order())
+    build_blocklist.build('card', CARDS, str(tmp_path / 'card.blk'))
+    assert not blocklists.contains('card', order())
+    os.unlink(tmp_path / 'card.blk')
+    assert not blocklists.contains('card', order(card='4111111111111111'))
+    assert 'card' not in blocklists.lists
+
+
+def test_set_keeps_the_list_in_use_when_a_new_file_is_broken(tmp_path):
+    path = tmp_path / 'card.blk'
+    build_blocklist.build('card', CARDS, str(path))
+    blocklists = BlocklistSet(str(tmp_path), reload_interval=3600)
+    broken = tmp_path / 'broken'
+    broken.write_bytes(b'NOTALIST')
+    os.replace(broken, path)
+    blocklists.reload()
+    assert blocklists.contains('card', order(card='4111111111111111'))
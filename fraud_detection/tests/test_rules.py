@@ -0,0 +1,142 @@
+import json
+import os
+import re
+
+import pytest
+
+import common_pb2 as common
+from rules import RuleEngine, compile_rules
+
+RULES_FILE = os.path.abspath(os.path.join(__file__, '../../src/rules.json'))
+
+QUANTITY_RULE = {"name": "total_quantity", "check": "max_quantity", "max": 9,
+                 "message": "Ordered too many items total"}
+CONTACT_RULE = {"name": "contact_email", "check": "pattern", "field": "contact",
+                "pattern": "^[^@]+@[^@]+$", "message": "Contact should be valid"}
+ITEMS_RULE = {"name": "distinct_items", "check": "max_items", "max": 2,
+              "message": "Ordered too many different items"}
+
+
+def order(quantity=1, contact='jane@example.com', items=1):
+    return common.AllInfoRequest(
+        name='Jane', contact=contact, credit_card_number='4111111111111111',
+        expiration_date='12/99', cvv=123, billing_address='Main 1, 10115, Berlin',
+        items=[common.Item(name=f'Book {index}', quantity=quantity)
+               for index in range(items)])
+
+
+def write_rules(path, rules, mtime=None):
+    with open(path, 'w') as f:
+        json.dump(rules, f)
+    if mtime is not None:
+        # Changes within one timestamp tick would look unchanged
+        os.utime(path, ns=(mtime, mtime))
+
+
+def names(groups, group):
+    return [name for name, _, _ in groups[group]]
+
+
+def test_shipped_rules_compile():
+    with open(RULES_FILE) as f:
+        groups = compile_rules(json.load(f))
+    assert set(groups) == {'user_data', 'credit_card'}
+
+
+def test_compile_rules_sorts_cheapest_first():
+    groups = compile_rules({'user_data': [CONTACT_RULE, QUANTITY_RULE, ITEMS_RULE]})
+    assert names(groups, 'user_data') == ['distinct_items', 'total_quantity', 'contact_email']
+
+
+def test_compile_rules_keeps_file_order_of_ties_and_own_costs():
+    expensive_items = dict(ITEMS_RULE, cost=10)
+    groups = compile_rules({'user_data': [expensive_items, QUANTITY_RULE, CONTACT_RULE]})
+    assert names(groups, 'user_data') == ['total_quantity', 'contact_email', 'distinct_items']
+
+
+def test_compile_rules_rejects_unknown_checks():
+    with pytest.raises(ValueError, match='Unknown check'):
+        compile_rules({'user_data': [dict(QUANTITY_RULE, check='max_price')]})
+
+
+def test_compile_rules_rejects_bad_patterns():
+    with pytest.raises(re.error):
+        compile_rules({'user_data': [dict(CONTACT_RULE, pattern='(')]})
+
+
+def test_blocklist_rule_without_blocklists_passes():
+    groups = compile_rules({'user_data': [
+        {"name": "blocked_domain", "check": "not_blocklisted", "list": "domain",
+         "message": "E-mail domain is blocked"}]})
+    _, predicate, _ = groups['user_data'][0]
+    assert predicate(order(), {})
+
+
+def test_evaluate_returns_first_broken_rule(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {'user_data': [CONTACT_RULE, QUANTITY_RULE]})
+    engine = RuleEngine(str(path))
+    assert engine.evaluate('user_data', order()) is None
+    assert engine.evaluate('user_data', order(quantity=10)) == 'Ordered too many items total'
+    assert engine.evaluate('user_data', order(contact='nobody')) == 'Contact should be valid'
+    # Both broken, the cheaper quantity rule runs first
+    assert engine.evaluate('user_data', order(quantity=10, contact='nobody')) == \
+        'Ordered too many items total'
+    assert engine.evaluate('credit_card', order(quantity=10)) is None
+
+
+def test_evaluate_velocity_rule(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {'credit_card': [
+        {"name": "card_orders_per_minute", "check": "max_velocity",
+         "feature": "card.1m.count", "max": 5,
+         "message": "Credit card used too many times in a minute"}]})
+    engine = RuleEngine(str(path))
+    assert engine.evaluate('credit_card', order()) is None
+    assert engine.evaluate('credit_card', order(), {'card.1m.count': 5}) is None
+    assert engine.evaluate('credit_card', order(), {'card.1m.count': 6}) == \
+        'Credit card used too many times in a minute'
+
+
+def test_reload_replaces_changed_rules(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {'user_data': [QUANTITY_RULE]}, mtime=1_000_000_000)
+    engine = RuleEngine(str(path), reload_interval=3600)
+    assert not engine.reload()
+
+    write_rules(path, {'user_data': [dict(QUANTITY_RULE, max=20)]}, mtime=2_000_000_000)
+    assert engine.evaluate('user_data', order(quantity=10)) is not None  # not checked yet
+    assert engine.reload()
+    assert engine.evaluate('user_data', order(quantity=10)) is None
+    assert not engine.reload()
+
+
+def test_rules_are_reloaded_after_the_interval(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {'user_data': [QUANTITY_RULE]}, mtime=1_000_000_000)
+    engine = RuleEngine(str(path), reload_interval=0)
+    write_rules(path, {'user_data': [dict(QUANTITY_RULE, max=20)]}, mtime=2_000_000_000)
+    assert engine.evaluate('user_data', order(quantity=10)) is None
+
+
+def test_reload_keeps_rules_that_fail_to_load(tmp_path):
+    path = tmp_path / 'rules.json'
+    write_rules(path, {'user_data': [QUANTITY_RULE]}, mtime=1_000_000_000)
+    engine = RuleEngine(str(path), reload_interval=3600)
+
+    path.write_text('{"user_data": [')
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    assert not engine.reload()
+    write_rules(path, {'user_data': [dict(QUANTITY_RULE, check='max_price')]},
+                mtime=3_000_000_000)
+    assert not engine.reload()
+    path.unlink()
+    assert not engine.reload()
+    assert engine.evaluate('user_data', order(quantity=10)) == 'Ordered too many items total'
+
+
+def test_rule_file_must_load_at_start(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text('not json')
+    with pytest.raises(ValueError):
+        RuleEngine(str(path))
@@ -0,0 +1,82 @@
+import common_pb2 as common
+from velocity import SlidingCounter, VelocityTracker
+
+MINUTE = (('1m', 60),)
+
+
+def order(card='4111 1111 1111 1111', contact='Jane@Example.com',
+          address='Main 1, 10115, Berlin', quantity=2):
+    return common.AllInfoRequest(
+        name='Jane', contact=contact, credit_card_number=card,
+        expiration_date='12/99', cvv=123, billing_address=address,
+        items=[common.Item(name='Book', quantity=quantity)])
+
+
+def test_counts_and_amounts_within_the_window():
+    counter = SlidingCounter(windows=MINUTE, buckets=6, salt=b'test')
+    assert counter.add('card', 2, now=1000) == [(1, 2.0)]
+    assert counter.add('card', 3, now=1030) == [(2, 5.0)]
+    assert counter.get('card', now=1059) == [(2, 5.0)]
+    assert counter.get('other', now=1059) == [(0, 0.0)]
+
+
+def test_buckets_leave_the_window_one_by_one():
+    # 10 second buckets
+    counter = SlidingCounter(windows=MINUTE, buckets=6, salt=b'test')
+    counter.add('card', 1, now=1000)
+    counter.add('card', 1, now=1025)
+    counter.add('card', 1, now=1045)
+    assert counter.get('card', now=1055) == [(3, 3.0)]
+    assert counter.get('card', now=1060) == [(2, 2.0)]
+    assert counter.get('card', now=1075) == [(2, 2.0)]
+    assert counter.get('card', now=1080) == [(1, 1.0)]
+    assert counter.get('card', now=1100) == [(0, 0.0)]
+
+
+def test_idle_key_starts_over():
+    counter = SlidingCounter(windows=MINUTE, buckets=6, salt=b'test')
+    counter.add('card', 5, now=1000)
+    counter.add('card', 5, now=1010)
+    assert counter.add('card', 1, now=5000) == [(1, 1.0)]
+
+
+def test_windows_are_counted_separately():
+    counter = SlidingCounter(windows=(('1m', 60), ('1h', 3600)), buckets=6, salt=b'test')
+    counter.add('card', 1, now=1000)
+    counter.add('card', 1, now=1200)
+    assert counter.get('card', now=1200) == [(1, 1.0), (2, 2.0)]
+
+
+def test_least_recently_seen_key_is_dropped():
+    counter = SlidingCounter(windows=MINUTE, max_keys=2, salt=b'test')
+    counter.add('a', 1, now=1000)
+    counter.add('b', 1, now=1000)
+    counter.add('a', 1, now=1001)
+    counter.add('c', 1, now=1002)
+    assert len(counter) == 2
+    assert counter.get('a', now=1003) == [(2, 2.0)]
+    assert counter.get('b', now=1003) == [(0, 0.0)]
+
+
+def test_keys_are_hashed_with_the_salt():
+    assert SlidingCounter(salt=b'one').hash('card') != SlidingCounter(salt=b'two').hash('card')
+
+
+def test_tracker_normalizes_card_contact_and_address():
+    tracker = VelocityTracker(salt=b'test')
+    tracker.record(order(), now=1000)
+    velocity = tracker.record(order(
+        card='4111111111111111', contact=' jane@example.com',
+        address='main 1 10115  berlin', quantity=3), now=1001)
+    for dimension in ('card', 'contact', 'address'):
+        assert velocity[f'{dimension}.1m.count'] == 2
+        assert velocity[f'{dimension}.24h.copies'] == 5
+    assert tracker.size() == 3
+
+
+def test_tracker_skips_empty_keys():
+    tracker = VelocityTracker(salt=b'test')
+    velocity = tracker.record(order(contact=''), now=1000)
+    assert velocity['contact.1m.count'] == 0
+    assert velocity['card.1m.count'] == 1
+    assert tracker.size() == 2
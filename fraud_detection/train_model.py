@@ -0,0 +1,217 @@
+"""
+Trains the local fraud model of fraud_detection/src/scoring.py.
+
+Fits a logistic regression by Newton's method on labelled orders, 80 % of
+them, and reports on the other 20 %: accuracy and ROC AUC of the score,
+how many orders each band of SayFraud takes (auto-pass below --pass-below,
+auto-reject above --reject-above, LLM in between) and how often the
+automatic decisions are wrong, and the time to score one order and a batch.
+
+Labelled orders are checkout request bodies, one JSON object per line with
+an extra boolean "isFraud". Without --data, a synthetic set is generated:
+ordinary orders like those of benchmarks/loadgen.py and frauds that show
+some of the usual signals (many copies, names that do not match the e-mail,
+random-looking contacts, cards far from expiry, missing address parts),
+with label noise so that the classes overlap.
+
+Usage:
+
+python fraud_detection/train_model.py [--data orders.jsonl] [--samples 20000] [--output fraud_detection/src/fraud_model.json]
+"""
+import argparse
+import json
+import random
+import string
+import sys
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+grpc_path = os.path.abspath(os.path.join(FILE, '../../utils/pb'))
+sys.path.insert(0, grpc_path)
+src_path = os.path.abspath(os.path.join(FILE, '../src'))
+sys.path.insert(0, src_path)
+import common_pb2 as common  # noqa
+import scoring  # noqa
+
+FIRST_NAMES = ['Alex', 'Maria', 'John', 'Jane', 'Ali', 'Sara', 'Liis', 'Mart']
+LAST_NAMES = ['Smith', 'Doe', 'Aliyev', 'Garcia', 'Kim', 'Novak', 'Tamm', 'Saar']
+BOOKS = ['1984 by George Orwell', 'Dune by Frank Herbert', 'Neuromancer by William Gibson',
+         'The Hobbit by J.R.R. Tolkien', 'Foundation by Isaac Asimov',
+         'Brave New World by Aldous Huxley', 'Snow Crash by Neal Stephenson']
+
+
+def to_request(order):
+    # The AllInfoRequest the orchestrator builds from a checkout body
+    address = order['billingAddress']
+    return common.AllInfoRequest(
+        name=order['user']['name'],
+        contact=order['user']['contact'],
+        credit_card_number=order['creditCard']['number'],
+        expiration_date=order['creditCard']['expirationDate'],
+        cvv=int(order['creditCard']['cvv']),
+        billing_address=f"{address['street']}, {address['zip']}, {address['city']}, {address['state']}, {address['country']}",
+        quantity=sum(item['quantity'] for item in order['items']),
+        items=order['items'])
+
+
+def synthetic_order(rng, fraud, now):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    contact = f'{first.lower()}.{last.lower()}@example.com'
+    years = rng.randint(1, 5)
+    items = [{'name': name, 'quantity': rng.randint(1, 2)}
+             for name in rng.sample(BOOKS, rng.randint(1, 3))]
+    address = {'street': f'{rng.randint(1, 200)} Main St', 'city': 'Tartu',
+               'state': 'Tartumaa', 'zip': f'{rng.randint(10000, 99999)}',
+               'country': 'Estonia'}
+    if fraud:
+        if rng.random() < 0.5:
+            contact = f'{rng.choice(LAST_NAMES).lower()}{rng.randint(1, 9999)}@example.com'
+        if rng.random() < 0.3:
+            contact = ''.join(rng.choice(string.ascii_lowercase + string.digits)
+                              for _ in range(10)) + '@mail.example'
+        if rng.random() < 0.4:
+            items = [{'name': name, 'quantity': rng.randint(3, 9)}
+                     for name in rng.sample(BOOKS, rng.randint(1, 4))]
+        if rng.random() < 0.3:
+            years = rng.randint(7, 9)
+        if rng.random() < 0.2:
+            address[rng.choice(sorted(address))] = ''
+        if rng.random() < 0.1:
+            contact = contact.replace('@', ' at ')
+    elif rng.random() < 0.1:
+        # Ordinary customers with an unrelated e-mail address or a bulk order
+        contact = f'{rng.choice(FIRST_NAMES).lower()}{rng.randint(1, 99)}@example.com'
+    elif rng.random() < 0.05:
+        items = [{'name': rng.choice(BOOKS), 'quantity': rng.randint(3, 6)}]
+    return {
+        'user': {'name': f'{first} {last}', 'contact': contact},
+        'creditCard': {
+            'number': ''.join(rng.choice(string.digits) for _ in range(16)),
+            'expirationDate': f'{rng.randint(1, 12):02d}/{(now.year + years) % 100:02d}',
+            'cvv': str(rng.randint(100, 999)),
+        },
+        'items': items,
+        'billingAddress': address,
+    }
+
+
+def synthetic_set(samples, fraud_ratio, label_noise, seed):
+    rng = random.Random(seed)
+    now = datetime.now()
+    orders, labels = [], []
+    for _ in range(samples):
+        fraud = rng.random() < fraud_ratio
+        orders.append(to_request(synthetic_order(rng, fraud, now)))
+        labels.append(fraud != (rng.random() < label_noise))
+    return orders, labels
+
+
+def load_set(path):
+    orders, labels = [], []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                order = json.loads(line)
+                labels.append(bool(order.pop('isFraud')))
+                orders.append(to_request(order))
+    return orders, labels
+
+
+def fit(x, y, l2=1e-3, iterations=25):
+    # Logistic regression on standardized features, Newton's method with
+    # an L2 penalty that keeps the weights finite on separable features
+    mean, scale = x.mean(axis=0), x.std(axis=0)
+    scale[scale == 0] = 1.0
+    z = np.hstack([(x - mean) / scale, np.ones((len(x), 1))])
+    w = np.zeros(z.shape[1])
+    penalty = np.eye(z.shape[1]) * l2 * len(x)
+    penalty[-1, -1] = 0  # No penalty on the bias
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-np.clip(z @ w, -scoring.MAX_LOGIT, scoring.MAX_LOGIT)))
+        gradient = z.T @ (p - y) + penalty @ w
+        hessian = (z * (p * (1 - p))[:, None]).T @ z + penalty
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return {'features': scoring.FEATURES, 'weights': w[:-1].tolist(), 'bias': float(w[-1]),
+            'mean': mean.tolist(), 'scale': scale.tolist()}
+
+
+def roc_auc(scores, labels):
+    # Probability that a fraud scores higher than an ordinary order
+    order = np.argsort(scores, kind='mergesort')
+    ranks = np.empty(len(scores))
+    ranks[order] = np.arange(1, len(scores) + 1)
+    positives = labels.sum()
+    negatives = len(labels) - positives
+    return (ranks[labels].sum() - positives * (positives + 1) / 2) / (positives * negatives)
+
+
+def report(model, orders, labels, args):
+    rows = np.array([scoring.features(order) for order in orders])
+    scores = model.scores(rows)
+    labels = np.asarray(labels)
+    passed = scores < args.pass_below
+    rejected = scores > args.reject_above
+    escalated = ~(passed | rejected)
+    print(f"Test set: {len(labels)} orders, {labels.mean():.1%} frauds")
+    print(f"accuracy at 0.5        {((scores > 0.5) == labels).mean():.3f}")
+    print(f"ROC AUC                {roc_auc(scores, labels):.3f}")
+    print(f"auto-pass  (< {args.pass_below})  {passed.mean():6.1%} of orders, "
+          f"{labels[passed].mean() if passed.any() else 0:.1%} of them frauds")
+    print(f"auto-reject (> {args.reject_above}) {rejected.mean():6.1%} of orders, "
+          f"{1 - labels[rejected].mean() if rejected.any() else 0:.1%} of them ordinary")
+    print(f"LLM                    {escalated.mean():6.1%} of orders")
+
+    iterations = 2000
+    start = time.perf_counter()
+    for index in range(iterations):
+        model.score(orders[index % len(orders)])
+    single = (time.perf_counter() - start) / iterations * 1e6
+    batch = rows[:64]
+    start = time.perf_counter()
+    for _ in range(iterations):
+        model.scores(batch)
+    batched = (time.perf_counter() - start) / iterations * 1e6 / len(batch)
+    print(f"score one order        {single:.1f} us (features included)")
+    print(f"score a batch of 64    {batched:.2f} us per order (features excluded)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data', help='labelled orders, JSON lines with isFraud')
+    parser.add_argument('--samples', type=int, default=20000,
+                        help='size of the synthetic set without --data')
+    parser.add_argument('--fraud-ratio', type=float, default=0.1)
+    parser.add_argument('--label-noise', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--pass-below', type=float, default=0.1)
+    parser.add_argument('--reject-above', type=float, default=0.9)
+    parser.add_argument('--output', default=os.path.join(src_path, 'fraud_model.json'))
+    args = parser.parse_args()
+
+    if args.data:
+        orders, labels = load_set(args.data)
+    else:
+        orders, labels = synthetic_set(
+            args.samples, args.fraud_ratio, args.label_noise, args.seed)
+    split = len(orders) * 4 // 5
+    x = np.array([scoring.features(order) for order in orders[:split]])
+    parameters = fit(x, np.asarray(labels[:split], dtype=np.float64))
+    model = scoring.FraudModel(parameters['weights'], parameters['bias'],
+                               parameters['mean'], parameters['scale'])
+    report(model, orders[split:], labels[split:], args)
+
+    with open(args.output, 'w') as f:
+        json.dump(parameters, f, indent=2)
+        f.write('\n')
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
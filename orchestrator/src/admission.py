@@ -0,0 +1,139 @@
+"""
+Admission control in front of the checkout pipeline.
+
+At most `limit` orders are verified at the same time. A few more may wait
+for a free slot for a short while; anything beyond that is turned away at
+once (429 with Retry-After) instead of piling up threads and requests behind
+slow downstream services.
+
+With ADMISSION_ADAPTIVE=true the limit follows the observed checkout latency
+(additive increase, multiplicative decrease): it shrinks by a tenth when
+checkouts take much longer than the best recent latency or end in a
+downstream timeout, and grows back by about one slot per round of checkouts
+while they are fast.
+"""
+import asyncio
+import collections
+import os
+import threading
+import time
+
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '64'))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '32'))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT_MS', '200')) / 1000
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER_SECONDS', '1'))
+ADMISSION_ADAPTIVE = os.getenv('ADMISSION_ADAPTIVE', 'false').lower() == 'true'
+ADMISSION_MIN_LIMIT = int(os.getenv('ADMISSION_MIN_LIMIT', '4'))
+# Adaptive limit: a checkout slower than this many times the baseline latency
+# counts as overload, and the baseline forgets old minimums at this rate
+LATENCY_TOLERANCE = 2.0
+BASELINE_DECAY = 0.01
+BACKOFF = 0.9
+
+
+class OverloadedError(Exception):
+    # No slot became free in time, answer 429
+    pass
+
+
+class _Waiter:
+    __slots__ = ('wake', 'admitted')
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.admitted = False
+
+
+class Limiter:
+    def __init__(self, limit=ADMISSION_MAX_IN_FLIGHT, queue_size=ADMISSION_QUEUE_SIZE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, adaptive=ADMISSION_ADAPTIVE,
+                 min_limit=ADMISSION_MIN_LIMIT):
+        self.limit = limit
+        self.in_flight = 0
+        self._max_limit = limit
+        self._min_limit = min(min_limit, limit)
+        self._limit = float(limit)  # fractional while it grows additively
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self._adaptive = adaptive
+        self._baseline = None  # Best recent checkout latency (seconds)
+        self._backed_off_at = 0.0
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _enter(self, wake):
+        # True when admitted, a _Waiter when queued, False when rejected
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                return True
+            if len(self._waiters) >= self._queue_size:
+                return False
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _give_up(self, waiter):
+        # Timed out in the queue, unless a slot was handed over meanwhile
+        with self._lock:
+            if waiter.admitted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def acquire(self):
+        event = threading.Event()
+        entered = self._enter(event.set)
+        if not isinstance(entered, _Waiter):
+            return entered
+        return event.wait(self._queue_timeout) or self._give_up(entered)
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        entered = self._enter(lambda: loop.call_soon_threadsafe(
+            lambda: ready.done() or ready.set_result(True)))
+        if not isinstance(entered, _Waiter):
+            return entered
+        try:
+            return await asyncio.wait_for(ready, self._queue_timeout)
+        except asyncio.TimeoutError:
+            return self._give_up(entered)
+        except asyncio.CancelledError:
+            # The client went away while queued, its slot if any goes to the next
+            if self._give_up(entered):
+                self.release()
+            raise
+
+    def release(self, latency=None, overloaded=False):
+        # latency of the finished checkout, overloaded if it hit a timeout
+        with self._lock:
+            self.in_flight -= 1
+            if self._adaptive and latency is not None:
+                self._adapt(latency, overloaded)
+            while self._waiters and self.in_flight < self.limit:
+                waiter = self._waiters.popleft()
+                waiter.admitted = True
+                self.in_flight += 1
+                waiter.wake()
+
+    def _adapt(self, latency, overloaded):
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        else:
+            self._baseline += (latency - self._baseline) * BASELINE_DECAY
+        if overloaded or latency > self._baseline * LATENCY_TOLERANCE:
+            # At most once per round, the checkouts of this round saw the
+            # same overload
+            now = time.monotonic()
+            if now - self._backed_off_at >= latency:
+                self._backed_off_at = now
+                self._limit = max(self._min_limit, self._limit * BACKOFF)
+        elif self.in_flight + 1 >= self.limit // 2:
+            # Only grow while the current limit is actually being used
+            self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+        self.limit = int(self._limit)
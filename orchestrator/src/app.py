@@ -1,14 +1,18 @@
-import threading
+import contextvars
 import json
+import time
 import uuid
+from concurrent import futures
 from flask_cors import CORS
-from flask import Flask, request
+from flask import Flask, Response, request
 import sys
 import os
 
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
 sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
 import common_pb2 as common  # noqa
 import fraud_detection_pb2 as fraud_detection  # noqa
 import fraud_detection_pb2_grpc as fraud_detection_grpc  # noqa
@@ -22,75 +26,88 @@ import books_database_pb2 as books_database  # noqa
 import books_database_pb2_grpc as books_database_grpc  # noqa
 
 import grpc  # noqa
-from google.protobuf.json_format import MessageToDict  # noqa
+import channel_pool  # noqa
+import circuit_breaker  # noqa
+from order_store import OrderStore  # noqa
+from event_dag import Deadline  # noqa
+import suggestion_results  # noqa
+from idempotency import InProgressError, KeyReusedError  # noqa
+import admission  # noqa
+import stock  # noqa
+import serialization  # noqa
+import metrics  # noqa
+import tracing  # noqa
+from checkout_common import (  # noqa
+    FRAUD_DETECTION_ADDR, TRANSACTION_VERIFICATION_ADDR, SUGGESTIONS_ADDR,
+    ORDER_QUEUE_ADDR, CHECKOUT_DEADLINE, ENQUEUE_MIN_TIMEOUT, SUGGESTIONS_MODE,
+    SUGGESTIONS_BACKGROUND_DEADLINE, SUGGESTIONS_MAX_WAIT, CHECKOUT_JOB_WORKERS,
+    ORDER_STATUS_TIMEOUT, BATCH_CONCURRENCY, BATCH_ENQUEUE_SIZE,
+    BATCH_ENQUEUE_TIMEOUT, ORDERS_IN_FLIGHT, ADMISSION_REJECTED, ACCEPTED_STATUS,
+    FailException, BatchOrder, accepted, admission_limiter, annotate_span,
+    approved, batch_line, build_checkout_graph, build_init_requests,
+    checkout_jobs, idempotency_cache, invalid_batch_order, invalid_order,
+    is_final, observe_call, observed, order_status, parse_batch, parse_order,
+    rejected, rejection_reason, respond_async, stock_cache,
+    suggestions_or_rejection)
 
 
 def check_fraud(order_id) -> fraud_detection.OrderResponse:
-    # Establish a connection with the fraud-detection gRPC service.
-    with grpc.insecure_channel('fraud_detection:50051') as channel:
-        # Create a stub object.
-        stub = fraud_detection_grpc.FraudServiceStub(channel)
-        # Call the service through the stub object.
-        vector_clock = common.VectorClock(clocks=[0, 0, 0])
-        request = common.Request(order_id=order_id, vector_clock=vector_clock)
-        response = stub.SayFraud(request)
-    return response
+    # Reuse the pooled connection to the fraud-detection gRPC service.
+    stub = channel_pool.get_stub(
+        FRAUD_DETECTION_ADDR, fraud_detection_grpc.FraudServiceStub)
+    # Call the service through the stub object.
+    vector_clock = common.VectorClock(clocks=[0, 0, 0])
+    request = common.Request(order_id=order_id, vector_clock=vector_clock)
+    return stub.SayFraud(request)
 
 
 def initTransaction(order_id, request_data):
-    with grpc.insecure_channel('transaction_verification:50051') as channel:
-        # Create a stub object.
-        stub = transaction_verification_grpc.VerificationServiceStub(channel)
-        # Call the service through the stub object.
-        billing_address = request_data['billingAddress']
-        billing_address = f"{billing_address['street']}, {billing_address['zip']}, {billing_address['city']}, {billing_address['state']}, {billing_address['country']}"
-        request = transaction_verification.TransactionRequest(
-            name=request_data['user']['name'],
-            contact=request_data['user']['contact'],
-            credit_card_number=request_data['creditCard']['number'],
-            expiration_date=request_data['creditCard']['expirationDate'],
-            cvv=int(request_data['creditCard']['cvv']),
-            billing_address=billing_address,
-            quantity=sum(item['quantity'] for item in request_data['items']),
-            items=request_data.get('items', [])
-        )
-        request = transaction_verification.InitRequest(
-            order_id=order_id, transaction_request=request)
-        response = stub.initVerification(request)
-    return response
+    stub = channel_pool.get_stub(
+        TRANSACTION_VERIFICATION_ADDR,
+        transaction_verification_grpc.VerificationServiceStub)
+    # Call the service through the stub object.
+    billing_address = request_data['billingAddress']
+    billing_address = f"{billing_address['street']}, {billing_address['zip']}, {billing_address['city']}, {billing_address['state']}, {billing_address['country']}"
+    request = transaction_verification.TransactionRequest(
+        name=request_data['user']['name'],
+        contact=request_data['user']['contact'],
+        credit_card_number=request_data['creditCard']['number'],
+        expiration_date=request_data['creditCard']['expirationDate'],
+        cvv=int(request_data['creditCard']['cvv']),
+        billing_address=billing_address,
+        quantity=sum(item['quantity'] for item in request_data['items']),
+        items=request_data.get('items', [])
+    )
+    request = transaction_verification.InitRequest(
+        order_id=order_id, transaction_request=request)
+    return stub.initVerification(request)
 
 
 def initFraudVerification(order_id, request_data):
-    with grpc.insecure_channel('fraud_detection:50051') as channel:
-        # Create a stub object.
-        stub = fraud_detection_grpc.FraudServiceStub(channel)
-        # Call the service through the stub object.
-        request = common.ItemsInitRequest(
-            order_id=order_id, items=request_data.get('items', []))
-        response = stub.InitVerification(request)
-    return response
+    stub = channel_pool.get_stub(
+        FRAUD_DETECTION_ADDR, fraud_detection_grpc.FraudServiceStub)
+    # Call the service through the stub object.
+    request = common.ItemsInitRequest(
+        order_id=order_id, items=request_data.get('items', []))
+    return stub.InitVerification(request)
 
 
 def get_suggestion(order_id) -> suggestions.Suggestions:
-    with grpc.insecure_channel('suggestions:50051') as channel:
-        # Create a stub object.
-        stub = suggestions_grpc.SuggestionServiceStub(channel)
-        # Call the service through the stub object.
-        vector_clock = common.VectorClock(clocks=[0, 0, 0])
-        request = common.Request(order_id=order_id, vector_clock=vector_clock)
-        response = stub.SaySuggest(request)
-    return response
+    stub = channel_pool.get_stub(
+        SUGGESTIONS_ADDR, suggestions_grpc.SuggestionServiceStub)
+    # Call the service through the stub object.
+    vector_clock = common.VectorClock(clocks=[0, 0, 0])
+    request = common.Request(order_id=order_id, vector_clock=vector_clock)
+    return stub.SaySuggest(request)
 
 
 def init_suggestion(order_id, request_data):
-    with grpc.insecure_channel('suggestions:50051') as channel:
-        # Create a stub object.
-        stub = suggestions_grpc.SuggestionServiceStub(channel)
-        # Call the service through the stub object.
-        request = common.ItemsInitRequest(
-            order_id=order_id, items=request_data.get('items', []))
-        response = stub.initSuggestion(request)
-    return response
+    stub = channel_pool.get_stub(
+        SUGGESTIONS_ADDR, suggestions_grpc.SuggestionServiceStub)
+    # Call the service through the stub object.
+    request = common.ItemsInitRequest(
+        order_id=order_id, items=request_data.get('items', []))
+    return stub.initSuggestion(request)
 
 
 # Import Flask.
@@ -100,196 +117,516 @@ def init_suggestion(order_id, request_data):
 
 # Create a simple Flask app.
 app = Flask(__name__)
-# Disable sorting of keys in JSON responses
-app.json.sort_keys = False
+# JSON responses without sorting of keys, see serialization.py
+app.json = serialization.JSONProvider(app)
 # Enable CORS for the app.
 CORS(app, resources={r'/*': {'origins': '*'}})
 
-vectorClocks = dict()  # order_id -> vector_clock
+# order_id -> vector_clock, per process: a checkout never leaves the worker
+# that accepted it
+vectorClocks = OrderStore()
 
 
 def comibine_vector_clock(order_id, new_clock):
-    vectorClocks[order_id] = [max(old, new) for old, new in zip(
-        vectorClocks[order_id], new_clock.clocks)]
-
-
-def event_a(
-        order_id,
-        transaction_stub: transaction_verification_grpc.VerificationServiceStub,
-        fraud_detection_stub: fraud_detection_grpc.FraudServiceStub,
-        suggestions_stub: suggestions_grpc.SuggestionServiceStub):
-    resp = transaction_stub.BookListNotEmtpy(common.Request(
-        order_id=order_id,
-        vector_clock=common.VectorClock(clocks=vectorClocks[order_id])))
+    # Both event threads merge into the same clock, so hold the order's lock
+    with vectorClocks.locked(order_id) as clock:
+        clock[:] = [max(old, new) for old, new in zip(clock, new_clock.clocks)]
+
+
+def current_vector_clock(order_id):
+    with vectorClocks.locked(order_id) as clock:
+        return common.VectorClock(clocks=clock)
+
+
+def check_response(order_id, resp):
     if resp.fail:
         raise FailException(resp.message)
     comibine_vector_clock(order_id, resp.vector_clock)
-    event_c(order_id, transaction_stub, fraud_detection_stub, suggestions_stub)
 
 
-def event_b(
-        order_id,
-        transaction_stub: transaction_verification_grpc.VerificationServiceStub,
-        fraud_detection_stub: fraud_detection_grpc.FraudServiceStub,
-        suggestions_stub: suggestions_grpc.SuggestionServiceStub):
+def current_request(order_id):
+    return common.Request(
+        order_id=order_id, vector_clock=current_vector_clock(order_id))
+
+
+def observed_future(call, method, request, timeout=None):
+    start = time.perf_counter()
+    future = method.future(request, timeout=timeout)
+    future.add_done_callback(lambda done: observe_call(
+        call, time.perf_counter() - start, done.exception()))
+    return future
+
+
+# Every event gets the same arguments:
+# (order_id, transaction_stub, fraud_detection_stub, suggestions_stub)
+# and the gRPC timeout the event DAG granted it out of the checkout deadline
+def event_a(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+            timeout=None):
+    # transaction-verification service checks that the book list is not empty.
+    resp = transaction_stub.BookListNotEmtpy(
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
+
+
+def event_b(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+            timeout=None):
+    # transaction-verification service checks that the user data is filled in.
     resp = transaction_stub.UserDataVerification(
-        common.Request(
-            order_id=order_id,
-            vector_clock=common.VectorClock(clocks=vectorClocks[order_id])))
-    if resp.fail:
-        raise FailException(resp.message)
-    comibine_vector_clock(order_id, resp.vector_clock)
-    event_d(order_id, fraud_detection_stub, suggestions_stub)
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
 
 
-def event_c(
-        order_id,
-        transaction_stub: transaction_verification_grpc.VerificationServiceStub,
-        fraud_detection_stub: fraud_detection_grpc.FraudServiceStub,
-        suggestions_stub: suggestions_grpc.SuggestionServiceStub):
+def event_c(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+            timeout=None):
+    # transaction-verification service checks the credit card format.
     resp = transaction_stub.CreditCardVerification(
-        common.Request(
-            order_id=order_id,
-            vector_clock=common.VectorClock(clocks=vectorClocks[order_id])))
-    if resp.fail:
-        raise FailException(resp.message)
-    comibine_vector_clock(order_id, resp.vector_clock)
-    event_e(order_id, fraud_detection_stub, suggestions_stub)
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
 
 
-def event_d(
-        order_id,
-        fraud_detection_stub: fraud_detection_grpc.FraudServiceStub,
-        suggestions_stub: suggestions_grpc.SuggestionServiceStub):
+def event_d(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+            timeout=None):
+    # fraud-detection service checks the user data for fraud.
     resp = fraud_detection_stub.CheckUserData(
-        common.Request(
-            order_id=order_id,
-            vector_clock=common.VectorClock(clocks=vectorClocks[order_id])))
-    if resp.fail:
-        raise FailException(resp.message)
-    comibine_vector_clock(order_id, resp.vector_clock)
-    event_e(order_id, fraud_detection_stub, suggestions_stub)
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
 
 
-def event_e(order_id,
-            fraud_detection_stub: fraud_detection_grpc.FraudServiceStub,
-            suggestions_stub: suggestions_grpc.SuggestionServiceStub):
+def event_e(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+            timeout=None):
     # fraud-detection service checks the credit card data for fraud.
     resp = fraud_detection_stub.CheckCreditCard(
-        common.Request(
-            order_id=order_id,
-            vector_clock=common.VectorClock(clocks=vectorClocks[order_id])))
-    if resp.fail:
-        raise FailException(resp.message)
-    if resp.message == "Early stop":
-        return
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
+
+
+def event_f(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+            timeout=None):
+    # suggestions service returns the suggested books.
+    try:
+        resp = suggestions_stub.SaySuggest(
+            current_request(order_id), timeout=timeout)
+    except circuit_breaker.OpenCircuitError:
+        # Suggestions are down, the order is approved without them
+        return []
     comibine_vector_clock(order_id, resp.vector_clock)
-    event_f(order_id, suggestions_stub)
+    return resp.books
+
+
+def event_g(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+            timeout=None):
+    # fraud-detection service scores the order, asking the LLM when unsure.
+    resp = fraud_detection_stub.SayFraud(
+        current_request(order_id), timeout=timeout)
+    if resp.is_fraud:
+        raise FailException(f"Suspected fraud: {resp.message}")
+
+
+checkout_events = build_checkout_graph({
+    'event_a': event_a, 'event_b': event_b, 'event_c': event_c,
+    'event_d': event_d, 'event_e': event_e, 'event_f': event_f,
+    'event_g': event_g,
+})
+# Used in background suggestions mode, approval only waits for these
+verification_events = checkout_events.without('event_f')
+
+batch_executor = futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv('BATCH_WORKERS', '64')),
+    thread_name_prefix='batch')
+suggestions_executor = futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv('SUGGESTIONS_WORKERS', '16')),
+    thread_name_prefix='suggestions')
+
+
+def background_suggestions_request(order_id):
+    # Snapshot of the clock after event_e, the request outlives the checkout
+    return common.Request(
+        order_id=order_id, vector_clock=current_vector_clock(order_id))
+
+
+def init_orders(general_request, suggestions_request, fraud_detection_stub,
+                transaction_verification_stub, suggestions_stub, timeout=None):
+    # Fan the three init calls out at once, so init costs one round-trip
+    init_futures = [
+        observed_future('init_fraud_detection', fraud_detection_stub.InitVerification,
+                        general_request, timeout=timeout),
+        observed_future('init_transaction_verification',
+                        transaction_verification_stub.initVerification,
+                        general_request, timeout=timeout),
+        observed_future('init_suggestions', suggestions_stub.initSuggestion,
+                        suggestions_request, timeout=timeout),
+    ]
+    for future in init_futures[:2]:
+        future.result()
+    try:
+        init_futures[2].result()
+    except circuit_breaker.OpenCircuitError:
+        pass  # event_f approves without suggestions while the circuit is open
+
+
+def check_stock(request_data):
+    # Rejection message if the order clearly cannot be fulfilled
+    copies = stock.wanted(request_data.get('items', []))
+    levels, lookup = stock_cache.cached(copies)
+    if lookup is not None:
+        try:
+            with observed('stock_check'):
+                stock_cache.store(stock_cache.client.call(
+                    lookup, timeout=stock.STOCK_TIMEOUT), levels)
+        except grpc.RpcError:
+            # Left to the two-phase commit of the order executor
+            stock.STOCK_LOOKUPS.inc(len(lookup.titles), source='failed')
+    return stock.shortage(copies, levels)
+
+
+def verify_order(order_id, request_data, deadline, suggestions_mode=SUGGESTIONS_MODE):
+    # Init and event DAG of one order. Returns (suggested_books,
+    # suggestions_request, error); in background suggestions mode the books
+    # are None and suggestions_request is what to ask for them afterwards
+    vectorClocks.put(order_id, [0, 0, 0])
+    try:
+        return run_verification(order_id, request_data, deadline, suggestions_mode)
+    finally:
+        annotate_span(order_id, vectorClocks.pop(order_id))
+
+
+def run_verification(order_id, request_data, deadline, suggestions_mode):
+    if stock.STOCK_CHECK:
+        # Before any verification or LLM work is spent on the order
+        out_of_stock = check_stock(request_data)
+        if out_of_stock is not None:
+            return None, None, FailException(out_of_stock)
+    # Channels are long-lived and shared between requests, see channel_pool
+    fraud_detection_stub = channel_pool.get_stub(
+        FRAUD_DETECTION_ADDR, fraud_detection_grpc.FraudServiceStub)
+    transaction_verification_stub = channel_pool.get_stub(
+        TRANSACTION_VERIFICATION_ADDR,
+        transaction_verification_grpc.VerificationServiceStub)
+    suggestions_stub = channel_pool.get_stub(
+        SUGGESTIONS_ADDR, suggestions_grpc.SuggestionServiceStub)
+    # Initing everything
+    general_request, suggestions_request = build_init_requests(
+        order_id, request_data)
+    try:
+        init_orders(general_request, suggestions_request, fraud_detection_stub,
+                    transaction_verification_stub, suggestions_stub,
+                    timeout=deadline.remaining())
+    except grpc.RpcError as e:
+        return None, None, e
+
+    background = suggestions_mode == 'background'
+    events = verification_events if background else checkout_events
+    result = events.run(
+        order_id, transaction_verification_stub, fraud_detection_stub,
+        suggestions_stub, deadline=deadline)
+    if background:
+        if not result.ok:
+            return None, None, result.error
+        return None, background_suggestions_request(order_id), None
+    suggested_books, error = suggestions_or_rejection(result)
+    return suggested_books, None, error
+
+
+def approve(order_id, suggested_books, suggestions_request):
+    # Called once the order is enqueued
+    if suggestions_request is not None:
+        suggest_in_background(
+            order_id, suggestions_request,
+            channel_pool.get_stub(
+                SUGGESTIONS_ADDR, suggestions_grpc.SuggestionServiceStub))
+    return approved(order_id, suggested_books)
 
 
-def event_f(order_id,
-            suggestions_stub: suggestions_grpc.SuggestionServiceStub):
-    resp = suggestions_stub.SaySuggest(common.Request(
-        order_id=order_id, vector_clock=common.VectorClock(clocks=vectorClocks[order_id])))
-    comibine_vector_clock(order_id, resp.vector_clock)
-    raise BookException(resp.books)
+def execute_order(request_data):
+    with ORDERS_IN_FLIGHT.track_inprogress(), \
+            tracing.span('checkout', service='orchestrator'):
+        order_id = uuid.uuid4().hex
+        deadline = Deadline(CHECKOUT_DEADLINE)
+        suggested_books, suggestions_request, error = verify_order(
+            order_id, request_data, deadline)
+        if error is not None:
+            return rejected(order_id, error)
+
+        # ALL CORRECT, SO send to order queue
+        enqueue_order(order_id, request_data, deadline)
+        # Finally return books to frontend
+        return approve(order_id, suggested_books, suggestions_request)
+
+
+def enqueue_order(order_id, request_data, deadline):
+    # The queue records the order as queued
+    order_queue_stub = channel_pool.get_stub(
+        ORDER_QUEUE_ADDR, order_queue_grpc.OrderQueueServiceStub)
+    items_to_send = common.ItemsInitRequest(
+        order_id=order_id, items=request_data.get('items', []))
+    with observed('enqueue'):
+        order_queue_stub.Enqueue(items_to_send, timeout=max(
+            deadline.remaining(), ENQUEUE_MIN_TIMEOUT))
+
+
+def set_status(order_id, state, message=''):
+    status_stub = channel_pool.get_stub(
+        ORDER_QUEUE_ADDR, order_queue_grpc.OrderStatusServiceStub)
+    with observed('set_status'):
+        status_stub.SetStatus(order_queue.OrderStatus(
+            order_id=order_id, state=state, message=message),
+            timeout=ORDER_STATUS_TIMEOUT)
+
+
+def checkout_job(order_id, request_data):
+    # Verifies and enqueues an accepted order, the outcome ends up in the
+    # status store instead of a response
+    try:
+        with ORDERS_IN_FLIGHT.track_inprogress(), \
+                tracing.span('checkout', service='orchestrator'):
+            deadline = Deadline(CHECKOUT_DEADLINE)
+            _, suggestions_request, error = verify_order(
+                order_id, request_data, deadline, suggestions_mode='background')
+            if error is None:
+                set_status(order_id, order_queue.OrderStatus.VERIFIED)
+                try:
+                    enqueue_order(order_id, request_data, deadline)
+                    approve(order_id, None, suggestions_request)
+                except grpc.RpcError as e:
+                    error = e
+            if error is not None:
+                set_status(order_id, order_queue.OrderStatus.REJECTED,
+                           rejection_reason(error))
+    except Exception as e:
+        print(f"Orchestrator - Checkout job for {order_id} failed: {e!r}")
+    finally:
+        checkout_jobs.release()
+
+
+def suggest_in_background(order_id, suggestions_request, suggestions_stub):
+    pending = suggestion_results.track(order_id)
+
+    def suggest():
+        try:
+            with observed('suggestions_background'):
+                resp = suggestions_stub.SaySuggest(
+                    suggestions_request, timeout=SUGGESTIONS_BACKGROUND_DEADLINE)
+            pending.finish('ready', serialization.books(resp.books))
+        except grpc.RpcError as e:
+            print(f"Orchestrator - Suggestions for {order_id} failed: {e.code().name}")
+            pending.finish('failed', [])
+
+    # Keeps the call in the checkout's trace
+    suggestions_executor.submit(contextvars.copy_context().run, suggest)
+
+
+def admitted_checkout(request_data):
+    # execute_order in a free admission slot, OverloadedError if none frees up
+    if not admission_limiter.acquire():
+        raise admission.OverloadedError()
+    started = time.perf_counter()
+    response = None
+    try:
+        response = execute_order(request_data)
+        return response
+    finally:
+        admission_limiter.release(
+            time.perf_counter() - started,
+            overloaded=response is None or not is_final(response))
+
+
+checkout_job_executor = futures.ThreadPoolExecutor(
+    max_workers=CHECKOUT_JOB_WORKERS, thread_name_prefix='checkout')
+
+
+def accept_checkout(request_data):
+    # Hands a validated order to a checkout job. OverloadedError if too many
+    # accepted orders are still waiting for one
+    if not checkout_jobs.acquire():
+        raise admission.OverloadedError()
+    order_id = uuid.uuid4().hex
+    try:
+        set_status(order_id, order_queue.OrderStatus.ACCEPTED)
+    except grpc.RpcError as e:
+        checkout_jobs.release()
+        return rejected(order_id, e)
+    checkout_job_executor.submit(
+        contextvars.copy_context().run, checkout_job, order_id, request_data)
+    return accepted(order_id)
 
 
-class BookException(Exception):
-    pass
+def checkout_response(response, headers=None):
+    status = 202 if response['status'] == ACCEPTED_STATUS else 200
+    return response, status, headers or {}
 
 
-class FailException(Exception):
-    pass
+def idempotency_error(code, message, status):
+    return {'error': {'code': code, 'message': message}}, status
 
 
-def execute_order(request_data):
-    order_id = uuid.uuid4().hex
-    vectorClocks[order_id] = [0, 0, 0]
-    with grpc.insecure_channel('fraud_detection:50051') as fraud_detection_channel:
-        with grpc.insecure_channel('transaction_verification:50051') as transcation_verifiction_channel:
-            with grpc.insecure_channel('suggestions:50051') as suggestions_channel:
-                # Initing everything
-                fraud_detection_stub = fraud_detection_grpc.FraudServiceStub(
-                    fraud_detection_channel)
-                transaction_verification_stub = transaction_verification_grpc.VerificationServiceStub(
-                    transcation_verifiction_channel)
-                suggestions_stub = suggestions_grpc.SuggestionServiceStub(
-                    suggestions_channel)
-                billing_address = request_data['billingAddress']
-                general_request = common.InitAllInfoRequest(order_id=order_id, request=common.AllInfoRequest(
-                    name=request_data['user']['name'],
-                    contact=request_data['user']['contact'],
-                    credit_card_number=request_data['creditCard']['number'],
-                    expiration_date=request_data['creditCard']['expirationDate'],
-                    cvv=int(request_data['creditCard']['cvv']),
-                    billing_address=f"{billing_address['street']}, {billing_address['zip']}, {billing_address['city']}, {billing_address['state']}, {billing_address['country']}",
-                    quantity=sum(item['quantity']
-                                 for item in request_data['items']),
-                    items=request_data.get('items', [])))
-                suggestions_request = common.ItemsInitRequest(
-                    order_id=order_id, items=request_data.get('items', []))
-                fraud_detection_stub.InitVerification(general_request)
-                transaction_verification_stub.initVerification(general_request)
-                suggestions_stub.initSuggestion(suggestions_request)
-
-                suggested_books = None
-                fail_error = None
-
-                # Wrapper around threads, that catches returned message
-                def thread_wrapper(target, args):
-                    try:
-                        target(*args)
-                    except BookException as e:  # Suggestions
-                        nonlocal suggested_books
-                        suggested_books = e.args[0]
-                    except FailException as e:  # Some kind of an error message
-                        nonlocal fail_error
-                        fail_error = e
-
-                t_a = threading.Thread(target=thread_wrapper, args=(
-                    event_a, (order_id, transaction_verification_stub, fraud_detection_stub, suggestions_stub)))
-                t_b = threading.Thread(target=thread_wrapper, args=(
-                    event_b, (order_id, transaction_verification_stub, fraud_detection_stub, suggestions_stub)))
-                t_a.start()
-                t_b.start()
-                t_a.join()
-                t_b.join()
-                if fail_error is not None:
-                    return {
-                        'orderId': order_id,
-                        'status': f'Order Rejected: {fail_error}',
-                        'suggestedBooks': []
-                    }
-                elif suggested_books is not None:
-                    # ALL CORRECT, SO send to order queue
-                    with grpc.insecure_channel('order_queue:50051') as order_queue_channel:
-                        order_queue_stub = order_queue_grpc.OrderQueueServiceStub(
-                            order_queue_channel)
-                        items_to_send = common.ItemsInitRequest(
-                            order_id=order_id, items=request_data.get('items', []))
-                        order_queue_stub.Enqueue(items_to_send)
-                    # Finally return books to frontend
-                    return {
-                        'orderId': order_id,
-                        'status': 'Order Approved',
-                        'suggestedBooks': [MessageToDict(book) for book in suggested_books],
-                    }
-                else:
-                    raise AssertionError(
-                        "Unexpected error occurred, threads did not terminate in an expected way")
-
-    return {
-        'orderId': order_id,
-        'status': 'Order Rejected',
-        'suggestedBooks': [],
-    }
+def overloaded_error():
+    ADMISSION_REJECTED.inc()
+    return {'error': {
+        'code': 'OVERLOADED',
+        'message': 'Too many checkouts in progress, please retry later',
+    }}, 429, {'Retry-After': str(admission.ADMISSION_RETRY_AFTER)}
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.route('/checkout', methods=['POST'])
 def checkout():
-    return execute_order(json.loads(request.data))
+    key = request.headers.get('Idempotency-Key')
+    request_data, error = parse_order(request.data)
+    if error is not None:
+        return error
+    run = admitted_checkout
+    if respond_async(request.headers.get('Prefer')):
+        run = accept_checkout
+    try:
+        if not key:
+            return checkout_response(run(request_data))
+        response, replayed = idempotency_cache.run_once(
+            key, request.data, lambda: run(request_data), is_final)
+    except admission.OverloadedError:
+        return overloaded_error()
+    except KeyReusedError:
+        return idempotency_error(
+            'IDEMPOTENCY_KEY_REUSED',
+            'Idempotency-Key was already used with a different request', 422)
+    except InProgressError:
+        return idempotency_error(
+            'IDEMPOTENCY_KEY_IN_PROGRESS',
+            'A request with this Idempotency-Key is still being processed', 409)
+    if replayed:
+        return checkout_response(response, {'Idempotent-Replayed': 'true'})
+    return checkout_response(response)
+
+
+@app.route('/orders/<order_id>', methods=['GET'])
+def get_order(order_id):
+    status_stub = channel_pool.get_stub(
+        ORDER_QUEUE_ADDR, order_queue_grpc.OrderStatusServiceStub)
+    try:
+        with observed('get_status'):
+            status = status_stub.GetStatus(order_queue.OrderStatusRequest(
+                order_id=order_id), timeout=ORDER_STATUS_TIMEOUT)
+    except grpc.RpcError as e:
+        return {'error': {'code': 'UNAVAILABLE', 'message':
+                          f'Order status unavailable ({e.code().name})'}}, 503
+    if status.state == order_queue.OrderStatus.UNKNOWN:
+        return {'error': {'code': 'NOT_FOUND', 'message': f'No order {order_id}'}}, 404
+    return order_status(status)
+
+
+def verify_batch_order(order):
+    message = invalid_order(order.request_data)
+    if message is not None:
+        order.line = invalid_batch_order(order.index, message)
+        return order
+    with ORDERS_IN_FLIGHT.track_inprogress(), \
+            tracing.span('checkout', service='orchestrator') as checkout_span:
+        checkout_span.set('batch_index', order.index)
+        order.suggested_books, order.suggestions_request, error = verify_order(
+            order.order_id, order.request_data, Deadline(CHECKOUT_DEADLINE))
+    if error is not None:
+        order.line = batch_line(order.index, rejected(order.order_id, error))
+    return order
+
+
+def enqueue_batch(orders):
+    order_queue_stub = channel_pool.get_stub(
+        ORDER_QUEUE_ADDR, order_queue_grpc.OrderQueueServiceStub)
+    try:
+        with observed('enqueue_batch'):
+            order_queue_stub.EnqueueBatch(order_queue.EnqueueBatchRequest(
+                orders=[order.enqueue_request() for order in orders]),
+                timeout=BATCH_ENQUEUE_TIMEOUT)
+    except grpc.RpcError as e:
+        return [batch_line(order.index, rejected(order.order_id, e))
+                for order in orders]
+    return [batch_line(order.index, approve(
+        order.order_id, order.suggested_books, order.suggestions_request))
+        for order in orders]
+
+
+def run_batch(orders):
+    # Yields one NDJSON line per order as soon as its outcome is known, at
+    # most BATCH_CONCURRENCY orders are being verified at a time
+    pending = (BatchOrder(index, request_data)
+               for index, request_data in enumerate(orders))
+    running = set()
+    to_enqueue = []
+
+    def submit_next():
+        order = next(pending, None)
+        if order is not None:
+            running.add(batch_executor.submit(verify_batch_order, order))
+
+    for _ in range(BATCH_CONCURRENCY):
+        submit_next()
+    while running:
+        done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            running.remove(future)
+            submit_next()
+            order = future.result()
+            if order.line is not None:
+                yield order.line
+            else:
+                to_enqueue.append(order)
+        if len(to_enqueue) >= BATCH_ENQUEUE_SIZE or (to_enqueue and not running):
+            yield from enqueue_batch(to_enqueue)
+            to_enqueue = []
+
+
+@app.route('/checkout/batch', methods=['POST'])
+def checkout_batch():
+    orders, error = parse_batch(request.data)
+    if error is not None:
+        return error
+    return Response(run_batch(orders), mimetype='application/x-ndjson')
+
+
+def suggestions_not_found(order_id):
+    return {'error': {'code': 'NOT_FOUND',
+                      'message': f'No suggestions for order {order_id}'}}, 404
+
+
+@app.route('/suggestions/<order_id>', methods=['GET'])
+def get_suggestions(order_id):
+    pending = suggestion_results.get(order_id)
+    if pending is None:
+        return suggestions_not_found(order_id)
+    wait = min(request.args.get('wait', 0, type=float), SUGGESTIONS_MAX_WAIT)
+    if wait > 0:
+        pending.wait(wait)
+    return pending.as_dict(order_id)
+
+
+@app.route('/suggestions/<order_id>/stream', methods=['GET'])
+def stream_suggestions(order_id):
+    pending = suggestion_results.get(order_id)
+    if pending is None:
+        return suggestions_not_found(order_id)
+
+    def events():
+        # Comment lines keep proxies from closing the idle connection
+        while not pending.wait(15):
+            yield ': keepalive\n\n'
+        yield f"event: suggestions\ndata: {json.dumps(pending.as_dict(order_id))}\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0')
+    mode = os.getenv('ORCHESTRATOR_MODE', 'sync')
+    if int(os.getenv('ORCHESTRATOR_WORKERS', '0')) > 0:
+        # Worker processes under a production server
+        import server
+        server.serve(mode)
+    elif mode == 'async':
+        # Serve /checkout from the grpc.aio based ASGI app instead
+        import asgi_app
+        asgi_app.serve()
+    else:
+        app.run(host='0.0.0.0')
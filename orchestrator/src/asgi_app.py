@@ -0,0 +1,616 @@
+"""
+Asyncio flavour of the orchestrator.
+
+Serves the same /checkout contract as app.py, but as a plain ASGI application
+whose event chain runs as coroutines over grpc.aio stubs. An order in flight
+is a handful of suspended coroutines instead of two OS threads, so a single
+process on one core can keep thousands of checkouts waiting on downstream
+services. What both apps share lives in checkout_common.py, so this one never
+imports the Flask app and its thread pools.
+
+Started by app.py when ORCHESTRATOR_MODE=async, or directly with
+uvicorn asgi_app:app
+"""
+import asyncio
+import json
+import sys
+import os
+import time
+import uuid
+from urllib.parse import parse_qs
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
+sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
+import common_pb2 as common  # noqa
+import fraud_detection_pb2_grpc as fraud_detection_grpc  # noqa
+import transaction_verification_pb2_grpc as transaction_verification_grpc  # noqa
+import suggestions_pb2_grpc as suggestions_grpc  # noqa
+import order_queue_pb2 as order_queue  # noqa
+import order_queue_pb2_grpc as order_queue_grpc  # noqa
+
+import grpc  # noqa
+import channel_pool  # noqa
+import circuit_breaker  # noqa
+from event_dag import Deadline  # noqa
+import suggestion_results  # noqa
+import metrics  # noqa
+import tracing  # noqa
+from order_store import OrderStore  # noqa
+from checkout_common import (  # noqa
+    FRAUD_DETECTION_ADDR, TRANSACTION_VERIFICATION_ADDR, SUGGESTIONS_ADDR,
+    ORDER_QUEUE_ADDR, CHECKOUT_DEADLINE, ENQUEUE_MIN_TIMEOUT, SUGGESTIONS_MODE,
+    SUGGESTIONS_BACKGROUND_DEADLINE, SUGGESTIONS_MAX_WAIT, BATCH_CONCURRENCY,
+    BATCH_ENQUEUE_SIZE, BATCH_ENQUEUE_TIMEOUT, FailException, BatchOrder,
+    approved, batch_line, build_checkout_graph, build_init_requests,
+    invalid_batch_order, invalid_order, parse_batch, rejected,
+    suggestions_or_rejection, idempotency_cache, is_final, observed, annotate_span, ORDERS_IN_FLIGHT,
+    admission_limiter, ADMISSION_REJECTED, stock_cache, ORDER_STATUS_TIMEOUT,
+    CHECKOUT_JOB_WORKERS, rejection_reason, accepted, order_status, parse_order,
+    respond_async, checkout_jobs, ACCEPTED_STATUS)
+from idempotency import InProgressError, KeyReusedError  # noqa
+import admission  # noqa
+import stock  # noqa
+import serialization  # noqa
+
+vectorClocks = OrderStore()  # order_id -> vector_clock, only touched from the event loop
+
+
+def comibine_vector_clock(order_id, new_clock):
+    clock = vectorClocks[order_id]
+    clock[:] = [max(old, new) for old, new in zip(clock, new_clock.clocks)]
+
+
+def current_request(order_id):
+    return common.Request(
+        order_id=order_id,
+        vector_clock=common.VectorClock(clocks=vectorClocks[order_id]))
+
+
+def check_response(order_id, resp):
+    if resp.fail:
+        raise FailException(resp.message)
+    comibine_vector_clock(order_id, resp.vector_clock)
+
+
+# Coroutine versions of the events in app.py, same arguments and causal order
+async def event_a(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+                  timeout=None):
+    resp = await transaction_stub.BookListNotEmtpy(
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
+
+
+async def event_b(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+                  timeout=None):
+    resp = await transaction_stub.UserDataVerification(
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
+
+
+async def event_c(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+                  timeout=None):
+    resp = await transaction_stub.CreditCardVerification(
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
+
+
+async def event_d(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+                  timeout=None):
+    resp = await fraud_detection_stub.CheckUserData(
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
+
+
+async def event_e(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+                  timeout=None):
+    resp = await fraud_detection_stub.CheckCreditCard(
+        current_request(order_id), timeout=timeout)
+    check_response(order_id, resp)
+
+
+async def event_f(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+                  timeout=None):
+    try:
+        resp = await suggestions_stub.SaySuggest(
+            current_request(order_id), timeout=timeout)
+    except circuit_breaker.OpenCircuitError:
+        # Suggestions are down, the order is approved without them
+        return []
+    comibine_vector_clock(order_id, resp.vector_clock)
+    return resp.books
+
+
+async def event_g(order_id, transaction_stub, fraud_detection_stub, suggestions_stub,
+                  timeout=None):
+    resp = await fraud_detection_stub.SayFraud(
+        current_request(order_id), timeout=timeout)
+    if resp.is_fraud:
+        raise FailException(f"Suspected fraud: {resp.message}")
+
+
+checkout_events = build_checkout_graph({
+    'event_a': event_a, 'event_b': event_b, 'event_c': event_c,
+    'event_d': event_d, 'event_e': event_e, 'event_f': event_f,
+    'event_g': event_g,
+})
+# Used in background suggestions mode, approval only waits for these
+verification_events = checkout_events.without('event_f')
+background_tasks = set()  # Keeps background suggestion tasks referenced
+
+
+async def observed_call(call, rpc):
+    with observed(call):
+        return await rpc
+
+
+async def init_suggestions(suggestions_stub, suggestions_request, timeout):
+    try:
+        await observed_call('init_suggestions', suggestions_stub.initSuggestion(
+            suggestions_request, timeout=timeout))
+    except circuit_breaker.OpenCircuitError:
+        pass  # event_f approves without suggestions while the circuit is open
+
+
+async def check_stock(request_data):
+    # Same contract as check_stock in app.py
+    copies = stock.wanted(request_data.get('items', []))
+    levels, lookup = stock_cache.cached(copies)
+    if lookup is not None:
+        try:
+            with observed('stock_check'):
+                stock_cache.store(await stock_cache.client.call_async(
+                    lookup, timeout=stock.STOCK_TIMEOUT), levels)
+        except grpc.RpcError:
+            stock.STOCK_LOOKUPS.inc(len(lookup.titles), source='failed')
+    return stock.shortage(copies, levels)
+
+
+async def verify_order(order_id, request_data, deadline,
+                       suggestions_mode=SUGGESTIONS_MODE):
+    # Same contract as verify_order in app.py
+    vectorClocks.put(order_id, [0, 0, 0])
+    try:
+        return await run_verification(order_id, request_data, deadline, suggestions_mode)
+    finally:
+        annotate_span(order_id, vectorClocks.pop(order_id))
+
+
+async def run_verification(order_id, request_data, deadline, suggestions_mode):
+    if stock.STOCK_CHECK:
+        out_of_stock = await check_stock(request_data)
+        if out_of_stock is not None:
+            return None, None, FailException(out_of_stock)
+    fraud_detection_stub = channel_pool.get_aio_stub(
+        FRAUD_DETECTION_ADDR, fraud_detection_grpc.FraudServiceStub)
+    transaction_verification_stub = channel_pool.get_aio_stub(
+        TRANSACTION_VERIFICATION_ADDR,
+        transaction_verification_grpc.VerificationServiceStub)
+    suggestions_stub = channel_pool.get_aio_stub(
+        SUGGESTIONS_ADDR, suggestions_grpc.SuggestionServiceStub)
+    general_request, suggestions_request = build_init_requests(
+        order_id, request_data)
+    # Fan the three init calls out at once, so init costs one round-trip
+    timeout = deadline.remaining()
+    try:
+        await asyncio.gather(
+            observed_call('init_fraud_detection', fraud_detection_stub.InitVerification(
+                general_request, timeout=timeout)),
+            observed_call('init_transaction_verification',
+                          transaction_verification_stub.initVerification(
+                              general_request, timeout=timeout)),
+            init_suggestions(suggestions_stub, suggestions_request, timeout))
+    except grpc.RpcError as e:
+        return None, None, e
+
+    background = suggestions_mode == 'background'
+    events = verification_events if background else checkout_events
+    result = await events.run_async(
+        order_id, transaction_verification_stub, fraud_detection_stub,
+        suggestions_stub, deadline=deadline)
+    # Snapshot of the clock after event_e, the request outlives the checkout
+    suggestions_request = current_request(order_id)
+
+    if background:
+        if not result.ok:
+            return None, None, result.error
+        return None, suggestions_request, None
+    suggested_books, error = suggestions_or_rejection(result)
+    return suggested_books, None, error
+
+
+def approve(order_id, suggested_books, suggestions_request):
+    # Called once the order is enqueued
+    if suggestions_request is not None:
+        task = asyncio.ensure_future(suggest_in_background(
+            order_id, suggestion_results.track(order_id), suggestions_request,
+            channel_pool.get_aio_stub(
+                SUGGESTIONS_ADDR, suggestions_grpc.SuggestionServiceStub)))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    return approved(order_id, suggested_books)
+
+
+async def execute_order(request_data):
+    with ORDERS_IN_FLIGHT.track_inprogress(), \
+            tracing.span('checkout', service='orchestrator'):
+        order_id = uuid.uuid4().hex
+        deadline = Deadline(CHECKOUT_DEADLINE)
+        suggested_books, suggestions_request, error = await verify_order(
+            order_id, request_data, deadline)
+        if error is not None:
+            return rejected(order_id, error)
+
+        # ALL CORRECT, SO send to order queue
+        await enqueue_order(order_id, request_data, deadline)
+        # Finally return books to frontend
+        return approve(order_id, suggested_books, suggestions_request)
+
+
+async def enqueue_order(order_id, request_data, deadline):
+    order_queue_stub = channel_pool.get_aio_stub(
+        ORDER_QUEUE_ADDR, order_queue_grpc.OrderQueueServiceStub)
+    with observed('enqueue'):
+        await order_queue_stub.Enqueue(common.ItemsInitRequest(
+            order_id=order_id, items=request_data.get('items', [])),
+            timeout=max(deadline.remaining(), ENQUEUE_MIN_TIMEOUT))
+
+
+async def set_status(order_id, state, message=''):
+    status_stub = channel_pool.get_aio_stub(
+        ORDER_QUEUE_ADDR, order_queue_grpc.OrderStatusServiceStub)
+    with observed('set_status'):
+        await status_stub.SetStatus(order_queue.OrderStatus(
+            order_id=order_id, state=state, message=message),
+            timeout=ORDER_STATUS_TIMEOUT)
+
+
+checkout_job_slots = asyncio.Semaphore(CHECKOUT_JOB_WORKERS)
+
+
+async def checkout_job(order_id, request_data):
+    # Same contract as checkout_job in app.py
+    try:
+        async with checkout_job_slots:
+            with ORDERS_IN_FLIGHT.track_inprogress(), \
+                    tracing.span('checkout', service='orchestrator'):
+                deadline = Deadline(CHECKOUT_DEADLINE)
+                _, suggestions_request, error = await verify_order(
+                    order_id, request_data, deadline, suggestions_mode='background')
+                if error is None:
+                    await set_status(order_id, order_queue.OrderStatus.VERIFIED)
+                    try:
+                        await enqueue_order(order_id, request_data, deadline)
+                        approve(order_id, None, suggestions_request)
+                    except grpc.RpcError as e:
+                        error = e
+                if error is not None:
+                    await set_status(order_id, order_queue.OrderStatus.REJECTED,
+                                     rejection_reason(error))
+    except Exception as e:
+        print(f"Orchestrator - Checkout job for {order_id} failed: {e!r}")
+    finally:
+        checkout_jobs.release()
+
+
+async def accept_checkout(request_data):
+    # Same contract as accept_checkout in app.py
+    if not await checkout_jobs.acquire_async():
+        raise admission.OverloadedError()
+    order_id = uuid.uuid4().hex
+    try:
+        await set_status(order_id, order_queue.OrderStatus.ACCEPTED)
+    except grpc.RpcError as e:
+        checkout_jobs.release()
+        return rejected(order_id, e)
+    task = asyncio.ensure_future(checkout_job(order_id, request_data))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return accepted(order_id)
+
+
+async def verify_batch_order(order):
+    message = invalid_order(order.request_data)
+    if message is not None:
+        order.line = invalid_batch_order(order.index, message)
+        return order
+    with ORDERS_IN_FLIGHT.track_inprogress(), \
+            tracing.span('checkout', service='orchestrator') as checkout_span:
+        checkout_span.set('batch_index', order.index)
+        order.suggested_books, order.suggestions_request, error = await verify_order(
+            order.order_id, order.request_data, Deadline(CHECKOUT_DEADLINE))
+    if error is not None:
+        order.line = batch_line(order.index, rejected(order.order_id, error))
+    return order
+
+
+async def enqueue_batch(orders):
+    order_queue_stub = channel_pool.get_aio_stub(
+        ORDER_QUEUE_ADDR, order_queue_grpc.OrderQueueServiceStub)
+    try:
+        with observed('enqueue_batch'):
+            await order_queue_stub.EnqueueBatch(order_queue.EnqueueBatchRequest(
+                orders=[order.enqueue_request() for order in orders]),
+                timeout=BATCH_ENQUEUE_TIMEOUT)
+    except grpc.RpcError as e:
+        return [batch_line(order.index, rejected(order.order_id, e))
+                for order in orders]
+    return [batch_line(order.index, approve(
+        order.order_id, order.suggested_books, order.suggestions_request))
+        for order in orders]
+
+
+async def run_batch(orders):
+    # Async version of run_batch in app.py
+    pending = (BatchOrder(index, request_data)
+               for index, request_data in enumerate(orders))
+    running = set()
+    to_enqueue = []
+
+    def submit_next():
+        order = next(pending, None)
+        if order is not None:
+            running.add(asyncio.ensure_future(verify_batch_order(order)))
+
+    for _ in range(BATCH_CONCURRENCY):
+        submit_next()
+    while running:
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            running.remove(task)
+            submit_next()
+            order = task.result()
+            if order.line is not None:
+                yield order.line
+            else:
+                to_enqueue.append(order)
+        if len(to_enqueue) >= BATCH_ENQUEUE_SIZE or (to_enqueue and not running):
+            for line in await enqueue_batch(to_enqueue):
+                yield line
+            to_enqueue = []
+
+
+async def suggest_in_background(order_id, pending, suggestions_request, suggestions_stub):
+    try:
+        with observed('suggestions_background'):
+            resp = await suggestions_stub.SaySuggest(
+                suggestions_request, timeout=SUGGESTIONS_BACKGROUND_DEADLINE)
+        pending.finish('ready', serialization.books(resp.books))
+    except grpc.RpcError as e:
+        print(f"Orchestrator - Suggestions for {order_id} failed: {e.code().name}")
+        pending.finish('failed', [])
+
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+]
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+
+async def send_json(send, status, payload, headers=()):
+    body = serialization.dumps(payload)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            *CORS_HEADERS,
+            *headers,
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def error_payload(code, message):
+    return {'error': {'code': code, 'message': message}}
+
+
+def query_float(scope, name):
+    # Like request.args.get(name, 0, type=float) in app.py, 0 when missing
+    # or not a number
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        return float(query.get(name, ['0'])[0])
+    except ValueError:
+        return 0.0
+
+
+async def get_suggestions(scope, send, order_id, stream):
+    pending = suggestion_results.get(order_id)
+    if pending is None:
+        return await send_json(send, 404, error_payload(
+            'NOT_FOUND', f'No suggestions for order {order_id}'))
+    if not stream:
+        wait = min(query_float(scope, 'wait'), SUGGESTIONS_MAX_WAIT)
+        if wait > 0:
+            await pending.wait_async(wait)
+        return await send_json(send, 200, pending.as_dict(order_id))
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            *CORS_HEADERS,
+        ],
+    })
+    # Comment lines keep proxies from closing the idle connection
+    while not await pending.wait_async(15):
+        await send({'type': 'http.response.body', 'body': b': keepalive\n\n',
+                    'more_body': True})
+    event = f"event: suggestions\ndata: {json.dumps(pending.as_dict(order_id))}\n\n"
+    await send({'type': 'http.response.body', 'body': event.encode()})
+
+
+async def admitted_checkout(request_data):
+    # execute_order in a free admission slot, OverloadedError if none frees up
+    if not await admission_limiter.acquire_async():
+        raise admission.OverloadedError()
+    started = time.perf_counter()
+    response = None
+    try:
+        response = await execute_order(request_data)
+        return response
+    finally:
+        admission_limiter.release(
+            time.perf_counter() - started,
+            overloaded=response is None or not is_final(response))
+
+
+def checkout_status(response):
+    return 202 if response['status'] == ACCEPTED_STATUS else 200
+
+
+async def checkout(scope, receive, send):
+    body = await read_body(receive)
+    headers = dict(scope['headers'])
+    key = headers.get(b'idempotency-key')
+    request_data, error = parse_order(body)
+    if error is not None:
+        return await send_json(send, error[1], error[0])
+    run = admitted_checkout
+    if respond_async(headers.get(b'prefer', b'').decode()):
+        run = accept_checkout
+    try:
+        if key is None:
+            response = await run(request_data)
+            return await send_json(send, checkout_status(response), response)
+        response, replayed = await idempotency_cache.run_once_async(
+            key.decode(), body, lambda: run(request_data), is_final)
+    except admission.OverloadedError:
+        ADMISSION_REJECTED.inc()
+        return await send_json(send, 429, error_payload(
+            'OVERLOADED', 'Too many checkouts in progress, please retry later'),
+            [(b'retry-after', str(admission.ADMISSION_RETRY_AFTER).encode())])
+    except KeyReusedError:
+        return await send_json(send, 422, error_payload(
+            'IDEMPOTENCY_KEY_REUSED',
+            'Idempotency-Key was already used with a different request'))
+    except InProgressError:
+        return await send_json(send, 409, error_payload(
+            'IDEMPOTENCY_KEY_IN_PROGRESS',
+            'A request with this Idempotency-Key is still being processed'))
+    headers = [(b'idempotent-replayed', b'true')] if replayed else []
+    await send_json(send, checkout_status(response), response, headers)
+
+
+async def get_order(send, order_id):
+    status_stub = channel_pool.get_aio_stub(
+        ORDER_QUEUE_ADDR, order_queue_grpc.OrderStatusServiceStub)
+    try:
+        with observed('get_status'):
+            status = await status_stub.GetStatus(order_queue.OrderStatusRequest(
+                order_id=order_id), timeout=ORDER_STATUS_TIMEOUT)
+    except grpc.RpcError as e:
+        return await send_json(send, 503, error_payload(
+            'UNAVAILABLE', f'Order status unavailable ({e.code().name})'))
+    if status.state == order_queue.OrderStatus.UNKNOWN:
+        return await send_json(send, 404, error_payload(
+            'NOT_FOUND', f'No order {order_id}'))
+    await send_json(send, 200, order_status(status))
+
+
+async def checkout_batch(receive, send):
+    orders, error = parse_batch(await read_body(receive))
+    if error is not None:
+        return await send_json(send, error[1], error[0])
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'application/x-ndjson'), *CORS_HEADERS],
+    })
+    try:
+        async for line in run_batch(orders):
+            await send({'type': 'http.response.body', 'body': line,
+                        'more_body': True})
+    except Exception as e:
+        # The 200 is out already, so the stream just ends early and the
+        # client gets no line for the orders left
+        print(f"Orchestrator - Batch checkout failed: {e!r}")
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await channel_pool.get_aio_pool().close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    method, path = scope['method'], scope['path']
+    if method == 'OPTIONS':
+        # CORS preflight, mirrors what Flask-CORS answers in sync mode
+        request_headers = dict(scope['headers'])
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                *CORS_HEADERS,
+                (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+                (b'access-control-allow-headers',
+                 request_headers.get(b'access-control-request-headers', b'*')),
+                (b'content-length', b'0'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+    elif path == '/checkout' and method == 'POST':
+        try:
+            await checkout(scope, receive, send)
+        except Exception as e:
+            print(f"Orchestrator - Checkout failed: {e!r}")
+            await send_json(send, 500, error_payload('INTERNAL', str(e)))
+    elif path == '/checkout/batch' and method == 'POST':
+        try:
+            await checkout_batch(receive, send)
+        except Exception as e:
+            print(f"Orchestrator - Batch checkout failed: {e!r}")
+            await send_json(send, 500, error_payload('INTERNAL', str(e)))
+    elif path == '/metrics' and method == 'GET':
+        body = metrics.render().encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', metrics.CONTENT_TYPE.encode()),
+                        (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+    elif path.startswith('/orders/') and method == 'GET':
+        await get_order(send, path.split('/')[2])
+    elif path.startswith('/suggestions/') and method == 'GET':
+        parts = path.split('/')  # ['', 'suggestions', order_id(, 'stream')]
+        stream = len(parts) == 4 and parts[3] == 'stream'
+        await get_suggestions(scope, send, parts[2], stream)
+    else:
+        await send_json(send, 404, error_payload('NOT_FOUND', path))
+
+
+def serve():
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', '5000')),
+                access_log=False)
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,357 @@
+"""
+What the Flask app (app.py) and the ASGI app (asgi_app.py) share.
+
+Settings, metrics, order validation, the causal order of the checkout
+events, the shapes of the /checkout responses and the per-process admission,
+idempotency and stock state. Nothing here starts a thread or depends on how
+the events are run, so the ASGI app does not pull in the Flask app and its
+thread pools.
+
+Usage:
+
+    from checkout_common import CHECKOUT_DEADLINE, parse_order, rejected
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent import futures
+
+import common_pb2 as common
+import order_queue_pb2 as order_queue
+
+import grpc
+import circuit_breaker
+from event_dag import DeadlineExceeded, EventGraph
+import suggestion_results
+from idempotency import default_cache
+import admission
+import stock
+import validation
+import serialization
+import metrics
+import tracing
+
+FRAUD_DETECTION_ADDR = os.getenv('FRAUD_DETECTION_ADDR', 'fraud_detection:50051')
+TRANSACTION_VERIFICATION_ADDR = os.getenv(
+    'TRANSACTION_VERIFICATION_ADDR', 'transaction_verification:50051')
+SUGGESTIONS_ADDR = os.getenv('SUGGESTIONS_ADDR', 'suggestions:50051')
+ORDER_QUEUE_ADDR = os.getenv('ORDER_QUEUE_ADDR', 'order_queue:50051')
+# Calls to a service that keeps failing fail fast until it recovers
+for address in (FRAUD_DETECTION_ADDR, TRANSACTION_VERIFICATION_ADDR,
+                SUGGESTIONS_ADDR, ORDER_QUEUE_ADDR, *stock.BOOKS_DATABASE_READ_ADDRS):
+    circuit_breaker.protect(address)
+
+# End-to-end budget of one checkout, split across init, the events and enqueue
+CHECKOUT_DEADLINE = float(os.getenv('CHECKOUT_DEADLINE_MS', '800')) / 1000
+# SayFraud as one more verification event, event_g: fraud_detection scores
+# the order and asks the LLM about the uncertain ones, which needs a
+# CHECKOUT_DEADLINE the LLM can answer in
+FRAUD_SCORE_CHECK = os.getenv('FRAUD_SCORE_CHECK', 'false').lower() == 'true'
+# An approved order must reach the queue even if the budget is already spent
+ENQUEUE_MIN_TIMEOUT = 0.5
+
+# "inline" answers /checkout only once suggestions are there, "background"
+# answers as soon as the order is verified and enqueued, and computes the
+# suggestions afterwards, see /suggestions/<orderId>. Inline suggestions need
+# a CHECKOUT_DEADLINE the LLM can answer in, with less the checkout comes back
+# without them
+SUGGESTIONS_MODE = os.getenv('SUGGESTIONS_MODE', 'inline')
+# Budget of a background suggestions call, it no longer holds up the checkout
+SUGGESTIONS_BACKGROUND_DEADLINE = float(
+    os.getenv('SUGGESTIONS_BACKGROUND_DEADLINE_MS', '30000')) / 1000
+# Longest a client may block on /suggestions/<orderId>?wait=<seconds>
+SUGGESTIONS_MAX_WAIT = 30.0
+
+# "inline" answers /checkout once the order is verified and enqueued,
+# "background" answers 202 with the order id as soon as the order is
+# validated and verifies it in a job, see /orders/<orderId>. Clients can ask
+# for the latter per request with "Prefer: respond-async"
+CHECKOUT_MODE = os.getenv('CHECKOUT_MODE', 'inline')
+CHECKOUT_JOB_WORKERS = int(os.getenv('CHECKOUT_JOB_WORKERS', '16'))
+# Accepted orders not done yet, beyond this /checkout answers 429
+CHECKOUT_MAX_PENDING_JOBS = int(os.getenv('CHECKOUT_MAX_PENDING_JOBS', '1000'))
+# The order status store is part of the order queue service
+ORDER_STATUS_TIMEOUT = 1.0
+
+# /checkout/batch: orders of one batch verified at the same time, largest
+# accepted batch, and how many approved orders go into one EnqueueBatch call
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '16'))
+BATCH_MAX_ORDERS = int(os.getenv('BATCH_MAX_ORDERS', '1000'))
+BATCH_ENQUEUE_SIZE = int(os.getenv('BATCH_ENQUEUE_SIZE', '100'))
+BATCH_ENQUEUE_TIMEOUT = float(os.getenv('BATCH_ENQUEUE_TIMEOUT_MS', '2000')) / 1000
+
+RPC_LATENCY = metrics.histogram(
+    'orchestrator_rpc_duration_seconds',
+    'Latency of the downstream calls made for a checkout', ['call', 'outcome'])
+ORDERS_IN_FLIGHT = metrics.gauge(
+    'orchestrator_orders_in_flight', 'Orders that have not been answered yet')
+metrics.gauge(
+    'orchestrator_threads', 'Live threads of the orchestrator process'
+).set_function(threading.active_count)
+ADMISSION_REJECTED = metrics.counter(
+    'orchestrator_admission_rejected_total',
+    'Checkouts turned away with 429 because too many were in progress')
+INVALID_ORDERS = metrics.counter(
+    'orchestrator_invalid_orders_total',
+    'Orders answered with 400 because they do not match the API specification')
+
+# Compiled once from utils/api/bookstore.yaml, see validation.py
+validate_checkout = validation.compile_schema(validation.load_spec(), 'CheckoutRequest')
+# The services get the total number of copies as an int32
+MAX_ORDER_QUANTITY = 2**31 - 1
+
+
+class FailException(Exception):
+    pass
+
+
+def call_outcome(error):
+    if error is None:
+        return 'ok'
+    if isinstance(error, FailException):
+        return 'rejected'
+    if isinstance(error, DeadlineExceeded):
+        return 'DEADLINE_EXCEEDED'
+    if isinstance(error, grpc.RpcError):
+        return error.code().name
+    if isinstance(error, (futures.CancelledError, asyncio.CancelledError)):
+        return 'cancelled'
+    if isinstance(error, KeyError):
+        # Answered after the order was already rejected and dropped
+        return 'abandoned'
+    return 'error'
+
+
+def observe_call(call, duration, error):
+    RPC_LATENCY.observe(duration, call=call, outcome=call_outcome(error))
+
+
+@contextmanager
+def observed(call):
+    # Records latency and outcome of the calls made inside the block
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        observe_call(call, time.perf_counter() - start, e)
+        raise
+    observe_call(call, time.perf_counter() - start, None)
+
+
+# Causal order of the checkout events as (event, events it waits for,
+# share of the deadline relative to the other events on its chain).
+# event_e is the join of both branches: a -> c -> e <- d <- b, e -> f
+CHECKOUT_EVENTS = [
+    ('event_a', (), 1),
+    ('event_b', (), 1),
+    ('event_c', ('event_a',), 1),
+    ('event_d', ('event_b',), 1),
+    ('event_e', ('event_c', 'event_d'), 1),
+    # The LLM call behind suggestions is by far the slowest step
+    ('event_f', ('event_e',), 4),
+]
+if FRAUD_SCORE_CHECK:
+    # Runs alongside event_f and may ask an LLM as well
+    CHECKOUT_EVENTS.append(('event_g', ('event_e',), 4))
+
+
+def build_checkout_graph(functions):
+    graph = EventGraph(observer=observe_call)
+    for name, deps, weight in CHECKOUT_EVENTS:
+        graph.add(name, functions[name], deps, weight)
+    return graph
+
+
+def is_deadline_error(error):
+    return isinstance(error, DeadlineExceeded) or (
+        isinstance(error, grpc.RpcError) and
+        error.code() == grpc.StatusCode.DEADLINE_EXCEEDED)
+
+
+def rejection_reason(error):
+    if isinstance(error, FailException):  # Some kind of an error message
+        return str(error)
+    if is_deadline_error(error):
+        return DEADLINE_REJECTION
+    if isinstance(error, grpc.RpcError):  # Downstream service is unreachable
+        return f"{UNAVAILABLE_REJECTION} ({error.code().name})"
+    raise error
+
+
+DEADLINE_REJECTION = "Checkout deadline exceeded, please try again"
+UNAVAILABLE_REJECTION = "Service unavailable"
+
+
+def is_final(response):
+    # Rejections caused by timeouts or outages may go through on a retry, so
+    # they are not kept in the idempotency cache
+    status = response['status']
+    return not (status.endswith(DEADLINE_REJECTION) or
+                UNAVAILABLE_REJECTION in status)
+
+
+def suggestions_or_rejection(result):
+    # Suggested books of a finished event DAG, or the error to reject with
+    if result.ok:
+        return result.results['event_f'], None
+    if result.failed_event == 'event_f' and is_deadline_error(result.error):
+        # Approval does not depend on suggestions, degrade to none
+        return [], None
+    return None, result.error
+
+
+def approved(order_id, suggested_books):
+    response = {
+        'orderId': order_id,
+        'status': 'Order Approved',
+        'suggestedBooks': [],
+        'statusUrl': f'/orders/{order_id}',
+    }
+    if suggested_books is None:
+        response['suggestionsUrl'] = f'/suggestions/{order_id}'
+    else:
+        response['suggestedBooks'] = serialization.books(suggested_books)
+    return response
+
+
+ACCEPTED_STATUS = 'Order Accepted'
+
+
+def accepted(order_id):
+    return {
+        'orderId': order_id,
+        'status': ACCEPTED_STATUS,
+        'suggestedBooks': [],
+        'statusUrl': f'/orders/{order_id}',
+    }
+
+
+def order_status(status):
+    state = order_queue.OrderStatus.State.Name(status.state).lower()
+    response = {'orderId': status.order_id, 'state': state,
+                'message': status.message, 'updatedAt': status.updated_at}
+    if suggestion_results.get(status.order_id) is not None:
+        response['suggestionsUrl'] = f'/suggestions/{status.order_id}'
+    return response
+
+
+def rejected(order_id, error):
+    return {
+        'orderId': order_id,
+        'status': f'Order Rejected: {rejection_reason(error)}',
+        'suggestedBooks': []
+    }
+
+
+def build_init_requests(order_id, request_data):
+    billing_address = request_data['billingAddress']
+    general_request = common.InitAllInfoRequest(order_id=order_id, request=common.AllInfoRequest(
+        name=request_data['user']['name'],
+        contact=request_data['user']['contact'],
+        credit_card_number=request_data['creditCard']['number'],
+        expiration_date=request_data['creditCard']['expirationDate'],
+        cvv=int(request_data['creditCard']['cvv']),
+        billing_address=f"{billing_address['street']}, {billing_address['zip']}, {billing_address['city']}, {billing_address['state']}, {billing_address['country']}",
+        quantity=sum(item['quantity']
+                     for item in request_data['items']),
+        items=request_data.get('items', [])))
+    suggestions_request = common.ItemsInitRequest(
+        order_id=order_id, items=request_data.get('items', []))
+    return general_request, suggestions_request
+
+
+def annotate_span(order_id, vector_clock):
+    # Final clock of the order on the checkout span, when it is traced
+    checkout_span = tracing.current_span()
+    if checkout_span is not None:
+        checkout_span.set('order_id', order_id)
+        checkout_span.set('vector_clock', list(vector_clock or ()))
+
+
+stock_cache = stock.StockCache()
+idempotency_cache = default_cache()
+admission_limiter = admission.Limiter()
+metrics.gauge(
+    'orchestrator_admission_limit', 'Checkouts allowed in progress at the same time'
+).set_function(lambda: admission_limiter.limit)
+metrics.gauge(
+    'orchestrator_admission_queued', 'Checkouts waiting for a free slot'
+).set_function(lambda: admission_limiter.queued)
+
+checkout_jobs = admission.Limiter(
+    CHECKOUT_MAX_PENDING_JOBS, queue_size=0, adaptive=False)
+metrics.gauge(
+    'orchestrator_checkout_jobs', 'Accepted checkouts that are not verified and enqueued yet'
+).set_function(lambda: checkout_jobs.in_flight)
+
+
+def respond_async(prefer):
+    return CHECKOUT_MODE == 'background' or 'respond-async' in (prefer or '').lower()
+
+
+def invalid_order(request_data):
+    # Why the order does not match the API specification, None if it does
+    message = validate_checkout(request_data)
+    if message is None:
+        if sum(item['quantity'] for item in request_data['items']) <= MAX_ORDER_QUANTITY:
+            return None
+        message = f'items: more than {MAX_ORDER_QUANTITY} copies in total'
+    INVALID_ORDERS.inc()
+    return f'Malformed order: {message}'
+
+
+def parse_order(body):
+    # Returns (request_data, error response), nothing is called downstream
+    # for an order that is not valid JSON or does not match the specification
+    try:
+        request_data = json.loads(body)
+    except ValueError:
+        INVALID_ORDERS.inc()
+        return None, ({'error': {'code': 'INVALID_ORDER',
+                                 'message': 'Expected a JSON object'}}, 400)
+    message = invalid_order(request_data)
+    if message is not None:
+        return None, ({'error': {'code': 'INVALID_ORDER', 'message': message}}, 400)
+    return request_data, None
+
+
+class BatchOrder:
+    def __init__(self, index, request_data):
+        self.index = index
+        self.request_data = request_data
+        self.order_id = uuid.uuid4().hex
+        self.suggested_books = None
+        self.suggestions_request = None
+        self.line = None  # Final result, unless the order is to be enqueued
+
+    def enqueue_request(self):
+        return common.ItemsInitRequest(
+            order_id=self.order_id, items=self.request_data.get('items', []))
+
+
+def batch_line(index, response):
+    return serialization.dumps({'index': index, **response}) + b'\n'
+
+
+def invalid_batch_order(index, message):
+    return batch_line(index, {'error': {'code': 'INVALID_ORDER', 'message': message}})
+
+
+def parse_batch(body):
+    # Returns (orders, error response)
+    try:
+        orders = json.loads(body)
+    except ValueError:
+        orders = None
+    if not isinstance(orders, list):
+        return None, ({'error': {'code': 'INVALID_BATCH',
+                                 'message': 'Expected a JSON array of orders'}}, 400)
+    if len(orders) > BATCH_MAX_ORDERS:
+        return None, ({'error': {
+            'code': 'BATCH_TOO_LARGE',
+            'message': f'At most {BATCH_MAX_ORDERS} orders per batch'}}, 413)
+    return orders, None
@@ -0,0 +1,229 @@
+"""
+Small DAG executor for the checkout events.
+
+Events are declared together with the events they depend on. Each event is
+started as soon as all of its predecessors have finished, so independent
+branches run concurrently and an event with several predecessors is a real
+join. The first failing event cancels everything that has not finished yet.
+Start offset and duration of every event are recorded on the result, and
+passed with the event's error (None on success) to the graph's observer.
+
+When the graph runs under a Deadline, every event is called with a timeout
+keyword: its weighted share of the time that is left, relative to the
+heaviest chain of events still ahead of it. Time saved by fast events flows
+to the ones after them. An event whose turn comes after the deadline fails
+with DeadlineExceeded without being called.
+
+Usage:
+
+    graph = EventGraph()
+    graph.add('event_a', event_a)
+    graph.add('event_c', event_c, deps=['event_a'])
+    result = graph.run(order)           # plain functions, on a thread pool
+    result = await graph.run_async(order)   # coroutine functions
+    result = graph.run(order, deadline=Deadline(0.8))
+"""
+import asyncio
+import contextvars
+import os
+import time
+from concurrent import futures
+
+_executor = futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv('EVENT_WORKERS', '64')),
+    thread_name_prefix='event')
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class Event:
+    def __init__(self, name, fn, deps, weight):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.weight = weight
+
+
+class DagResult:
+    def __init__(self):
+        self.results = {}  # event name -> return value
+        self.timings = {}  # event name -> (start offset, duration) in seconds
+        self.error = None  # exception of the first failed event
+        self.failed_event = None
+        self.cancelled = []  # events that did not get to finish
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class EventGraph:
+    def __init__(self, observer=None):
+        self.events = {}  # name -> Event, in declaration order
+        self.observer = observer  # observer(name, duration, error)
+        self._chain_weights = None
+
+    def add(self, name, fn, deps=(), weight=1.0):
+        # Dependencies must be declared first, which also rules out cycles
+        for dep in deps:
+            if dep not in self.events:
+                raise ValueError(f"Event {name} depends on unknown event {dep}")
+        if name in self.events:
+            raise ValueError(f"Event {name} is declared twice")
+        self.events[name] = Event(name, fn, deps, weight)
+        self._chain_weights = None
+        return self
+
+    def without(self, *names):
+        # Copy of the graph without the given events and their dependants
+        graph = EventGraph(self.observer)
+        removed = set(names)
+        for event in self.events.values():
+            if event.name in removed or removed.intersection(event.deps):
+                removed.add(event.name)
+            else:
+                graph.add(event.name, event.fn, event.deps, event.weight)
+        return graph
+
+    def _dependants(self):
+        dependants = {name: [] for name in self.events}
+        for event in self.events.values():
+            for dep in event.deps:
+                dependants[dep].append(event.name)
+        return dependants
+
+    def chain_weights(self):
+        # Weight of the heaviest chain starting at each event
+        if self._chain_weights is None:
+            dependants = self._dependants()
+            weights = {}
+            for name in reversed(self.events):
+                weights[name] = self.events[name].weight + max(
+                    (weights[dependant] for dependant in dependants[name]),
+                    default=0)
+            self._chain_weights = weights
+        return self._chain_weights
+
+    def _call_kwargs(self, event, deadline):
+        if deadline is None:
+            return {}
+        # gRPC does not reliably fail calls whose deadline is already over
+        if deadline.expired():
+            raise DeadlineExceeded(f"No time left for {event.name}")
+        share = event.weight / self.chain_weights()[event.name]
+        return {'timeout': deadline.remaining() * share}
+
+    def run(self, *args, executor=None, deadline=None) -> DagResult:
+        executor = executor or _executor
+        result = DagResult()
+        dependants = self._dependants()
+        waiting = {event.name: len(event.deps) for event in self.events.values()}
+        origin = time.perf_counter()
+        running = {}  # future -> event name
+
+        def timed(event):
+            start = time.perf_counter()
+            error = None
+            try:
+                return event.fn(*args, **self._call_kwargs(event, deadline))
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self._record(result, event.name, start - origin,
+                             time.perf_counter() - start, error)
+
+        def start(name):
+            # Events see the caller's context variables, e.g. its trace span
+            running[executor.submit(
+                contextvars.copy_context().run, timed, self.events[name])] = name
+
+        for name, count in waiting.items():
+            if count == 0:
+                start(name)
+        while running:
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    # Only events still queued can be cancelled
+                    for pending in running:
+                        pending.cancel()
+                    return self._fail(result, name, error)
+                result.results[name] = future.result()
+                for dependant in dependants[name]:
+                    waiting[dependant] -= 1
+                    if waiting[dependant] == 0:
+                        start(dependant)
+        return result
+
+    async def run_async(self, *args, deadline=None) -> DagResult:
+        result = DagResult()
+        dependants = self._dependants()
+        waiting = {event.name: len(event.deps) for event in self.events.values()}
+        origin = time.perf_counter()
+        running = {}  # task -> event name
+
+        async def timed(event):
+            start = time.perf_counter()
+            error = None
+            try:
+                return await event.fn(*args, **self._call_kwargs(event, deadline))
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self._record(result, event.name, start - origin,
+                             time.perf_counter() - start, error)
+
+        def start(name):
+            running[asyncio.ensure_future(timed(self.events[name]))] = name
+
+        for name, count in waiting.items():
+            if count == 0:
+                start(name)
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = running.pop(task)
+                error = task.exception()
+                if error is not None:
+                    for pending in running:
+                        pending.cancel()
+                    for other in done:
+                        other.exception()  # Mark as retrieved
+                    return self._fail(result, name, error)
+                result.results[name] = task.result()
+                for dependant in dependants[name]:
+                    waiting[dependant] -= 1
+                    if waiting[dependant] == 0:
+                        start(dependant)
+        return result
+
+    def _record(self, result, name, offset, duration, error):
+        result.timings[name] = (offset, duration)
+        if self.observer is not None:
+            self.observer(name, duration, error)
+
+    def _fail(self, result, name, error):
+        result.error = error
+        result.failed_event = name
+        # Threads that are already inside an RPC finish on their own, their
+        # results are ignored
+        result.cancelled = [other for other in self.events
+                            if other != name and other not in result.results]
+        return result
@@ -0,0 +1,236 @@
+"""
+Response cache for /checkout keyed by the client's Idempotency-Key header.
+
+The first request with a key runs the checkout. Duplicates that arrive while
+it is still running wait for its result, later ones get the stored response,
+so a client retrying on a timeout never verifies or enqueues the same order
+twice. Entries are bounded in number and expire after a TTL. With
+IDEMPOTENCY_CACHE_FILE set, finished responses are also appended to a local
+JSON-lines file and reloaded when the orchestrator restarts.
+
+When several worker processes serve /checkout, SharedIdempotencyCache keeps
+claims and responses in the shared state database instead, and duplicates
+that land on another worker poll it for the first request's response.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent import futures
+
+import shared_state
+from order_store import OrderStore
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_CACHE_FILE = os.getenv('IDEMPOTENCY_CACHE_FILE', '')
+# How long a duplicate waits for the first request before giving up
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
+
+
+class KeyReusedError(Exception):
+    # The key was already used with a different request body
+    pass
+
+
+class InProgressError(Exception):
+    # The first request with the key is still running
+    pass
+
+
+class _Claim:
+    __slots__ = ('fingerprint', 'future')
+
+    def __init__(self, fingerprint, future):
+        self.fingerprint = fingerprint
+        self.future = future
+
+
+class IdempotencyCache:
+    def __init__(self, max_size=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL,
+                 path=IDEMPOTENCY_CACHE_FILE):
+        self._store = OrderStore(max_size=max_size, ttl=ttl)
+        self._ttl = ttl
+        self._path = path
+        self._file_lock = threading.Lock()
+        if path:
+            self._load()
+
+    def _claim(self, key, body):
+        fingerprint = hashlib.sha256(body).hexdigest()
+        new = _Claim(fingerprint, futures.Future())
+        claim = self._store.setdefault(key, new)
+        if claim.fingerprint != fingerprint:
+            raise KeyReusedError(key)
+        # Whoever stored the claim owns the key
+        return claim, claim is new
+
+    def _finish(self, key, claim, response, cacheable):
+        if cacheable:
+            self._append(key, claim.fingerprint, response)
+        else:
+            # Let waiters have it, but a later retry runs the checkout again
+            self._store.pop(key)
+        claim.future.set_result(response)
+
+    def _abandon(self, key, claim, error):
+        self._store.pop(key)
+        claim.future.set_exception(error)
+
+    def run_once(self, key, body, fn, cacheable=lambda response: True):
+        # Returns (response, replayed)
+        claim, owner = self._claim(key, body)
+        if not owner:
+            try:
+                return claim.future.result(timeout=IDEMPOTENCY_WAIT), True
+            except futures.TimeoutError:
+                raise InProgressError(key)
+        try:
+            response = fn()
+        except BaseException as e:
+            self._abandon(key, claim, e)
+            raise
+        self._finish(key, claim, response, cacheable(response))
+        return response, False
+
+    async def run_once_async(self, key, body, fn, cacheable=lambda response: True):
+        # Same as run_once, fn is a coroutine function
+        claim, owner = self._claim(key, body)
+        if not owner:
+            try:
+                # Shielded, a duplicate that times out or goes away must not
+                # cancel the claim the owner and the other duplicates share
+                return await asyncio.wait_for(asyncio.shield(
+                    asyncio.wrap_future(claim.future)), IDEMPOTENCY_WAIT), True
+            except asyncio.TimeoutError:
+                raise InProgressError(key)
+        try:
+            response = await fn()
+        except BaseException as e:
+            self._abandon(key, claim, e)
+            raise
+        self._finish(key, claim, response, cacheable(response))
+        return response, False
+
+    def _append(self, key, fingerprint, response):
+        if not self._path:
+            return
+        line = json.dumps({
+            'key': key,
+            'fingerprint': fingerprint,
+            'expiresAt': time.time() + self._ttl,
+            'response': response,
+        })
+        with self._file_lock, open(self._path, 'a') as f:
+            f.write(line + '\n')
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        now = time.time()
+        live = {}
+        lines = 0
+        with open(self._path) as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Torn write from a crash
+                if record['expiresAt'] > now:
+                    live[record['key']] = record
+        for key, record in live.items():
+            future = futures.Future()
+            future.set_result(record['response'])
+            self._store.put(key, _Claim(record['fingerprint'], future),
+                            ttl=record['expiresAt'] - now)
+        if lines > 2 * len(live) + 100:
+            # Drop expired and overwritten records
+            tmp_path = self._path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for record in live.values():
+                    f.write(json.dumps(record) + '\n')
+            os.replace(tmp_path, self._path)
+        print(f"IdempotencyCache - Loaded {len(live)} responses from {self._path}")
+
+
+class SharedIdempotencyCache:
+    # Same interface as IdempotencyCache, state kept in a shared_state store
+    def __init__(self, store, ttl=IDEMPOTENCY_TTL):
+        self._store = store
+        self._ttl = ttl
+
+    def _try_claim(self, key, fingerprint):
+        # Returns (owner, response), response is None while it is running
+        claim = {'fingerprint': fingerprint, 'response': None}
+        # A claim whose worker died is given up after IDEMPOTENCY_WAIT
+        if self._store.add(key, claim, IDEMPOTENCY_WAIT):
+            return True, None
+        record = self._store.get(key)
+        if record is None:
+            # Finished without a cacheable response in the meantime
+            return self._try_claim(key, fingerprint)
+        if record['fingerprint'] != fingerprint:
+            raise KeyReusedError(key)
+        return False, record['response']
+
+    def _finish(self, key, fingerprint, response, cacheable):
+        if cacheable:
+            self._store.put(key, {'fingerprint': fingerprint,
+                                  'response': response}, self._ttl)
+        else:
+            # Waiting duplicates run the checkout again themselves
+            self._store.delete(key)
+
+    def run_once(self, key, body, fn, cacheable=lambda response: True):
+        fingerprint = hashlib.sha256(body).hexdigest()
+        give_up_at = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            owner, response = self._try_claim(key, fingerprint)
+            if owner:
+                break
+            if response is not None:
+                return response, True
+            if time.monotonic() >= give_up_at:
+                raise InProgressError(key)
+            time.sleep(shared_state.POLL_INTERVAL)
+        try:
+            response = fn()
+        except BaseException:
+            self._store.delete(key)
+            raise
+        self._finish(key, fingerprint, response, cacheable(response))
+        return response, False
+
+    async def run_once_async(self, key, body, fn, cacheable=lambda response: True):
+        fingerprint = hashlib.sha256(body).hexdigest()
+        give_up_at = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            # The store is sqlite on a shared file, keep its I/O off the loop
+            owner, response = await asyncio.to_thread(
+                self._try_claim, key, fingerprint)
+            if owner:
+                break
+            if response is not None:
+                return response, True
+            if time.monotonic() >= give_up_at:
+                raise InProgressError(key)
+            await asyncio.sleep(shared_state.POLL_INTERVAL)
+        try:
+            response = await fn()
+        except BaseException:
+            await asyncio.to_thread(self._store.delete, key)
+            raise
+        await asyncio.to_thread(
+            self._finish, key, fingerprint, response, cacheable(response))
+        return response, False
+
+
+def default_cache():
+    # Shared between the worker processes when there is more than one
+    store = shared_state.store('idempotency')
+    if store is None:
+        return IdempotencyCache()
+    return SharedIdempotencyCache(store)
@@ -0,0 +1,70 @@
+"""
+JSON responses of the orchestrator without protobuf reflection.
+
+MessageToDict walks the descriptor of every suggested book it converts,
+book_to_dict reads the three fields of suggestions.Book directly and leaves
+out the empty ones as MessageToDict does. dumps() encodes with orjson when
+it is installed, else with the json module.
+
+RESPONSE_SERIALIZER picks the implementation:
+    orjson    book_to_dict and orjson, falls back to fields without orjson
+    fields    book_to_dict and the json module
+    protobuf  MessageToDict and the json module, as before
+
+Usage:
+
+    app.json = serialization.JSONProvider(app)
+    body = serialization.dumps({'suggestedBooks': serialization.books(resp.books)})
+"""
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+from google.protobuf.json_format import MessageToDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RESPONSE_SERIALIZER = os.getenv('RESPONSE_SERIALIZER', 'orjson')
+if RESPONSE_SERIALIZER == 'orjson' and orjson is None:
+    print("Orchestrator - orjson is not installed, serializing responses with json")
+    RESPONSE_SERIALIZER = 'fields'
+
+
+def book_to_dict(book):
+    # Same output as MessageToDict(book) for a suggestions.Book
+    result = {}
+    if book.bookId:
+        result['bookId'] = book.bookId
+    if book.title:
+        result['title'] = book.title
+    if book.author:
+        result['author'] = book.author
+    return result
+
+
+if RESPONSE_SERIALIZER == 'protobuf':
+    def books(books):
+        return [MessageToDict(book) for book in books]
+else:
+    def books(books):
+        return [book_to_dict(book) for book in books]
+
+
+if RESPONSE_SERIALIZER == 'orjson':
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class JSONProvider(DefaultJSONProvider):
+    # Flask JSON responses encoded with dumps(), key order kept
+    sort_keys = False
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj) + b'\n', mimetype=self.mimetype)
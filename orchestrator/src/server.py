@@ -0,0 +1,60 @@
+"""
+Production entry point of the orchestrator.
+
+Serves /checkout from ORCHESTRATOR_WORKERS processes sharing one port:
+gunicorn with threaded workers (ORCHESTRATOR_THREADS requests at a time per
+process) for the Flask app, or uvicorn's process manager for the ASGI app
+with ORCHESTRATOR_MODE=async. State that later requests have to find on any
+worker lives in the shared state database, see shared_state.py.
+
+The workers import the app after they are started, so gRPC channels are
+never created before a fork.
+
+Usage:
+
+ORCHESTRATOR_WORKERS=4 python orchestrator/src/app.py
+"""
+import os
+
+from gunicorn.app.base import BaseApplication
+
+import shared_state
+
+ORCHESTRATOR_THREADS = int(os.getenv('ORCHESTRATOR_THREADS', '16'))
+# Workers that do not answer the arbiter for this long are restarted (seconds)
+WORKER_TIMEOUT = int(os.getenv('ORCHESTRATOR_WORKER_TIMEOUT', '30'))
+PORT = int(os.getenv('PORT', '5000'))
+
+
+class GunicornServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Runs in every worker
+        import app
+        return app.app
+
+
+def serve(mode):
+    workers = max(shared_state.ORCHESTRATOR_WORKERS, 1)
+    print(f"Orchestrator - Serving {mode} mode with {workers} workers")
+    if mode == 'async':
+        import uvicorn
+        uvicorn.run('asgi_app:app', host='0.0.0.0', port=PORT,
+                    workers=workers, access_log=False)
+        return
+    GunicornServer({
+        'bind': f'0.0.0.0:{PORT}',
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': ORCHESTRATOR_THREADS,
+        'timeout': WORKER_TIMEOUT,
+        'keepalive': 5,
+        'preload_app': False,
+    }).run()
@@ -0,0 +1,89 @@
+"""
+State shared by the worker processes of one orchestrator.
+
+With ORCHESTRATOR_WORKERS > 1 consecutive requests of a client can land on
+different processes. Whatever a later request has to see, the idempotency
+claims and responses and the background suggestions, is then kept in a
+SQLite database on local disk (ORCHESTRATOR_STATE_DB) instead of process
+memory. The state of a checkout in progress, such as its vector clock,
+stays in process: a checkout runs from start to finish in the worker that
+accepted it.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+ORCHESTRATOR_WORKERS = int(os.getenv('ORCHESTRATOR_WORKERS', '0'))
+# Only used when there is more than one worker, unless set explicitly
+ORCHESTRATOR_STATE_DB = os.getenv('ORCHESTRATOR_STATE_DB') or (
+    '/tmp/orchestrator_state.db' if ORCHESTRATOR_WORKERS > 1 else '')
+# How often a process waiting for another one re-reads an entry (seconds)
+POLL_INTERVAL = 0.02
+# Expired rows are deleted every this many writes
+PURGE_EVERY = 1000
+
+
+class SharedStore:
+    # JSON values with a per-entry TTL, one table of the database per store.
+    # Connections are opened lazily per thread, so a store can be created
+    # before the server forks its workers.
+    def __init__(self, path, table):
+        self._path = path
+        self._table = table
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self._table} ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def _written(self, conn):
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            conn.execute(f'DELETE FROM {self._table} WHERE expires_at <= ?',
+                         (time.time(),))
+
+    def add(self, key, value, ttl) -> bool:
+        # Stores value unless the key holds a live entry, True if it did
+        now = time.time()
+        conn = self._connection()
+        cursor = conn.execute(
+            f'INSERT INTO {self._table} VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, '
+            f'expires_at = excluded.expires_at WHERE {self._table}.expires_at <= ?',
+            (key, json.dumps(value), now + ttl, now))
+        self._written(conn)
+        return cursor.rowcount == 1
+
+    def put(self, key, value, ttl):
+        conn = self._connection()
+        conn.execute(f'INSERT OR REPLACE INTO {self._table} VALUES (?, ?, ?)',
+                     (key, json.dumps(value), time.time() + ttl))
+        self._written(conn)
+
+    def get(self, key):
+        row = self._connection().execute(
+            f'SELECT value FROM {self._table} WHERE key = ? AND expires_at > ?',
+            (key, time.time())).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def delete(self, key):
+        self._connection().execute(
+            f'DELETE FROM {self._table} WHERE key = ?', (key,))
+
+
+def store(table):
+    # The shared store for table, None when the orchestrator runs one process
+    if not ORCHESTRATOR_STATE_DB:
+        return None
+    return SharedStore(ORCHESTRATOR_STATE_DB, table)
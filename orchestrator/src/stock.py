@@ -0,0 +1,86 @@
+"""
+Stock pre-check of a checkout.
+
+Before any verification, fraud check or LLM call is spent on an order, the
+orchestrator asks the books_database replicas for the stock of its books in
+one ReadBatch call, hedged across the replicas (see hedging.py), and rejects
+the order if it wants more copies of a book than there are. Stock levels are
+cached for STOCK_CACHE_TTL_MS, so a burst of orders for the same books costs
+a single lookup.
+
+Backups may lag the primary by a write and the cache lags both, so this only
+turns away orders that clearly cannot be fulfilled; the two-phase commit of
+the order executor still has the final word. If the lookup fails, the order
+goes on unchecked.
+"""
+import os
+
+import books_database_pb2 as books_database
+import books_database_pb2_grpc as books_database_grpc
+
+import hedging
+import metrics
+from order_store import OrderStore
+
+STOCK_CHECK = os.getenv('STOCK_CHECK', 'true').lower() == 'true'
+BOOKS_DATABASE_READ_ADDRS = os.getenv(
+    'BOOKS_DATABASE_READ_ADDRS',
+    'books_database:50051,books_database_primary:50051').split(',')
+STOCK_CACHE_TTL = float(os.getenv('STOCK_CACHE_TTL_MS', '1000')) / 1000
+STOCK_CACHE_SIZE = int(os.getenv('STOCK_CACHE_SIZE', '10000'))
+# The whole pre-check, a replica that does not answer in time is skipped
+STOCK_TIMEOUT = float(os.getenv('STOCK_TIMEOUT_MS', '100')) / 1000
+
+STOCK_LOOKUPS = metrics.counter(
+    'orchestrator_stock_lookups_total',
+    'Stock levels needed by the pre-check, by where they came from', ['source'])
+STOCK_REJECTED = metrics.counter(
+    'orchestrator_stock_rejected_total',
+    'Checkouts rejected by the stock pre-check')
+
+
+def wanted(items):
+    # Copies ordered per title, a title may be on several lines
+    copies = {}
+    for item in items:
+        copies[item['name']] = copies.get(item['name'], 0) + item['quantity']
+    return copies
+
+
+def shortage(copies, levels):
+    # Rejection message for the first title with too few copies, if any.
+    # Titles whose stock is unknown pass
+    for title, quantity in copies.items():
+        stock = levels.get(title)
+        if stock is not None and quantity > stock:
+            STOCK_REJECTED.inc()
+            return f"Not enough stock for {title}"
+    return None
+
+
+class StockCache:
+    def __init__(self, addresses=BOOKS_DATABASE_READ_ADDRS, ttl=STOCK_CACHE_TTL,
+                 max_size=STOCK_CACHE_SIZE):
+        self.levels = OrderStore(max_size=max_size, ttl=ttl)  # title -> stock
+        self.client = hedging.HedgedClient(
+            addresses, books_database_grpc.BooksDatabaseStub, 'ReadBatch')
+
+    def cached(self, titles):
+        # (stock of the cached titles, request for the others or None)
+        levels, missing = {}, []
+        for title in titles:
+            stock = self.levels.get(title)
+            if stock is None:
+                missing.append(title)
+            else:
+                levels[title] = stock
+        STOCK_LOOKUPS.inc(len(levels), source='cache')
+        if not missing:
+            return levels, None
+        return levels, books_database.ReadBatchRequest(titles=missing)
+
+    def store(self, response, levels):
+        STOCK_LOOKUPS.inc(len(response.stock), source='replica')
+        for title, stock in response.stock.items():
+            self.levels.put(title, stock)
+            levels[title] = stock
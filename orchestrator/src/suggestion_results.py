@@ -0,0 +1,129 @@
+"""
+Suggestions computed after /checkout has already answered.
+
+With SUGGESTIONS_MODE=background the orchestrator approves an order as soon
+as verification passes and it is enqueued, then asks the suggestions service
+off the critical path. The outcome is kept here for a while and served by
+/suggestions/<orderId> (plain JSON, optionally long-polling) and
+/suggestions/<orderId>/stream (server-sent events). With several worker
+processes the outcome is also written to the shared state database, so any
+worker can answer for an order.
+"""
+import asyncio
+import os
+import threading
+import time
+
+import shared_state
+from order_store import OrderStore
+
+# How long finished suggestions can still be fetched
+SUGGESTIONS_TTL = float(os.getenv('SUGGESTIONS_TTL_SECONDS', '600'))
+
+
+class PendingSuggestions:
+    def __init__(self):
+        self.status = 'pending'  # pending, ready or failed
+        self.books = []
+        self._ready = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._ready.is_set()
+
+    def finish(self, status, books):
+        with self._lock:
+            self.status = status
+            self.books = books
+            self._ready.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._ready.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout):
+        return self._ready.wait(timeout)
+
+    async def wait_async(self, timeout):
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        self.add_done_callback(lambda: loop.call_soon_threadsafe(ready.set))
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.done
+
+    def as_dict(self, order_id):
+        return {
+            'orderId': order_id,
+            'status': self.status,
+            'suggestedBooks': self.books,
+        }
+
+
+class SharedSuggestions(PendingSuggestions):
+    # Suggestions of an order checked out by another worker process
+    def __init__(self, order_id, record):
+        super().__init__()
+        self._order_id = order_id
+        self._update(record)
+
+    def _update(self, record):
+        if record is not None:
+            self.status = record['status']
+            self.books = record['books']
+
+    @property
+    def done(self):
+        return self.status != 'pending'
+
+    def wait(self, timeout):
+        give_up_at = time.monotonic() + timeout
+        while not self.done and time.monotonic() < give_up_at:
+            time.sleep(shared_state.POLL_INTERVAL)
+            self._update(shared.get(self._order_id))
+        return self.done
+
+    async def wait_async(self, timeout):
+        give_up_at = time.monotonic() + timeout
+        while not self.done and time.monotonic() < give_up_at:
+            await asyncio.sleep(shared_state.POLL_INTERVAL)
+            # sqlite blocks, keep it off the event loop
+            self._update(await asyncio.to_thread(shared.get, self._order_id))
+        return self.done
+
+
+results = OrderStore(ttl=SUGGESTIONS_TTL)  # order_id -> PendingSuggestions
+shared = shared_state.store('suggestions')  # None with a single worker
+
+
+def _publish(order_id, pending):
+    shared.put(order_id, {'status': pending.status, 'books': pending.books},
+               SUGGESTIONS_TTL)
+
+
+def track(order_id) -> PendingSuggestions:
+    pending = PendingSuggestions()
+    results.put(order_id, pending)
+    if shared is not None:
+        _publish(order_id, pending)
+        pending.add_done_callback(lambda: _publish(order_id, pending))
+    return pending
+
+
+def get(order_id) -> PendingSuggestions:
+    pending = results.get(order_id)
+    if pending is None and shared is not None:
+        record = shared.get(order_id)
+        if record is not None:
+            pending = SharedSuggestions(order_id, record)
+    return pending
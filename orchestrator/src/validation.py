@@ -0,0 +1,168 @@
+"""
+Request validation compiled from the OpenAPI specification.
+
+The schemas of utils/api/bookstore.yaml are turned into Python source once,
+at import: one straight-line function per schema, with every $ref inlined,
+patterns precompiled and no lookups in the specification left at request
+time. A validator returns None for a valid document, or a message naming
+the first offending field, e.g. "creditCard.cvv: expected a string".
+
+Supported keywords: type, nullable, required, properties, items, enum,
+minLength, maxLength, pattern, minimum, maximum, minItems, maxItems,
+additionalProperties: false and $ref to '#/components/schemas/...'.
+Everything else is documentation.
+
+Usage:
+
+    validate_checkout = validation.compile_schema(spec, 'CheckoutRequest')
+    error = validate_checkout(json.loads(body))
+"""
+import os
+import re
+
+import yaml
+
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+API_SPEC = os.getenv('BOOKSTORE_API_SPEC', os.path.abspath(
+    os.path.join(FILE, '../../../utils/api/bookstore.yaml')))
+
+# isinstance checks of the JSON types; bool is an int in Python but not in JSON
+TYPE_CHECKS = {
+    'object': 'isinstance({v}, dict)',
+    'array': 'isinstance({v}, list)',
+    'string': 'isinstance({v}, str)',
+    'boolean': 'isinstance({v}, bool)',
+    'integer': 'isinstance({v}, int) and not isinstance({v}, bool)',
+    'number': 'isinstance({v}, (int, float)) and not isinstance({v}, bool)',
+}
+TYPE_NAMES = {'object': 'an object', 'array': 'an array', 'string': 'a string',
+              'boolean': 'a boolean', 'integer': 'an integer', 'number': 'a number'}
+MAX_REF_DEPTH = 32
+
+
+def load_spec(path=API_SPEC):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+class _Compiler:
+    def __init__(self, spec):
+        self.spec = spec
+        self.lines = []
+        self.constants = {}  # name -> value used by the generated code
+        self._names = 0
+
+    def name(self, prefix):
+        self._names += 1
+        return f'{prefix}{self._names}'
+
+    def constant(self, value):
+        name = self.name('_c')
+        self.constants[name] = value
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def resolve(self, schema, depth=0):
+        while '$ref' in schema:
+            ref = schema['$ref']
+            if not ref.startswith('#/') or depth > MAX_REF_DEPTH:
+                raise ValueError(f"Unsupported $ref {ref}")
+            schema = self.spec
+            for part in ref[2:].split('/'):
+                schema = schema[part]
+            depth += 1
+        return schema
+
+    @staticmethod
+    def path(parts):
+        # Python expression for the location of a value, loop indices are
+        # variable names wrapped in a tuple
+        pieces = []
+        for part in parts:
+            if isinstance(part, tuple):
+                pieces.append(f"'[' + str({part[0]}) + ']'")
+            else:
+                pieces.append(repr(('.' if pieces else '') + part))
+        return ' + '.join(pieces) if pieces else "'body'"
+
+    def fail(self, indent, parts, message):
+        self.emit(indent, f"return {self.path(parts)} + {': ' + message!r}")
+
+    def check(self, schema, v, parts, indent):
+        # Code that returns an error message if the value in v does not match
+        schema = self.resolve(schema)
+        if schema.get('nullable'):
+            self.emit(indent, f'if {v} is not None:')
+            indent += 1
+        kind = schema.get('type')
+        if kind is not None:
+            self.emit(indent, f"if not ({TYPE_CHECKS[kind].format(v=v)}):")
+            self.fail(indent + 1, parts, f'expected {TYPE_NAMES[kind]}')
+        if 'enum' in schema:
+            self.emit(indent, f"if {v} not in {self.constant(frozenset(schema['enum']))}:")
+            self.fail(indent + 1, parts, f"expected one of {', '.join(map(str, schema['enum']))}")
+        if 'minLength' in schema:
+            self.emit(indent, f"if len({v}) < {int(schema['minLength'])}:")
+            self.fail(indent + 1, parts, f"shorter than {schema['minLength']} characters")
+        if 'maxLength' in schema:
+            self.emit(indent, f"if len({v}) > {int(schema['maxLength'])}:")
+            self.fail(indent + 1, parts, f"longer than {schema['maxLength']} characters")
+        if 'pattern' in schema:
+            pattern = self.constant(re.compile(schema['pattern']))
+            self.emit(indent, f"if {pattern}.search({v}) is None:")
+            self.fail(indent + 1, parts, f"does not match {schema['pattern']}")
+        if 'minimum' in schema:
+            self.emit(indent, f"if {v} < {schema['minimum']!r}:")
+            self.fail(indent + 1, parts, f"less than {schema['minimum']}")
+        if 'maximum' in schema:
+            self.emit(indent, f"if {v} > {schema['maximum']!r}:")
+            self.fail(indent + 1, parts, f"greater than {schema['maximum']}")
+        if 'minItems' in schema:
+            self.emit(indent, f"if len({v}) < {int(schema['minItems'])}:")
+            self.fail(indent + 1, parts, f"fewer than {schema['minItems']} items")
+        if 'maxItems' in schema:
+            self.emit(indent, f"if len({v}) > {int(schema['maxItems'])}:")
+            self.fail(indent + 1, parts, f"more than {schema['maxItems']} items")
+        required = schema.get('required', ())
+        for key, subschema in schema.get('properties', {}).items():
+            value = self.name('v')
+            self.emit(indent, f"{value} = {v}.get({key!r}, _missing)")
+            if key in required:
+                self.emit(indent, f"if {value} is _missing:")
+                self.fail(indent + 1, [*parts, key], 'required')
+                self.check(subschema, value, [*parts, key], indent)
+            else:
+                self.emit(indent, f"if {value} is not _missing:")
+                self.check(subschema, value, [*parts, key], indent + 1)
+                self.emit(indent + 1, 'pass')
+        for key in required:
+            if key not in schema.get('properties', {}):
+                self.emit(indent, f"if {key!r} not in {v}:")
+                self.fail(indent + 1, [*parts, key], 'required')
+        if schema.get('additionalProperties') is False:
+            known, key = self.constant(frozenset(schema.get('properties', {}))), self.name('k')
+            self.emit(indent, f"for {key} in {v}:")
+            self.emit(indent + 1, f"if {key} not in {known}:")
+            prefix = f"{self.path(parts)} + '.'" if parts else "''"
+            self.emit(indent + 2, f"return {prefix} + str({key}) + ': unexpected property'")
+        if 'items' in schema:
+            index, item = self.name('i'), self.name('v')
+            self.emit(indent, f"for {index}, {item} in enumerate({v}):")
+            self.check(schema['items'], item, [*parts, (index,)], indent + 1)
+            self.emit(indent + 1, 'pass')
+
+
+def compile_schema(spec, name):
+    # Validator function for components/schemas/<name> of spec
+    compiler = _Compiler(spec)
+    compiler.emit(0, 'def validate(data):')
+    compiler.check({'$ref': f'#/components/schemas/{name}'}, 'data', [], 1)
+    compiler.emit(1, 'return None')
+    source = '\n'.join(compiler.lines)
+    namespace = {'_missing': object(), **compiler.constants}
+    exec(compile(source, f'<schema {name}>', 'exec'), namespace)
+    validate = namespace['validate']
+    validate.source = source
+    return validate
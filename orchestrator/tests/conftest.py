@@ -0,0 +1,12 @@
+import sys
+import os
+
+# The orchestrator modules import each other and utils/ as top-level
+# modules, as they do when orchestrator/src/app.py runs
+FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
+grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
+sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
+src_path = os.path.abspath(os.path.join(FILE, '../../src'))
+sys.path.insert(0, src_path)
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+from admission import Limiter
+
+
+def limiter(limit=2, queue_size=2, queue_timeout=1.0, **kwargs):
+    return Limiter(limit, queue_size=queue_size, queue_timeout=queue_timeout,
+                   adaptive=kwargs.pop('adaptive', False), **kwargs)
+
+
+def wait_until(condition, timeout=1.0):
+    give_up_at = time.monotonic() + timeout
+    while not condition() and time.monotonic() < give_up_at:
+        time.sleep(0.001)
+    return condition()
+
+
+def test_admits_up_to_the_limit_then_rejects_beyond_the_queue():
+    gate = limiter(limit=2, queue_size=0)
+    assert gate.acquire() is True
+    assert gate.acquire() is True
+    assert gate.acquire() is False
+    gate.release()
+    assert gate.acquire() is True
+    assert gate.in_flight == 2
+
+
+def test_queued_checkout_gets_the_released_slot():
+    gate = limiter(limit=1, queue_size=1)
+    assert gate.acquire()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(gate.acquire()))
+    waiter.start()
+    assert wait_until(lambda: gate.queued == 1)
+    assert gate.acquire() is False  # queue full
+    gate.release()
+    waiter.join(1)
+    assert admitted == [True]
+    assert gate.in_flight == 1
+    assert gate.queued == 0
+
+
+def test_queued_checkout_gives_up_after_the_timeout():
+    gate = limiter(limit=1, queue_size=1, queue_timeout=0.05)
+    assert gate.acquire()
+    started = time.monotonic()
+    assert gate.acquire() is False
+    assert time.monotonic() - started >= 0.05
+    assert gate.queued == 0
+    assert gate.in_flight == 1
+
+
+def test_async_queued_checkout_gets_the_released_slot():
+    async def run():
+        gate = limiter(limit=1, queue_size=1)
+        assert await gate.acquire_async()
+        waiter = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0.01)
+        assert gate.queued == 1
+        gate.release()
+        assert await waiter is True
+        assert gate.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_async_queued_checkout_gives_up_after_the_timeout():
+    async def run():
+        gate = limiter(limit=1, queue_size=1, queue_timeout=0.05)
+        assert await gate.acquire_async()
+        assert await gate.acquire_async() is False
+        assert gate.queued == 0
+        assert gate.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_async_checkout_leaves_the_queue():
+    async def run():
+        gate = limiter(limit=1, queue_size=1)
+        assert await gate.acquire_async()
+        waiter = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert gate.queued == 0
+        gate.release()
+        assert gate.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_async_checkout_frees_a_slot_handed_over_meanwhile():
+    async def run():
+        gate = limiter(limit=1, queue_size=1)
+        assert await gate.acquire_async()
+        waiter = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0.01)
+        # The client goes away, and the slot is handed over to the waiter
+        # before it gets to see the cancellation
+        waiter.cancel()
+        gate.release()
+        admitted, = await asyncio.gather(waiter, return_exceptions=True)
+        assert isinstance(admitted, asyncio.CancelledError)
+        assert gate.in_flight == 0
+        assert await gate.acquire_async() is True
+
+    asyncio.run(run())
+
+
+def test_adaptive_limit_backs_off_on_overload_and_grows_back():
+    gate = limiter(limit=20, queue_size=0, adaptive=True, min_limit=4)
+    for _ in range(20):
+        gate.acquire()
+    gate.release(0.01)
+    assert gate.limit == 20
+    gate.release(0.01, overloaded=True)
+    assert gate.limit == 18
+    # At most one back-off per round of checkouts
+    gate.release(0.01, overloaded=True)
+    assert gate.limit == 18
+
+    for _ in range(200):
+        gate.acquire()
+        gate.release(0.01)
+    assert gate.limit == 20
+
+
+def test_adaptive_limit_stays_above_the_minimum():
+    gate = limiter(limit=5, queue_size=0, adaptive=True, min_limit=4)
+    for _ in range(10):
+        gate.acquire()
+        gate.release(0.0, overloaded=True)
+    assert gate.limit == 4
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import grpc
+import pytest
+
+import channel_pool
+from channel_pool import AioChannelPool, ChannelPool
+
+# Nothing listens there, so channels to it fail to connect
+TARGET = 'localhost:1'
+
+# Closing a channel grpc still polls the state of makes its polling thread
+# fail with "Channel closed!", which grpc's own close() does as well
+pytestmark = pytest.mark.filterwarnings(
+    'ignore::pytest.PytestUnhandledThreadExceptionWarning')
+
+
+class Stub:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+def probe(channel):
+    # Code of a call through channel, or the error of a closed channel
+    try:
+        channel.unary_unary('/test.Service/Method')(b'', timeout=0.05)
+    except grpc.RpcError as e:
+        return e.code()
+    except ValueError as e:
+        return str(e)
+
+
+@pytest.fixture
+def grace(monkeypatch):
+    monkeypatch.setattr(channel_pool, 'RETIRED_CHANNEL_GRACE', 0.3)
+    return 0.3
+
+
+def failed(pool, target=TARGET, since=5.0):
+    # Marks the channel to target stale as if it failed since seconds ago
+    entry = pool._entries[target]
+    entry._on_state_change(grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+    entry.created_at -= since
+
+
+def test_channels_and_stubs_are_shared_per_target():
+    pool = ChannelPool()
+    stub = pool.get_stub(TARGET, Stub)
+    assert pool.get_stub(TARGET, Stub) is stub
+    assert pool.get_channel(TARGET) is stub.channel
+    assert pool.get_channel('localhost:2') is not stub.channel
+    pool.close()
+
+
+def test_failed_channel_is_rebuilt_and_the_old_one_closed_after_the_grace(grace):
+    pool = ChannelPool()
+    old = pool.get_channel(TARGET)
+    failed(pool)
+    new = pool.get_channel(TARGET)
+    assert new is not old
+    assert pool.get_stub(TARGET, Stub).channel is new
+    # Calls still running on the old channel are not cancelled right away
+    assert probe(old) == grpc.StatusCode.UNAVAILABLE
+    time.sleep(grace * 2)
+    assert 'closed' in probe(old)
+    assert probe(new) == grpc.StatusCode.UNAVAILABLE
+    pool.close()
+
+
+def test_failed_channel_is_not_rebuilt_more_than_once_a_second():
+    pool = ChannelPool()
+    channel = pool.get_channel(TARGET)
+    failed(pool, since=0)
+    assert pool.get_channel(TARGET) is channel
+    pool.close()
+
+
+def test_channel_that_recovered_is_kept():
+    pool = ChannelPool()
+    channel = pool.get_channel(TARGET)
+    failed(pool)
+    pool._entries[TARGET]._on_state_change(grpc.ChannelConnectivity.READY)
+    assert pool.get_channel(TARGET) is channel
+    pool.close()
+
+
+def test_reset_forces_a_new_channel(grace):
+    pool = ChannelPool()
+    channel = pool.get_channel(TARGET)
+    pool.reset(TARGET)
+    assert pool.get_channel(TARGET) is not channel
+    pool.close()
+
+
+def test_aio_failed_channel_is_rebuilt_and_the_old_one_closed_after_the_grace(grace):
+    async def run():
+        pool = AioChannelPool()
+        stub = pool.get_stub(TARGET, Stub)
+        assert pool.get_stub(TARGET, Stub) is stub
+        old = stub.channel
+        state = old.get_state(try_to_connect=True)
+        while state != grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+            await asyncio.wait_for(old.wait_for_state_change(state), 5)
+            state = old.get_state()
+        assert pool.get_channel(TARGET) is old  # younger than a second
+        pool._channels[TARGET] = (old, time.monotonic() - 5)
+
+        new = pool.get_stub(TARGET, Stub).channel
+        assert new is not old
+        assert old.get_state() != grpc.ChannelConnectivity.SHUTDOWN
+        await asyncio.sleep(grace * 2)
+        assert old.get_state() == grpc.ChannelConnectivity.SHUTDOWN
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_aio_pools_are_per_event_loop():
+    async def pool():
+        return channel_pool.get_aio_pool()
+
+    async def same():
+        return channel_pool.get_aio_pool() is channel_pool.get_aio_pool()
+
+    assert asyncio.run(same())
+    assert asyncio.run(pool()) is not asyncio.run(pool())
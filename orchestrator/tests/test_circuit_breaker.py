@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import grpc
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+OK = grpc.StatusCode.OK
+UNAVAILABLE = grpc.StatusCode.UNAVAILABLE
+
+
+def breaker(target='svc:50051', open_seconds=0.0, half_open_calls=2, **kwargs):
+    return CircuitBreaker(target, window=4, min_calls=4, failure_rate=0.5,
+                          slow_call=1.0, slow_call_rate=1.0,
+                          open_seconds=open_seconds, half_open_calls=half_open_calls,
+                          **kwargs)
+
+
+def trip(cb):
+    for _ in range(4):
+        assert cb.allow()
+        cb.record(0.01, UNAVAILABLE)
+    assert cb.state == OPEN
+
+
+def test_opens_when_enough_calls_fail():
+    cb = breaker()
+    for code in (OK, OK, UNAVAILABLE):
+        cb.record(0.01, code)
+    assert cb.state == CLOSED
+    cb.record(0.01, UNAVAILABLE)
+    assert cb.state == OPEN
+
+
+def test_application_errors_do_not_open_it():
+    cb = breaker()
+    for _ in range(4):
+        cb.record(0.01, grpc.StatusCode.INVALID_ARGUMENT)
+    assert cb.state == CLOSED
+
+
+def test_slow_calls_open_it():
+    cb = breaker()
+    for _ in range(4):
+        cb.record(2.0, OK)
+    assert cb.state == OPEN
+
+
+def test_open_circuit_rejects_until_it_may_probe():
+    cb = breaker(open_seconds=0.05)
+    trip(cb)
+    assert cb.allow() is False
+    time.sleep(0.06)
+    assert cb.allow() is True
+    assert cb.state == HALF_OPEN
+
+
+def test_half_open_lets_a_few_probes_through_and_closes_when_they_succeed():
+    cb = breaker()
+    trip(cb)
+    assert cb.allow() and cb.allow()
+    assert cb.state == HALF_OPEN
+    assert cb.allow() is False
+    cb.record(0.01, OK)
+    assert cb.state == HALF_OPEN
+    cb.record(0.01, OK)
+    assert cb.state == CLOSED
+    assert cb.allow()
+
+
+def test_failed_probe_opens_it_again():
+    cb = breaker()
+    trip(cb)
+    assert cb.allow()
+    cb.record(0.01, UNAVAILABLE)
+    assert cb.state == OPEN
+
+
+def test_cancelled_probes_go_to_the_next_calls():
+    cb = breaker()
+    trip(cb)
+    assert cb.allow() and cb.allow()
+    assert cb.allow() is False
+    cb.release()
+    cb.release()
+    assert cb.allow() and cb.allow()
+    cb.record(0.01, OK)
+    cb.record(0.01, OK)
+    assert cb.state == CLOSED
+
+
+def test_release_outside_half_open_changes_nothing():
+    cb = breaker()
+    cb.release()
+    assert cb.state == CLOSED
+    assert cb.allow()
+
+
+def test_aio_interceptor_gives_back_the_probe_of_a_cancelled_call():
+    target = 'cancelled-probes:50051'
+    cb = circuit_breaker.protect(target, window=4, min_calls=4, open_seconds=0.0,
+                                 half_open_calls=1)
+    trip(cb)
+    interceptor = circuit_breaker.AioClientInterceptor(target)
+
+    async def hang(client_call_details, request):
+        await asyncio.sleep(10)
+
+    async def run():
+        for _ in range(3):
+            call = asyncio.ensure_future(interceptor.intercept_unary_unary(hang, None, None))
+            await asyncio.sleep(0.01)
+            call.cancel()
+            await asyncio.gather(call, return_exceptions=True)
+            assert cb.state == HALF_OPEN
+            assert cb._probes == 0
+
+    asyncio.run(run())
+    assert cb.allow() is True
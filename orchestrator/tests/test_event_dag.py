@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent import futures
+
+import pytest
+
+from event_dag import Deadline, DeadlineExceeded, EventGraph
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def event(name, log, delay=0.0, error=None):
+    # Event that logs its start and end, sleeps for delay and may fail
+    def fn(order, timeout=None):
+        log.append(('start', name, timeout))
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        log.append(('end', name))
+        return name
+    return fn
+
+
+def async_event(name, log, delay=0.0, error=None):
+    async def fn(order, timeout=None):
+        log.append(('start', name, timeout))
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            log.append(('cancelled', name))
+            raise
+        if error is not None:
+            raise error
+        log.append(('end', name))
+        return name
+    return fn
+
+
+def diamond(make, log, **overrides):
+    # a and b run concurrently, c joins them, d follows c
+    delays = {'a': 0.05, 'b': 0.05, 'c': 0.0, 'd': 0.0}
+    graph = EventGraph()
+    for name, deps in (('a', ()), ('b', ()), ('c', ('a', 'b')), ('d', ('c',))):
+        graph.add(name, make(name, log, **overrides.get(name, {'delay': delays[name]})),
+                  deps=deps)
+    return graph
+
+
+def starts(log):
+    return [entry[1] for entry in log if entry[0] == 'start']
+
+
+def test_events_run_after_all_their_dependencies():
+    log = []
+    result = diamond(event, log).run({})
+    assert result.ok
+    assert result.results == {'a': 'a', 'b': 'b', 'c': 'c', 'd': 'd'}
+    assert sorted(starts(log)[:2]) == ['a', 'b']
+    assert log.index(('start', 'c', None)) > log.index(('end', 'a'))
+    assert log.index(('start', 'c', None)) > log.index(('end', 'b'))
+    assert starts(log)[-1] == 'd'
+    assert set(result.timings) == {'a', 'b', 'c', 'd'}
+
+
+def test_independent_events_run_concurrently():
+    graph = EventGraph()
+    for name in 'abcd':
+        graph.add(name, event(name, [], delay=0.2))
+    started = time.monotonic()
+    assert graph.run({}).ok
+    assert time.monotonic() - started < 0.6
+
+
+def test_failed_event_stops_the_events_after_it():
+    log = []
+    result = diamond(event, log, b={'error': ValueError('bad card')}).run({})
+    assert not result.ok
+    assert isinstance(result.error, ValueError)
+    assert result.failed_event == 'b'
+    assert 'c' not in starts(log) and 'd' not in starts(log)
+    assert set(result.cancelled) >= {'c', 'd'}
+
+
+def test_observer_sees_every_finished_event():
+    seen = []
+    graph = diamond(event, [], c={'error': RuntimeError('down')})
+    graph.observer = lambda name, duration, error: seen.append((name, type(error)))
+    graph.run({})
+    assert sorted(seen) == [('a', type(None)), ('b', type(None)), ('c', RuntimeError)]
+
+
+def test_events_see_the_callers_context():
+    graph = EventGraph().add('a', lambda order: request_id.get())
+    request_id.set('r1')
+    assert graph.run({}).results == {'a': 'r1'}
+
+
+def test_deadline_is_shared_along_the_heaviest_chain():
+    log = []
+    graph = EventGraph()
+    graph.add('a', event('a', log))
+    graph.add('b', event('b', log), deps=['a'], weight=3.0)
+    graph.add('c', event('c', log), deps=['a'])
+    assert graph.chain_weights() == {'a': 4.0, 'b': 3.0, 'c': 1.0}
+    assert graph.run({}, deadline=Deadline(1.0)).ok
+    timeouts = {entry[1]: entry[2] for entry in log if entry[0] == 'start'}
+    assert timeouts['a'] == pytest.approx(0.25, abs=0.02)
+    # The time a did not need flows to the events after it
+    assert timeouts['b'] == pytest.approx(0.95, abs=0.05)
+    assert timeouts['c'] == pytest.approx(0.95, abs=0.05)
+
+
+def test_event_after_the_deadline_fails_without_being_called():
+    log = []
+    graph = EventGraph()
+    graph.add('a', event('a', log, delay=0.1))
+    graph.add('b', event('b', log), deps=['a'])
+    result = graph.run({}, deadline=Deadline(0.05))
+    assert isinstance(result.error, DeadlineExceeded)
+    assert result.failed_event == 'b'
+    assert starts(log) == ['a']
+
+
+def test_declaring_events_checks_dependencies():
+    graph = EventGraph().add('a', None)
+    with pytest.raises(ValueError, match='unknown event'):
+        graph.add('b', None, deps=['missing'])
+    with pytest.raises(ValueError, match='twice'):
+        graph.add('a', None)
+
+
+def test_without_drops_the_events_and_their_dependants():
+    graph = diamond(event, [])
+    assert list(graph.without('b').events) == ['a']
+    assert list(graph.without('d').events) == ['a', 'b', 'c']
+
+
+def test_async_events_run_after_all_their_dependencies():
+    log = []
+    result = asyncio.run(diamond(async_event, log).run_async({}))
+    assert result.results == {'a': 'a', 'b': 'b', 'c': 'c', 'd': 'd'}
+    assert log.index(('start', 'c', None)) > log.index(('end', 'a'))
+    assert log.index(('start', 'c', None)) > log.index(('end', 'b'))
+
+
+def test_async_failed_event_cancels_the_running_ones():
+    log = []
+    graph = EventGraph()
+    graph.add('slow', async_event('slow', log, delay=5))
+    graph.add('bad', async_event('bad', log, delay=0.01, error=ValueError('bad')))
+    graph.add('after', async_event('after', log), deps=['slow'])
+
+    async def run():
+        result = await graph.run_async({})
+        await asyncio.sleep(0)  # let the cancellation land
+        return result
+
+    started = time.monotonic()
+    result = asyncio.run(run())
+    assert time.monotonic() - started < 1
+    assert result.failed_event == 'bad'
+    assert ('cancelled', 'slow') in log
+    assert sorted(result.cancelled) == ['after', 'slow']
+
+
+def test_async_deadline_reaches_the_events():
+    log = []
+    graph = EventGraph()
+    graph.add('a', async_event('a', log, delay=0.1))
+    graph.add('b', async_event('b', log), deps=['a'])
+    result = asyncio.run(graph.run_async({}, deadline=Deadline(0.05)))
+    assert isinstance(result.error, DeadlineExceeded)
+    assert log[0] == ('start', 'a', pytest.approx(0.025, abs=0.01))
+    assert starts(log) == ['a']
+
+
+def test_sync_events_run_on_the_given_executor():
+    names = []
+    graph = EventGraph().add('a', lambda order: names.append(
+        threading.current_thread().name))
+    with futures.ThreadPoolExecutor(thread_name_prefix='mine') as executor:
+        graph.run({}, executor=executor)
+    assert names[0].startswith('mine')
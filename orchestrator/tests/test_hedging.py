@@ -0,0 +1,127 @@
+import asyncio
+import threading
+from concurrent import futures
+
+import grpc
+import pytest
+
+import hedging
+from hedging import HedgedClient
+
+
+class Error(grpc.RpcError):
+    def __init__(self, code):
+        self._code = code
+
+    def code(self):
+        return self._code
+
+
+class Replica:
+    # Stands in for the stub of one replica, Read answers its name after
+    # delay seconds, or fails with code
+    def __init__(self, name, delay=0.0, code=None):
+        self.name = name
+        self.delay = delay
+        self.code = code
+        self.calls = 0
+        self.Read = self
+
+    def _outcome(self):
+        if self.code is not None:
+            raise Error(self.code)
+        return self.name
+
+    def future(self, request, timeout=None):
+        self.calls += 1
+        future = futures.Future()
+
+        def finish():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._outcome())
+                except Error as e:
+                    future.set_exception(e)
+
+        threading.Timer(self.delay, finish).start()
+        return future
+
+    async def __call__(self, request, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self._outcome()
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    replicas = {}
+    monkeypatch.setattr(hedging.channel_pool, 'get_stub',
+                        lambda target, stub_cls: replicas[target])
+    monkeypatch.setattr(hedging.channel_pool, 'get_aio_stub',
+                        lambda target, stub_cls: replicas[target])
+    return replicas
+
+
+def client(replicas, primary, backup, **kwargs):
+    replicas.update(a=primary, b=backup)
+    return HedgedClient(['a', 'b'], None, 'Read', **kwargs)
+
+
+def test_fast_primary_is_not_hedged(replicas):
+    books = client(replicas, Replica('a'), Replica('b'))
+    assert books.call(None, timeout=1) == 'a'
+    assert replicas['b'].calls == 0
+
+
+def test_slow_primary_is_hedged_and_the_backup_wins(replicas):
+    books = client(replicas, Replica('a', delay=0.5), Replica('b'))
+    assert books.call(None, timeout=1) == 'b'
+    assert replicas['b'].calls == 1
+
+
+def test_unavailable_primary_fails_over_outside_the_budget(replicas):
+    books = client(replicas, Replica('a', code=grpc.StatusCode.UNAVAILABLE),
+                   Replica('b'), burst=0, max_extra_load=0)
+    assert books.call(None, timeout=1) == 'b'
+
+
+def test_request_errors_are_returned_without_hedging(replicas):
+    books = client(replicas, Replica('a', code=grpc.StatusCode.INVALID_ARGUMENT),
+                   Replica('b'))
+    with pytest.raises(Error) as error:
+        books.call(None, timeout=1)
+    assert error.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+    assert replicas['b'].calls == 0
+
+
+def test_hedges_stop_when_the_budget_is_used_up(replicas):
+    books = client(replicas, Replica('a', delay=0.2), Replica('b', delay=0.2),
+                   burst=1, max_extra_load=0)
+    books.call(None, timeout=1)  # hedged, a then b
+    books.call(None, timeout=1)  # b only
+    assert replicas['a'].calls + replicas['b'].calls == 3
+    assert books._budget == 0
+
+
+def test_async_slow_primary_is_hedged_and_the_backup_wins(replicas):
+    books = client(replicas, Replica('a', delay=0.5), Replica('b'))
+    assert asyncio.run(books.call_async(None, timeout=1)) == 'b'
+    assert replicas['b'].calls == 1
+
+
+def test_async_request_errors_are_returned_without_hedging(replicas):
+    books = client(replicas, Replica('a', code=grpc.StatusCode.NOT_FOUND),
+                   Replica('b'))
+    with pytest.raises(Error) as error:
+        asyncio.run(books.call_async(None, timeout=1))
+    assert error.value.code() == grpc.StatusCode.NOT_FOUND
+    assert replicas['b'].calls == 0
+
+
+def test_async_deadline_exceeded_primary_is_hedged_only_within_the_budget(replicas):
+    books = client(replicas, Replica('a', code=grpc.StatusCode.DEADLINE_EXCEEDED),
+                   Replica('b'), burst=0, max_extra_load=0)
+    with pytest.raises(Error) as error:
+        asyncio.run(books.call_async(None, timeout=1))
+    assert error.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    assert replicas['b'].calls == 0
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+
+import pytest
+
+import idempotency
+from idempotency import (IdempotencyCache, InProgressError, KeyReusedError,
+                         SharedIdempotencyCache)
+from shared_state import SharedStore
+
+
+def approved(order_id='1'):
+    return {'orderId': order_id, 'status': 'Order Approved'}
+
+
+def test_first_request_runs_later_ones_replay():
+    cache = IdempotencyCache()
+    calls = []
+
+    def checkout():
+        calls.append(1)
+        return approved()
+
+    assert cache.run_once('key', b'{}', checkout) == (approved(), False)
+    assert cache.run_once('key', b'{}', checkout) == (approved(), True)
+    assert len(calls) == 1
+
+
+def test_key_reused_with_another_body():
+    cache = IdempotencyCache()
+    cache.run_once('key', b'{"a": 1}', approved)
+    with pytest.raises(KeyReusedError):
+        cache.run_once('key', b'{"a": 2}', approved)
+
+
+def test_responses_that_are_not_cacheable_run_again():
+    cache = IdempotencyCache()
+    cache.run_once('key', b'{}', approved, cacheable=lambda response: False)
+    assert cache.run_once('key', b'{}', lambda: approved('2')) == (approved('2'), False)
+
+
+def test_failed_checkout_gives_the_key_up():
+    cache = IdempotencyCache()
+
+    def fail():
+        raise RuntimeError('down')
+
+    with pytest.raises(RuntimeError):
+        cache.run_once('key', b'{}', fail)
+    assert cache.run_once('key', b'{}', approved) == (approved(), False)
+
+
+def test_duplicate_waits_for_the_first_request():
+    cache = IdempotencyCache()
+    started, finish = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        finish.wait(1)
+        return approved()
+
+    owner = threading.Thread(target=cache.run_once, args=('key', b'{}', slow))
+    owner.start()
+    started.wait(1)
+    threading.Timer(0.05, finish.set).start()
+    assert cache.run_once('key', b'{}', approved) == (approved(), True)
+    owner.join(1)
+
+
+def test_duplicate_gives_up_while_the_first_request_runs(monkeypatch):
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_WAIT', 0.05)
+    cache = IdempotencyCache()
+    started, finish = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        finish.wait(1)
+        return approved()
+
+    owner = threading.Thread(target=cache.run_once, args=('key', b'{}', slow))
+    owner.start()
+    started.wait(1)
+    with pytest.raises(InProgressError):
+        cache.run_once('key', b'{}', approved)
+    finish.set()
+    owner.join(1)
+    assert cache.run_once('key', b'{}', approved) == (approved(), True)
+
+
+def test_cancelled_async_duplicate_leaves_the_claim_alone():
+    async def run():
+        cache = IdempotencyCache()
+        finish = asyncio.Event()
+
+        async def slow():
+            await finish.wait()
+            return approved()
+
+        owner = asyncio.ensure_future(cache.run_once_async('key', b'{}', slow))
+        await asyncio.sleep(0.01)
+        duplicate = asyncio.ensure_future(cache.run_once_async('key', b'{}', slow))
+        await asyncio.sleep(0.01)
+        duplicate.cancel()
+        await asyncio.gather(duplicate, return_exceptions=True)
+
+        finish.set()
+        assert await owner == (approved(), False)
+        assert await cache.run_once_async('key', b'{}', slow) == (approved(), True)
+
+    asyncio.run(run())
+
+
+def test_async_duplicate_that_times_out_leaves_the_claim_alone(monkeypatch):
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_WAIT', 0.02)
+
+    async def run():
+        cache = IdempotencyCache()
+        finish = asyncio.Event()
+
+        async def slow():
+            await finish.wait()
+            return approved()
+
+        owner = asyncio.ensure_future(cache.run_once_async('key', b'{}', slow))
+        await asyncio.sleep(0.01)
+        with pytest.raises(InProgressError):
+            await cache.run_once_async('key', b'{}', slow)
+        finish.set()
+        assert await owner == (approved(), False)
+        assert await cache.run_once_async('key', b'{}', slow) == (approved(), True)
+
+    asyncio.run(run())
+
+
+def test_responses_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'idempotency.jsonl')
+    IdempotencyCache(path=path).run_once('key', b'{}', approved)
+    with open(path, 'a') as f:
+        f.write('{"torn')
+    cache = IdempotencyCache(path=path)
+    assert cache.run_once('key', b'{}', lambda: approved('2')) == (approved(), True)
+
+
+def test_shared_async_cache_keeps_sqlite_off_the_loop(tmp_path):
+    class Store(SharedStore):
+        # Remembers the threads the store is used from
+        threads = set()
+
+        def _connection(self):
+            self.threads.add(threading.get_ident())
+            return super()._connection()
+
+    cache = SharedIdempotencyCache(Store(str(tmp_path / 'state.db'), 'idempotency'))
+
+    async def checkout():
+        return approved()
+
+    async def run():
+        assert await cache.run_once_async('key', b'{}', checkout) == (approved(), False)
+        assert await cache.run_once_async('key', b'{}', checkout) == (approved(), True)
+        with pytest.raises(KeyReusedError):
+            await cache.run_once_async('key', b'{"a": 1}', checkout)
+
+    asyncio.run(run())
+    assert Store.threads and threading.get_ident() not in Store.threads
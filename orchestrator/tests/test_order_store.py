@@ -0,0 +1,109 @@
+import threading
+
+import grpc
+import pytest
+
+import order_store
+from order_store import OrderStore
+
+
+class Clock:
+    # Stands in for the time module, moved on by hand
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(order_store, 'time', clock)
+    return clock
+
+
+class Context:
+    def abort(self, code, details):
+        raise grpc.RpcError(code, details)
+
+
+def test_entries_expire_after_their_ttl(clock):
+    orders = OrderStore(ttl=10)
+    orders.put('a', 1)
+    orders.put('b', 2, ttl=30)
+    clock.now += 9.9
+    assert orders.get('a') == 1
+    clock.now += 0.1
+    assert orders.get('a') is None
+    assert 'a' not in orders
+    assert orders['b'] == 2
+    clock.now += 20
+    with pytest.raises(KeyError):
+        orders['b']
+    assert orders.stats()['expirations'] == 2
+
+
+def test_expired_entries_are_swept_on_insert(clock):
+    orders = OrderStore(ttl=10)
+    for index in range(5):
+        orders.put(index, index)
+    clock.now += 10
+    orders.put('new', 1)
+    assert len(orders) == 1
+    assert orders.expirations == 5
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    orders = OrderStore(max_size=2)
+    orders.put('a', 1)
+    orders.put('b', 2)
+    orders.get('a')
+    orders.put('c', 3)
+    assert 'b' not in orders
+    assert orders.get('a') == 1 and orders.get('c') == 3
+    assert orders.evictions == 1
+    assert len(orders) == 2
+
+
+def test_setdefault_keeps_the_live_value(clock):
+    orders = OrderStore(ttl=10)
+    assert orders.setdefault('a', 1) == 1
+    assert orders.setdefault('a', 2) == 1
+    clock.now += 10
+    assert orders.setdefault('a', 3) == 3
+
+
+def test_pop_removes_the_entry(clock):
+    orders = OrderStore()
+    orders.put('a', 1)
+    assert orders.pop('a') == 1
+    assert orders.pop('a', 'gone') == 'gone'
+
+
+def test_locked_serializes_updates_of_one_order(clock):
+    orders = OrderStore()
+    orders.put('a', {'vc': [0]})
+
+    def bump():
+        for _ in range(1000):
+            with orders.locked('a') as entry:
+                entry['vc'][0] += 1
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert orders['a']['vc'] == [4000]
+
+
+def test_unknown_order_aborts_the_call(clock):
+    orders = OrderStore(ttl=10)
+    orders.put('a', 1)
+    clock.now += 10
+    with pytest.raises(KeyError):
+        orders.locked('a')
+    with pytest.raises(grpc.RpcError) as error:
+        orders.locked_or_abort('a', Context())
+    assert error.value.args == (grpc.StatusCode.NOT_FOUND, 'Unknown order a')
@@ -0,0 +1,82 @@
+import time
+from concurrent import futures
+
+import books_database_pb2 as books_database
+import pytest
+
+import hedging
+from stock import StockCache, shortage, wanted
+
+STOCK = {'Dune': 2, 'Emma': 0}
+
+
+class BooksDatabase:
+    # Stands in for the ReadBatch stub of every replica
+    def __init__(self):
+        self.requests = []
+        self.ReadBatch = self
+
+    def future(self, request, timeout=None):
+        self.requests.append(list(request.titles))
+        future = futures.Future()
+        future.set_result(books_database.ReadBatchResponse(stock={
+            title: STOCK[title] for title in request.titles if title in STOCK}))
+        return future
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = BooksDatabase()
+    monkeypatch.setattr(hedging.channel_pool, 'get_stub',
+                        lambda target, stub_cls: database)
+    return database
+
+
+def check(cache, items):
+    # check_stock of app.py
+    copies = wanted(items)
+    levels, lookup = cache.cached(copies)
+    if lookup is not None:
+        cache.store(cache.client.call(lookup, timeout=1), levels)
+    return shortage(copies, levels)
+
+
+def test_copies_of_a_title_are_added_up():
+    assert wanted([{'name': 'Dune', 'quantity': 1}, {'name': 'Emma', 'quantity': 2},
+                   {'name': 'Dune', 'quantity': 2}]) == {'Dune': 3, 'Emma': 2}
+
+
+def test_shortage_names_the_first_title_without_enough_copies():
+    assert shortage({'Dune': 2}, {'Dune': 2}) is None
+    assert shortage({'Dune': 3, 'Emma': 1}, {'Dune': 2, 'Emma': 0}) == \
+        'Not enough stock for Dune'
+
+
+def test_titles_of_unknown_stock_pass():
+    assert shortage({'Unknown': 100}, {}) is None
+
+
+def test_order_for_more_copies_than_in_stock_is_rejected(database):
+    cache = StockCache(addresses=['a:50051', 'b:50051'])
+    assert check(cache, [{'name': 'Dune', 'quantity': 2}]) is None
+    assert check(cache, [{'name': 'Emma', 'quantity': 1}]) == 'Not enough stock for Emma'
+    assert check(cache, [{'name': 'Unknown', 'quantity': 1}]) is None
+
+
+def test_stock_levels_are_cached_for_the_ttl(database):
+    cache = StockCache(addresses=['a:50051'], ttl=0.05)
+    check(cache, [{'name': 'Dune', 'quantity': 1}])
+    levels, lookup = cache.cached({'Dune': 1, 'Emma': 1})
+    assert levels == {'Dune': 2}
+    assert list(lookup.titles) == ['Emma']
+    check(cache, [{'name': 'Dune', 'quantity': 1}, {'name': 'Emma', 'quantity': 0}])
+    assert database.requests == [['Dune'], ['Emma']]
+    time.sleep(0.06)
+    assert cache.cached({'Dune': 1})[0] == {}
+
+
+def test_cached_titles_need_no_lookup(database):
+    cache = StockCache(addresses=['a:50051'])
+    check(cache, [{'name': 'Dune', 'quantity': 1}, {'name': 'Emma', 'quantity': 0}])
+    assert cache.cached({'Dune': 1, 'Emma': 1}) == ({'Dune': 2, 'Emma': 0}, None)
+
@@ -0,0 +1,145 @@
+import copy
+import json
+
+import pytest
+
+import checkout_common
+import validation
+
+SPEC = {'components': {'schemas': {
+    'Order': {
+        'type': 'object',
+        'required': ['id', 'lines'],
+        'additionalProperties': False,
+        'properties': {
+            'id': {'type': 'string', 'minLength': 2, 'maxLength': 4},
+            'lines': {'type': 'array', 'minItems': 1, 'maxItems': 2,
+                      'items': {'$ref': '#/components/schemas/Line'}},
+            'priority': {'type': 'string', 'enum': ['low', 'high']},
+            'note': {'type': 'string', 'nullable': True},
+            'paid': {'type': 'boolean'},
+        },
+    },
+    'Line': {
+        'type': 'object',
+        'required': ['sku'],
+        'properties': {
+            'sku': {'type': 'string', 'pattern': '^[A-Z]{3}$'},
+            'price': {'type': 'number', 'minimum': 0, 'maximum': 100},
+        },
+    },
+}}}
+
+ORDER = {'id': 'o1', 'lines': [{'sku': 'ABC', 'price': 9.5}], 'priority': 'low',
+         'note': None, 'paid': True}
+
+CHECKOUT = {
+    'user': {'name': 'Jane', 'contact': 'jane@example.com'},
+    'creditCard': {'number': '4111111111111111', 'expirationDate': '12/99',
+                   'cvv': '123'},
+    'userComment': None,
+    'items': [{'name': 'Book', 'quantity': 1}],
+    'billingAddress': {'street': 'Main 1', 'city': 'Berlin', 'state': 'BE',
+                       'zip': '10115', 'country': 'DE'},
+}
+
+
+@pytest.fixture(scope='module')
+def validate_order():
+    return validation.compile_schema(SPEC, 'Order')
+
+
+@pytest.fixture(scope='module')
+def validate_checkout():
+    return validation.compile_schema(validation.load_spec(), 'CheckoutRequest')
+
+
+def changed(document, path, value):
+    # Copy of document with the value at path replaced, or removed for ...
+    document = copy.deepcopy(document)
+    target = document
+    for key in path[:-1]:
+        target = target[key]
+    if value is ...:
+        del target[path[-1]]
+    else:
+        target[path[-1]] = value
+    return document
+
+
+def test_valid_documents_pass(validate_order, validate_checkout):
+    assert validate_order(ORDER) is None
+    assert validate_order({'id': 'o1', 'lines': [{'sku': 'ABC'}]}) is None
+    assert validate_checkout(CHECKOUT) is None
+
+
+@pytest.mark.parametrize('path, value, message', [
+    (['id'], ..., 'id: required'),
+    (['id'], 7, 'id: expected a string'),
+    (['id'], 'o', 'id: shorter than 2 characters'),
+    (['id'], 'o12345', 'id: longer than 4 characters'),
+    (['lines'], [], 'lines: fewer than 1 items'),
+    (['lines'], [{'sku': 'ABC'}] * 3, 'lines: more than 2 items'),
+    (['lines', 0, 'sku'], 'abc', 'lines[0].sku: does not match ^[A-Z]{3}$'),
+    (['lines', 0, 'price'], -1, 'lines[0].price: less than 0'),
+    (['lines', 0, 'price'], 101, 'lines[0].price: greater than 100'),
+    (['lines', 0, 'price'], '9', 'lines[0].price: expected a number'),
+    (['priority'], 'urgent', 'priority: expected one of low, high'),
+    (['note'], 5, 'note: expected a string'),
+    (['paid'], 1, 'paid: expected a boolean'),
+    (['extra'], 1, 'extra: unexpected property'),
+])
+def test_invalid_documents_name_the_field(validate_order, path, value, message):
+    assert validate_order(changed(ORDER, path, value)) == message
+
+
+def test_document_of_the_wrong_type(validate_order):
+    assert validate_order([]) == 'body: expected an object'
+
+
+@pytest.mark.parametrize('path, value, message', [
+    (['user'], ..., 'user: required'),
+    (['creditCard', 'cvv'], 123, 'creditCard.cvv: expected a string'),
+    (['creditCard', 'cvv'], '12a', 'creditCard.cvv: does not match ^[0-9]{1,9}$'),
+    (['items', 0, 'quantity'], 0, 'items[0].quantity: less than 1'),
+    (['items', 0, 'quantity'], True, 'items[0].quantity: expected an integer'),
+    (['items', 0, 'price'], 3, 'items[0].price: unexpected property'),
+    (['billingAddress', 'zip'], ..., 'billingAddress.zip: required'),
+])
+def test_checkout_requests_are_checked_against_the_specification(
+        validate_checkout, path, value, message):
+    assert validate_checkout(changed(CHECKOUT, path, value)) == message
+
+
+def test_unsupported_refs_are_rejected():
+    spec = {'components': {'schemas': {'A': {'$ref': 'other.yaml#/A'}}}}
+    with pytest.raises(ValueError, match='Unsupported'):
+        validation.compile_schema(spec, 'A')
+
+
+def test_ref_cycles_are_rejected():
+    spec = {'components': {'schemas': {'A': {'$ref': '#/components/schemas/A'}}}}
+    with pytest.raises(ValueError, match='Unsupported'):
+        validation.compile_schema(spec, 'A')
+
+
+def test_parse_order_rejects_what_is_not_json():
+    assert checkout_common.parse_order(b'{"user":') == (None, ({'error': {
+        'code': 'INVALID_ORDER', 'message': 'Expected a JSON object'}}, 400))
+
+
+def test_parse_order_rejects_orders_off_the_specification():
+    body = json.dumps(changed(CHECKOUT, ['creditCard', 'cvv'], 123)).encode()
+    assert checkout_common.parse_order(body) == (None, ({'error': {
+        'code': 'INVALID_ORDER',
+        'message': 'Malformed order: creditCard.cvv: expected a string'}}, 400))
+
+
+def test_parse_order_rejects_too_many_copies(monkeypatch):
+    monkeypatch.setattr(checkout_common, 'MAX_ORDER_QUANTITY', 3)
+    order = changed(CHECKOUT, ['items'], [{'name': 'A', 'quantity': 2},
+                                          {'name': 'B', 'quantity': 2}])
+    _, error = checkout_common.parse_order(json.dumps(order).encode())
+    assert error[0]['error']['message'] == \
+        'Malformed order: items: more than 3 copies in total'
+    assert checkout_common.parse_order(json.dumps(CHECKOUT).encode()) == (CHECKOUT, None)
@@ -7,6 +7,8 @@ import os
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
 sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
 
 import common_pb2 as common  # noqa
 import common_pb2_grpc as common_grpc  # noqa
@@ -18,6 +20,16 @@ import books_database_pb2 as books_database  # noqa
 import books_database_pb2_grpc as books_database_grpc  # noqa
 import docker  # noqa
 import time  # noqa
+import channel_pool  # noqa
+import circuit_breaker  # noqa
+import tracing  # noqa
+
+ORDER_QUEUE_ADDR = 'order_queue:50051'
+BOOKS_DATABASE_ADDR = 'books_database_primary:50051'
+PAYMENT_ADDR = 'payment:50051'
+# 2PC participants that keep failing are failed fast until they recover
+circuit_breaker.protect(BOOKS_DATABASE_ADDR)
+circuit_breaker.protect(PAYMENT_ADDR)
 
 
 class OrderExecutorService:
@@ -28,27 +40,25 @@ class OrderExecutorService:
 
     def send_declare_election(self, target_id: str):
         # Returns True if target is alive, False otherwise
-        with grpc.insecure_channel(f'{target_id}:50051') as leader_channel:
-            leader_election_stub = order_queue_grpc.LeaderElectionServiceStub(
-                leader_channel)
-            try:
-                leader_election_stub.DeclareElection(
-                    order_queue.LeaderRequest(sender_id=self.executor_id), timeout=1)
-                return True
-            except:
-                return False
+        leader_election_stub = channel_pool.get_stub(
+            f'{target_id}:50051', order_queue_grpc.LeaderElectionServiceStub)
+        try:
+            leader_election_stub.DeclareElection(
+                order_queue.LeaderRequest(sender_id=self.executor_id), timeout=1)
+            return True
+        except:
+            return False
 
     def send_declare_victory(self, target_id: str):
         # Returns True if target is alive, False otherwise
-        with grpc.insecure_channel(f'{target_id}:50051') as leader_channel:
-            leader_election_stub = order_queue_grpc.LeaderElectionServiceStub(
-                leader_channel)
-            try:
-                leader_election_stub.DeclareVictory(
-                    order_queue.LeaderRequest(sender_id=self.executor_id), timeout=1)
-                return True
-            except Exception:
-                return False
+        leader_election_stub = channel_pool.get_stub(
+            f'{target_id}:50051', order_queue_grpc.LeaderElectionServiceStub)
+        try:
+            leader_election_stub.DeclareVictory(
+                order_queue.LeaderRequest(sender_id=self.executor_id), timeout=1)
+            return True
+        except Exception:
+            return False
 
     def start_leader_election(self):
         for id in self.known_ids:
@@ -146,43 +156,68 @@ class OrderExecutorService:
             return False
 
     def run(self):
-        with grpc.insecure_channel('order_queue:50051') as order_queue_channel:
-            order_queue_stub = order_queue_grpc.OrderQueueServiceStub(
-                order_queue_channel)
+        order_queue_stub = channel_pool.get_stub(
+            ORDER_QUEUE_ADDR, order_queue_grpc.OrderQueueServiceStub)
 
-            while True:
-                if self.leader_id == self.executor_id:
-                    # Is leader
+        while True:
+            if self.leader_id == self.executor_id:
+                # Is leader
 
-                    try:
-                        order: common.ItemsInitRequest = order_queue_stub.Dequeue(
-                            common.Empty())
-                    except grpc.RpcError as err:
-                        if err.code() == grpc.StatusCode.ABORTED:
-                            continue  # Queue empty
-                        else:
-                            raise
-
-                    # Process order here
-                    with grpc.insecure_channel('books_database_primary:50051') as db_channel, grpc.insecure_channel('payment:50051') as payment_channel:
-                        db_stub = common_grpc.TransactionServiceStub(
-                            db_channel)
-                        payment_stub = common_grpc.TransactionServiceStub(
-                            payment_channel)
-                        for item in order.items:
-                            if not self.two_phase_commit(order.order_id, item.name, item.quantity, [db_stub, payment_stub]):
-                                print(
-                                    f"WARNING: Order for {item.quantity} copies of {item.name} failed, not enough stock")
-                else:
-                    # Is not leader
-
-                    if self.leader_id is not None:
-                        # Ping leader using election declaration
-                        if not self.send_declare_election(self.leader_id):
-                            # Leader has failed, start new election
-                            self.start_leader_election()
-
-                    time.sleep(2)
+                try:
+                    order, call = order_queue_stub.Dequeue.with_call(
+                        common.Empty())
+                except grpc.RpcError as err:
+                    if err.code() == grpc.StatusCode.ABORTED:
+                        continue  # Queue empty
+                    else:
+                        raise
+
+                # Continue the trace of the checkout that enqueued the order
+                parent = tracing.extract(
+                    dict(call.trailing_metadata() or ()).get(tracing.TRACEPARENT))
+                if parent is None:
+                    self.execute(order)
+                    continue
+                with tracing.span('execute_order', parent, service='order_executor') as span:
+                    span.set('order_id', order.order_id)
+                    self.execute(order)
+            else:
+                # Is not leader
+
+                if self.leader_id is not None:
+                    # Ping leader using election declaration
+                    if not self.send_declare_election(self.leader_id):
+                        # Leader has failed, start new election
+                        self.start_leader_election()
+
+                time.sleep(2)
+
+    def execute(self, order: common.ItemsInitRequest):
+        db_stub = channel_pool.get_stub(
+            BOOKS_DATABASE_ADDR, common_grpc.TransactionServiceStub)
+        payment_stub = channel_pool.get_stub(
+            PAYMENT_ADDR, common_grpc.TransactionServiceStub)
+        failed = []
+        for item in order.items:
+            if not self.two_phase_commit(order.order_id, item.name, item.quantity, [db_stub, payment_stub]):
+                print(
+                    f"WARNING: Order for {item.quantity} copies of {item.name} failed, not enough stock")
+                failed.append(item.name)
+        if failed:
+            self.report(order.order_id, order_queue.OrderStatus.ABORTED,
+                        f"Could not commit {', '.join(failed)}")
+        else:
+            self.report(order.order_id, order_queue.OrderStatus.COMMITTED)
+
+    def report(self, order_id, state, message=''):
+        # Outcome of the order on /orders/<orderId>, best effort
+        status_stub = channel_pool.get_stub(
+            ORDER_QUEUE_ADDR, order_queue_grpc.OrderStatusServiceStub)
+        try:
+            status_stub.SetStatus(order_queue.OrderStatus(
+                order_id=order_id, state=state, message=message), timeout=1)
+        except grpc.RpcError as e:
+            print(f"Status of order {order_id} not recorded: {e.code().name}")
 
 
 class LeaderElectionService(order_queue_grpc.LeaderElectionServiceServicer):
@@ -219,7 +254,9 @@ def run():
     svc = OrderExecutorService(executor_id, known_ids)
 
     # Create a gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor())
+    server = grpc.server(
+        futures.ThreadPoolExecutor(),
+        interceptors=[tracing.server_interceptor('order_executor')])
     order_queue_grpc.add_LeaderElectionServiceServicer_to_server(
         LeaderElectionService(svc), server)
     # Listen on port 50051
@@ -1,6 +1,8 @@
 import queue
 import sys
 import os
+import threading
+import time
 
 # This set of lines are needed to import the gRPC stubs.
 # The path of the stubs is relative to the current file, or absolute inside the container.
@@ -8,16 +10,38 @@ import os
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
 sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
 
 import common_pb2 as common  # noqa
 from concurrent import futures  # noqa
 import grpc  # noqa
+import order_queue_pb2 as order_queue  # noqa
 import order_queue_pb2_grpc as order_queue_grpc  # noqa
+from order_store import OrderStore  # noqa
+import tracing  # noqa
+
+ORDER_STATUS_TTL = float(os.getenv('ORDER_STATUS_TTL_SECONDS', '86400'))
+ORDER_STATUS_MAX_SIZE = int(os.getenv('ORDER_STATUS_MAX_SIZE', '100000'))
+
+State = order_queue.OrderStatus
+# An order only moves forward, a late or repeated update never undoes a
+# later state. Rejected, committed and aborted are final
+STATE_RANK = {
+    State.ACCEPTED: 0,
+    State.VERIFIED: 1,
+    State.QUEUED: 2,
+    State.REJECTED: 3,
+    State.COMMITTED: 3,
+    State.ABORTED: 3,
+}
 
 
 class RequestWithPriority:
-    def __init__(self, request):
+    def __init__(self, request, traceparent=None):
         self.request = request
+        # Trace of the checkout that enqueued the order, handed to the executor
+        self.traceparent = traceparent
         # Negative so more product is prioritized
         self.priority = -sum([item.quantity for item in request.items])
 
@@ -25,27 +49,73 @@ class RequestWithPriority:
         return self.priority < other.priority
 
 
-class OrderQueueService(order_queue_grpc.OrderQueueServiceServicer):
+class OrderStatusService(order_queue_grpc.OrderStatusServiceServicer):
     def __init__(self):
+        self._statuses = OrderStore(max_size=ORDER_STATUS_MAX_SIZE, ttl=ORDER_STATUS_TTL)
+        self._lock = threading.Lock()
+
+    def update(self, order_id, state, message=''):
+        # Returns False when the order is already further along
+        with self._lock:
+            current = self._statuses.get(order_id)
+            if current is not None and STATE_RANK[current.state] >= STATE_RANK[state]:
+                return False
+            self._statuses.put(order_id, State(
+                order_id=order_id, state=state, message=message,
+                updated_at=time.time()))
+            return True
+
+    def SetStatus(self, request, context):
+        if request.state not in STATE_RANK:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Unknown order state')
+        self.update(request.order_id, request.state, request.message)
+        return common.Empty()
+
+    def GetStatus(self, request, context):
+        # UNKNOWN for orders never seen or long forgotten
+        return self._statuses.get(request.order_id) or State(
+            order_id=request.order_id, state=State.UNKNOWN)
+
+
+class OrderQueueService(order_queue_grpc.OrderQueueServiceServicer):
+    def __init__(self, statuses=None):
         self._queue = queue.PriorityQueue()
+        self.statuses = OrderStatusService() if statuses is None else statuses
 
     def Enqueue(self, request, context):
-        self._queue.put(RequestWithPriority(request))
+        self._queue.put(RequestWithPriority(
+            request, tracing.current_traceparent()))
+        self.statuses.update(request.order_id, State.QUEUED)
+        return common.Empty()
+
+    def EnqueueBatch(self, request, context):
+        # One round-trip for all approved orders of a /checkout/batch
+        traceparent = tracing.current_traceparent()
+        for order in request.orders:
+            self._queue.put(RequestWithPriority(order, traceparent))
+            self.statuses.update(order.order_id, State.QUEUED)
         return common.Empty()
 
     def Dequeue(self, request, context):
         try:
-            request = self._queue.get(timeout=2).request
-            return request
+            item = self._queue.get(timeout=2)
+            if item.traceparent is not None:
+                context.set_trailing_metadata(
+                    ((tracing.TRACEPARENT, item.traceparent),))
+            return item.request
         except queue.Empty:
             context.abort(grpc.StatusCode.ABORTED, 'Queue empty')
 
 
 def serve():
     # Create a gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor())
-    order_queue_grpc.add_OrderQueueServiceServicer_to_server(
-        OrderQueueService(), server)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(),
+        interceptors=[tracing.server_interceptor('order_queue')])
+    queue_service = OrderQueueService()
+    order_queue_grpc.add_OrderQueueServiceServicer_to_server(queue_service, server)
+    order_queue_grpc.add_OrderStatusServiceServicer_to_server(
+        queue_service.statuses, server)
     # Listen on port 50051
     port = "50051"
     server.add_insecure_port("[::]:" + port)
@@ -4,11 +4,14 @@ import os
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
 sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
 import common_pb2 as common  # noqa
 import common_pb2_grpc as common_grpc  # noqa
 
 import grpc  # noqa
 from concurrent import futures  # noqa
+import tracing  # noqa
 
 
 class PaymentService(common_grpc.TransactionService):
@@ -32,7 +35,9 @@ class PaymentService(common_grpc.TransactionService):
 
 
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor())
+    server = grpc.server(
+        futures.ThreadPoolExecutor(),
+        interceptors=[tracing.server_interceptor('payment')])
     common_grpc.add_TransactionServiceServicer_to_server(
         PaymentService(), server)
     port = "50051"
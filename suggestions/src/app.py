@@ -16,6 +16,8 @@ import os
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
 sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
 import common_pb2 as common  # noqa
 import suggestions_pb2 as suggestions  # noqa
 import suggestions_pb2_grpc as suggestions_grpc  # noqa
@@ -25,6 +27,13 @@ from concurrent import futures  # noqa
 from pydantic import BaseModel  # noqa
 
 from pydantic_ai import Agent  # noqa
+from order_store import OrderStore  # noqa
+import tracing  # noqa
+
+# Do not start an LLM call when the caller's deadline leaves less than this,
+# the LLM seldom answers sooner and a call cut off by the deadline is paid
+# for nothing
+LLM_MIN_BUDGET = float(os.getenv('LLM_MIN_BUDGET_MS', '1000')) / 1000
 
 
 class BookSuggestion(BaseModel):
@@ -67,12 +76,12 @@ class SuggestionsService(suggestions_grpc.SuggestionServiceServicer):
     def __init__(self, svc_idx=1, total_svcs=3):
         self.svc_idx = svc_idx
         self.total_svcs = total_svcs
-        self.orders = {}  # orderId -> {data}
+        self.orders = OrderStore()  # orderId -> {data, vc}
 
     def initSuggestion(self, request, context=None):
         order_id = request.order_id
         data = request.items
-        self.orders[order_id] = {"data": data, "vc": [0]*self.total_svcs}
+        self.orders.put(order_id, {"data": data, "vc": [0]*self.total_svcs})
         return common.Empty()
 
     def merge_and_incrment(self, local_vc, incoming_vc=0):
@@ -84,17 +93,28 @@ class SuggestionsService(suggestions_grpc.SuggestionServiceServicer):
     def SaySuggest(self, request, context):
         order_id = request.order_id
         incoming_vc = request.vector_clock.clocks
-        entry = self.orders.get(order_id)
-        self.merge_and_incrment(entry["vc"], incoming_vc)
+        with self.orders.locked_or_abort(order_id, context) as entry:
+            data = entry["data"]
+            self.merge_and_incrment(entry["vc"], incoming_vc)
+            vc = list(entry["vc"])
+        # Suggesting is the last event of an order, its state is not needed anymore
+        self.orders.pop(order_id)
         response = suggestions.Suggestions(
-            vector_clock=common.VectorClock(clocks=entry["vc"]))
-        response.books.extend(findMostSimilarBooks(entry["data"]))
+            vector_clock=common.VectorClock(clocks=vc))
+        time_remaining = context.time_remaining()
+        if time_remaining is not None and time_remaining < LLM_MIN_BUDGET:
+            print(f"SuggestionsService - Skipping suggestions for {order_id}, "
+                  f"only {time_remaining:.3f}s of budget left")
+            return response
+        response.books.extend(findMostSimilarBooks(data))
         return response
 
 
 def serve():
     # Create a gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor())
+    server = grpc.server(
+        futures.ThreadPoolExecutor(),
+        interceptors=[tracing.server_interceptor('suggestions')])
     # Add HelloService
     # suggestions_grpc.add_HelloServiceServicer_to_server(HelloService(), server)
     suggestions_grpc.add_SuggestionServiceServicer_to_server(
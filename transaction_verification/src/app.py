@@ -7,12 +7,16 @@ import os
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 grpc_path = os.path.abspath(os.path.join(FILE, '../../../utils/pb'))
 sys.path.insert(0, grpc_path)
+utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/other'))
+sys.path.insert(0, utils_path)
 import common_pb2 as common  # noqa
 import transaction_verification_pb2 as transaction_verification  # noqa
 import transaction_verification_pb2_grpc as transaction_verification_grpc  # noqa
 
 import grpc  # noqa
 from concurrent import futures  # noqa
+from order_store import OrderStore  # noqa
+import tracing  # noqa
 
 
 def verify_credit_card(request: common.AllInfoRequest):
@@ -38,12 +42,12 @@ class VerificationService(transaction_verification_grpc.VerificationServiceServi
     def __init__(self, svc_idx=2, total_svcs=3):
         self.svc_idx = svc_idx
         self.total_svcs = total_svcs
-        self.orders = {}  # orderId -> {data}
+        self.orders = OrderStore()  # orderId -> {data, vc}
 
     def initVerification(self, request: common.InitAllInfoRequest, context=None):
         order_id = request.order_id
         data = request.request
-        self.orders[order_id] = {"data": data, "vc": [0]*self.total_svcs}
+        self.orders.put(order_id, {"data": data, "vc": [0]*self.total_svcs})
         return common.Empty()
 
     def merge_and_incrment(self, local_vc, incoming_vc=0):
@@ -54,23 +58,25 @@ class VerificationService(transaction_verification_grpc.VerificationServiceServi
     def BookListNotEmtpy(self, request: common.Request, context) -> common.Response:
         order_id = request.order_id
         incoming_vc = request.vector_clock.clocks
-        entry = self.orders.get(order_id)
-        data = entry["data"]
-        self.merge_and_incrment(entry["vc"], incoming_vc)
+        with self.orders.locked_or_abort(order_id, context) as entry:
+            data = entry["data"]
+            self.merge_and_incrment(entry["vc"], incoming_vc)
+            vc = list(entry["vc"])
         if len(data.items) == 0:
             response = common.Response(
-                fail=True, message="Books list is empty", vector_clock=common.VectorClock(clocks=entry["vc"]))
+                fail=True, message="Books list is empty", vector_clock=common.VectorClock(clocks=vc))
         else:
             response = common.Response(
-                fail=False, message="", vector_clock=common.VectorClock(clocks=entry["vc"]))
+                fail=False, message="", vector_clock=common.VectorClock(clocks=vc))
         return response
 
     def UserDataVerification(self, request, context):
         order_id = request.order_id
         incoming_vc = request.vector_clock.clocks
-        entry = self.orders.get(order_id)
-        data = entry["data"]
-        self.merge_and_incrment(entry["vc"], incoming_vc)
+        with self.orders.locked_or_abort(order_id, context) as entry:
+            data = entry["data"]
+            self.merge_and_incrment(entry["vc"], incoming_vc)
+            vc = list(entry["vc"])
         is_correct = True
         message = "All needed data is filled in"
         if verify_contact(data) is False:
@@ -83,15 +89,16 @@ class VerificationService(transaction_verification_grpc.VerificationServiceServi
             message = "Buyer name should be filled in"
             is_correct = False
         response = common.Response(fail=(
-            is_correct is False), message=message, vector_clock=common.VectorClock(clocks=entry["vc"]))
+            is_correct is False), message=message, vector_clock=common.VectorClock(clocks=vc))
         return response
 
     def CreditCardVerification(self, request, context):
         order_id = request.order_id
         incoming_vc = request.vector_clock.clocks
-        entry = self.orders.get(order_id)
-        data = entry["data"]
-        self.merge_and_incrment(entry["vc"], incoming_vc)
+        with self.orders.locked_or_abort(order_id, context) as entry:
+            data = entry["data"]
+            self.merge_and_incrment(entry["vc"], incoming_vc)
+            vc = list(entry["vc"])
         is_correct = True
         message = "Credit card information is filled in"
 
@@ -100,13 +107,15 @@ class VerificationService(transaction_verification_grpc.VerificationServiceServi
             is_correct = False
 
         response = common.Response(fail=(
-            is_correct is False), message=message, vector_clock=common.VectorClock(clocks=entry["vc"]))
+            is_correct is False), message=message, vector_clock=common.VectorClock(clocks=vc))
         return response
 
 
 def serve():
     # Create a gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor())
+    server = grpc.server(
+        futures.ThreadPoolExecutor(),
+        interceptors=[tracing.server_interceptor('transaction_verification')])
     # Add HelloService
     # transaction_verification_grpc.add_HelloServiceServicer_to_server(HelloService(), server)
     transaction_verification_grpc.add_VerificationServiceServicer_to_server(
@@ -0,0 +1,204 @@
+"""
+Process-wide registry of long-lived gRPC channels and stubs.
+
+Channels are created once per target, kept alive with HTTP/2 keepalive pings
+and shared by every thread of the process. A channel that reports
+TRANSIENT_FAILURE or SHUTDOWN, and has not become READY again since, is
+marked stale and rebuilt (re-resolving the target) the next time it is
+requested. The channel it replaces is closed RETIRED_CHANNEL_GRACE later,
+so that calls still running on it, or about to start on a stub handed out
+before, are not cancelled. Calls made through pooled channels carry the
+current trace context, see tracing.py, and go through the circuit breaker
+of their target when it is protected, see circuit_breaker.py.
+
+Usage:
+
+    import channel_pool
+    stub = channel_pool.get_stub('fraud_detection:50051', FraudServiceStub)
+
+Asyncio code uses the grpc.aio flavour, which keeps one pool per event loop:
+
+    stub = channel_pool.get_aio_stub('fraud_detection:50051', FraudServiceStub)
+"""
+import asyncio
+import threading
+import time
+
+import grpc
+
+import circuit_breaker
+import tracing
+
+KEEPALIVE_OPTIONS = [
+    # Ping the server every 30s, give up if there is no ack in 10s
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    # Keep idle channels warm between checkouts
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+]
+
+# Do not rebuild the same target more often than this (seconds)
+MIN_REBUILD_INTERVAL = 1.0
+# Close a replaced channel this long after, longer than any call on it lasts (seconds)
+RETIRED_CHANNEL_GRACE = 30.0
+
+
+class _PooledChannel:
+    def __init__(self, target, options):
+        self.channel = grpc.intercept_channel(
+            grpc.insecure_channel(target, options=options),
+            tracing.ClientInterceptor(),
+            circuit_breaker.ClientInterceptor(target))
+        self.created_at = time.monotonic()
+        self.stale = False
+        self.stubs = {}  # stub class -> stub
+        self.channel.subscribe(self._on_state_change)
+
+    def _on_state_change(self, state):
+        if state in (grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+                     grpc.ChannelConnectivity.SHUTDOWN):
+            self.stale = True
+        elif state == grpc.ChannelConnectivity.READY:
+            self.stale = False
+
+    def close(self):
+        self.channel.unsubscribe(self._on_state_change)
+        self.channel.close()
+
+    def retire(self):
+        # Other threads may still be calling through it, close it later
+        self.channel.unsubscribe(self._on_state_change)
+        timer = threading.Timer(RETIRED_CHANNEL_GRACE, self.channel.close)
+        timer.daemon = True
+        timer.start()
+
+
+class ChannelPool:
+    def __init__(self, options=None):
+        self._options = KEEPALIVE_OPTIONS if options is None else options
+        self._lock = threading.Lock()
+        self._entries = {}  # target -> _PooledChannel
+
+    def _entry(self, target):
+        entry = self._entries.get(target)
+        if entry is not None and not self._needs_rebuild(entry):
+            return entry
+        with self._lock:
+            entry = self._entries.get(target)
+            if entry is None or self._needs_rebuild(entry):
+                if entry is not None:
+                    print(f"ChannelPool - Rebuilding channel to {target}")
+                    entry.retire()
+                entry = _PooledChannel(target, self._options)
+                self._entries[target] = entry
+            return entry
+
+    @staticmethod
+    def _needs_rebuild(entry):
+        return entry.stale and \
+            time.monotonic() - entry.created_at >= MIN_REBUILD_INTERVAL
+
+    def get_channel(self, target) -> grpc.Channel:
+        return self._entry(target).channel
+
+    def get_stub(self, target, stub_cls):
+        entry = self._entry(target)
+        stub = entry.stubs.get(stub_cls)
+        if stub is None:
+            stub = entry.stubs.setdefault(stub_cls, stub_cls(entry.channel))
+        return stub
+
+    def reset(self, target):
+        # Force the next get_* call to open a fresh channel
+        entry = self._entries.get(target)
+        if entry is not None:
+            entry.stale = True
+            entry.created_at = 0
+
+    def close(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.close()
+            self._entries.clear()
+
+
+class AioChannelPool:
+    # grpc.aio channels are bound to the event loop they were created in,
+    # so this pool must only be used from a single loop.
+    def __init__(self, options=None):
+        self._options = KEEPALIVE_OPTIONS if options is None else options
+        self._channels = {}  # target -> (channel, created_at)
+        self._stubs = {}  # (target, stub class) -> stub
+        self._closing = set()  # close() tasks of retired channels
+
+    def get_channel(self, target) -> grpc.aio.Channel:
+        channel, created_at = self._channels.get(target, (None, 0))
+        if channel is not None:
+            state = channel.get_state(try_to_connect=False)
+            if state not in (grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+                             grpc.ChannelConnectivity.SHUTDOWN) or \
+                    time.monotonic() - created_at < MIN_REBUILD_INTERVAL:
+                return channel
+            print(f"AioChannelPool - Rebuilding channel to {target}")
+            asyncio.get_running_loop().call_later(
+                RETIRED_CHANNEL_GRACE, self._close_retired, channel)
+        channel = grpc.aio.insecure_channel(
+            target, options=self._options,
+            interceptors=[tracing.AioClientInterceptor(),
+                          circuit_breaker.AioClientInterceptor(target)])
+        self._channels[target] = (channel, time.monotonic())
+        for key in [key for key in self._stubs if key[0] == target]:
+            del self._stubs[key]
+        return channel
+
+    def _close_retired(self, channel):
+        # Coroutines may still be calling through it until the grace period ends
+        task = asyncio.ensure_future(channel.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def get_stub(self, target, stub_cls):
+        channel = self.get_channel(target)
+        stub = self._stubs.get((target, stub_cls))
+        if stub is None:
+            stub = self._stubs[(target, stub_cls)] = stub_cls(channel)
+        return stub
+
+    async def close(self):
+        for channel, _ in self._channels.values():
+            await channel.close()
+        self._channels.clear()
+        self._stubs.clear()
+
+
+_default_pool = ChannelPool()
+_aio_pools = {}  # event loop -> AioChannelPool
+
+
+def get_channel(target) -> grpc.Channel:
+    return _default_pool.get_channel(target)
+
+
+def get_stub(target, stub_cls):
+    return _default_pool.get_stub(target, stub_cls)
+
+
+def reset(target):
+    _default_pool.reset(target)
+
+
+def close():
+    _default_pool.close()
+
+
+def get_aio_pool() -> AioChannelPool:
+    loop = asyncio.get_running_loop()
+    pool = _aio_pools.get(loop)
+    if pool is None:
+        pool = _aio_pools[loop] = AioChannelPool()
+    return pool
+
+
+def get_aio_stub(target, stub_cls):
+    return get_aio_pool().get_stub(target, stub_cls)
@@ -0,0 +1,255 @@
+"""
+Per-service circuit breakers for gRPC calls.
+
+A breaker watches the outcome of the last CIRCUIT_WINDOW calls to one target.
+It opens when too many of them failed (UNAVAILABLE, DEADLINE_EXCEEDED and
+other transport errors, not application aborts) or were slower than
+CIRCUIT_SLOW_CALL_MS. While open, calls fail at once with OpenCircuitError,
+a grpc.RpcError with code UNAVAILABLE, instead of each waiting for its own
+connection failure. After CIRCUIT_OPEN_SECONDS it lets a few probe calls
+through (half-open), and closes again when all of them succeed.
+
+Channels from channel_pool consult the breaker of their target, so a service
+only has to say which targets to protect:
+
+    circuit_breaker.protect('suggestions:50051')
+    stub = channel_pool.get_stub('suggestions:50051', SuggestionServiceStub)
+"""
+import collections
+import os
+import threading
+import time
+
+import grpc
+
+import metrics
+
+CIRCUIT_WINDOW = int(os.getenv('CIRCUIT_WINDOW', '20'))
+CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '10'))
+CIRCUIT_FAILURE_RATE = float(os.getenv('CIRCUIT_FAILURE_RATE', '0.5'))
+CIRCUIT_SLOW_CALL = float(os.getenv('CIRCUIT_SLOW_CALL_MS', '2000')) / 1000
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv('CIRCUIT_SLOW_CALL_RATE', '0.8'))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '5'))
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv('CIRCUIT_HALF_OPEN_CALLS', '3'))
+
+# Codes that say something about the health of the service, not the request
+FAILURE_CODES = frozenset([
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNKNOWN,
+])
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = metrics.gauge(
+    'circuit_breaker_state',
+    'State of the circuit breaker of a target (0 closed, 1 half-open, 2 open)',
+    ['target'])
+BREAKER_REJECTED = metrics.counter(
+    'circuit_breaker_rejected_total',
+    'Calls failed fast because the circuit of their target was open', ['target'])
+
+
+class OpenCircuitError(grpc.aio.AioRpcError, grpc.Call, grpc.Future):
+    # Raised by the interceptors instead of making the call. Both flavours of
+    # gRPC hand it back to the caller as the failed call, so it is an
+    # AioRpcError for grpc.aio and a finished Call and Future for grpc
+    def __init__(self, target):
+        super().__init__(grpc.StatusCode.UNAVAILABLE, grpc.aio.Metadata(),
+                         grpc.aio.Metadata(), f'Circuit to {target} is open')
+        self.target = target
+
+    def is_active(self):
+        return False
+
+    def time_remaining(self):
+        return None
+
+    def add_callback(self, callback):
+        return False
+
+    def cancel(self):
+        return False
+
+    def cancelled(self):
+        return False
+
+    def running(self):
+        return False
+
+    def done(self):
+        return True
+
+    def result(self, timeout=None):
+        raise self
+
+    def exception(self, timeout=None):
+        return self
+
+    def traceback(self, timeout=None):
+        return self.__traceback__
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+
+class CircuitBreaker:
+    def __init__(self, target, window=CIRCUIT_WINDOW, min_calls=CIRCUIT_MIN_CALLS,
+                 failure_rate=CIRCUIT_FAILURE_RATE, slow_call=CIRCUIT_SLOW_CALL,
+                 slow_call_rate=CIRCUIT_SLOW_CALL_RATE,
+                 open_seconds=CIRCUIT_OPEN_SECONDS,
+                 half_open_calls=CIRCUIT_HALF_OPEN_CALLS):
+        self.target = target
+        self.state = CLOSED
+        self._min_calls = min_calls
+        self._failure_rate = failure_rate
+        self._slow_call = slow_call
+        self._slow_call_rate = slow_call_rate
+        self._open_seconds = open_seconds
+        self._half_open_calls = half_open_calls
+        self._outcomes = collections.deque(maxlen=window)  # (failed, slow)
+        self._opened_at = 0.0
+        self._probes = 0  # Calls let through while half-open
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0, target=target)
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f"CircuitBreaker - {self.target} {self.state} -> {state}")
+        self.state = state
+        BREAKER_STATE.set(_STATE_VALUES[state], target=self.target)
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._probes = self._probe_successes = 0
+        else:
+            self._outcomes.clear()
+
+    def allow(self):
+        # Whether a call may go out now, counts it as a probe when half-open
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self._open_seconds:
+                    BREAKER_REJECTED.inc(target=self.target)
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self._half_open_calls:
+                    BREAKER_REJECTED.inc(target=self.target)
+                    return False
+                self._probes += 1
+            return True
+
+    def release(self):
+        # A call let through ended without an outcome (cancelled by its
+        # caller), when half-open its probe goes to the next call
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, duration, code):
+        failed = code in FAILURE_CODES
+        slow = duration >= self._slow_call
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._set_state(OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self._half_open_calls:
+                        self._set_state(CLOSED)
+                return
+            if self.state == OPEN:
+                return  # Call started before the circuit opened
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self._min_calls:
+                return
+            failures = sum(1 for f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, s in self._outcomes if s)
+            if failures >= calls * self._failure_rate or \
+                    slow_calls >= calls * self._slow_call_rate:
+                self._set_state(OPEN)
+
+
+_breakers = {}  # target -> CircuitBreaker
+_lock = threading.Lock()
+
+
+def protect(target, **thresholds) -> CircuitBreaker:
+    # Guards every pooled call to target, thresholds override the defaults
+    with _lock:
+        breaker = _breakers.get(target)
+        if breaker is None:
+            breaker = _breakers[target] = CircuitBreaker(target, **thresholds)
+        return breaker
+
+
+def get(target):
+    return _breakers.get(target)
+
+
+def _code(done):
+    # Status code of a finished grpc.Future
+    if done.cancelled():
+        return grpc.StatusCode.CANCELLED
+    error = done.exception()
+    if error is None:
+        return grpc.StatusCode.OK
+    code = getattr(error, 'code', None)
+    return code() if callable(code) else grpc.StatusCode.UNKNOWN
+
+
+class ClientInterceptor(grpc.UnaryUnaryClientInterceptor):
+    # Added by channel_pool to the channel of target
+    def __init__(self, target):
+        self.target = target
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        breaker = _breakers.get(self.target)
+        if breaker is None:
+            return continuation(client_call_details, request)
+        if not breaker.allow():
+            raise OpenCircuitError(self.target)
+        started = time.monotonic()
+        outcome = continuation(client_call_details, request)
+
+        def on_done(done):
+            if done.cancelled():
+                breaker.release()
+            else:
+                breaker.record(time.monotonic() - started, _code(done))
+
+        outcome.add_done_callback(on_done)
+        return outcome
+
+
+class AioClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    # grpc.aio flavour of ClientInterceptor
+    def __init__(self, target):
+        self.target = target
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        breaker = _breakers.get(self.target)
+        if breaker is None:
+            return await continuation(client_call_details, request)
+        if not breaker.allow():
+            raise OpenCircuitError(self.target)
+        started = time.monotonic()
+        code = grpc.StatusCode.CANCELLED
+        try:
+            call = await continuation(client_call_details, request)
+            # Call.code() is a coroutine here, so wait for the status in place
+            code = await call.code()
+        finally:
+            # Cancelled calls, e.g. the losers of a hedge or the events left
+            # when a checkout fails, must not keep their half-open probe
+            if code == grpc.StatusCode.CANCELLED:
+                breaker.release()
+            else:
+                breaker.record(time.monotonic() - started, code)
+        return call
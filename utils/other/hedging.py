@@ -0,0 +1,257 @@
+"""
+Hedged calls to read-only RPCs served by several replicas.
+
+A call goes to one replica (round-robin). If it has not answered after the
+HEDGE_QUANTILE latency of recent calls, the same request is sent to the next
+replica and whichever answers first wins; the other attempt is cancelled.
+Hedges are paid from a budget that grows by HEDGE_MAX_EXTRA_LOAD per call,
+so the replicas see at most that much extra load even when all of them slow
+down together. A call that fails with UNAVAILABLE before the delay (replica
+down, circuit open) moves to the next replica at once, outside the budget.
+Other errors are answers about the request, which another replica would
+give as well, so they are returned at once and never hedged.
+
+Only hedge RPCs that are safe to run twice, like BooksDatabase.Read.
+
+Usage:
+
+    books = hedging.HedgedClient(
+        ['books_database_primary:50051', 'books_database:50051'],
+        BooksDatabaseStub, 'Read')
+    response = books.call(ReadRequest(title=title), timeout=1)
+    response = await books.call_async(ReadRequest(title=title), timeout=1)
+"""
+import asyncio
+import collections
+import itertools
+import os
+import queue
+import threading
+import time
+
+import grpc
+
+import channel_pool
+import metrics
+
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', '0.95'))
+HEDGE_MAX_EXTRA_LOAD = float(os.getenv('HEDGE_MAX_EXTRA_LOAD', '0.1'))
+# Hedges that may be sent back to back after a quiet period
+HEDGE_BURST = float(os.getenv('HEDGE_BURST', '10'))
+HEDGE_WINDOW = int(os.getenv('HEDGE_WINDOW', '1000'))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY_MS', '1')) / 1000
+# Used until HEDGE_MIN_SAMPLES latencies have been seen
+HEDGE_INITIAL_DELAY = float(os.getenv('HEDGE_INITIAL_DELAY_MS', '50')) / 1000
+HEDGE_MIN_SAMPLES = 20
+# Recompute the quantile every this many calls, not on every call
+RECOMPUTE_EVERY = 50
+
+# Errors of the replica, not of the request, worth asking another replica
+RETRYABLE_CODES = frozenset([
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+])
+
+HEDGE_CALLS = metrics.counter(
+    'hedging_calls_total',
+    'Hedged calls by the attempt that answered (primary, hedge) or failed',
+    ['method', 'winner'])
+HEDGES_SENT = metrics.counter(
+    'hedging_hedges_total', 'Duplicate requests sent to another replica', ['method'])
+HEDGE_FAILOVERS = metrics.counter(
+    'hedging_failovers_total',
+    'Requests sent to another replica after failing fast with UNAVAILABLE', ['method'])
+HEDGES_DENIED = metrics.counter(
+    'hedging_hedges_denied_total',
+    'Hedges not sent because the extra load budget was used up', ['method'])
+HEDGE_DELAY = metrics.gauge(
+    'hedging_delay_seconds', 'Current delay before a call is hedged', ['method'])
+
+
+def _retrieve(task):
+    if not task.cancelled():
+        task.exception()
+
+
+def _unavailable(error):
+    return isinstance(error, grpc.RpcError) and error.code() == grpc.StatusCode.UNAVAILABLE
+
+
+def _retryable(error):
+    return isinstance(error, grpc.RpcError) and error.code() in RETRYABLE_CODES
+
+
+class LatencyWindow:
+    # Latencies of the last `size` calls and one quantile of them
+    def __init__(self, quantile=HEDGE_QUANTILE, size=HEDGE_WINDOW,
+                 initial=HEDGE_INITIAL_DELAY, floor=HEDGE_MIN_DELAY):
+        self.value = initial
+        self._quantile = quantile
+        self._floor = floor
+        self._samples = collections.deque(maxlen=size)
+        self._since_recompute = 0
+        self._lock = threading.Lock()
+
+    def observe(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+            self._since_recompute += 1
+            if self._since_recompute < RECOMPUTE_EVERY and \
+                    len(self._samples) != HEDGE_MIN_SAMPLES:
+                return
+            self._since_recompute = 0
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return
+            ordered = sorted(self._samples)
+            index = min(len(ordered) - 1, int(len(ordered) * self._quantile))
+            self.value = max(self._floor, ordered[index])
+
+
+class HedgedClient:
+    def __init__(self, targets, stub_cls, method, quantile=HEDGE_QUANTILE,
+                 max_extra_load=HEDGE_MAX_EXTRA_LOAD, burst=HEDGE_BURST,
+                 window=HEDGE_WINDOW):
+        if not targets:
+            raise ValueError("HedgedClient needs at least one target")
+        self.targets = list(targets)
+        self.stub_cls = stub_cls
+        self.method = method
+        self.latency = LatencyWindow(quantile, window)
+        self._max_extra_load = max_extra_load
+        self._burst = burst
+        self._budget = burst
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        HEDGE_DELAY.set(self.latency.value, method=method)
+
+    def _replicas(self):
+        # Replica for the first attempt and the one to hedge to
+        index = next(self._next) % len(self.targets)
+        return self.targets[index], self.targets[(index + 1) % len(self.targets)]
+
+    def _observe(self, latency):
+        self.latency.observe(latency)
+        HEDGE_DELAY.set(self.latency.value, method=self.method)
+
+    def _earn(self):
+        with self._lock:
+            self._budget = min(self._burst, self._budget + self._max_extra_load)
+
+    def _may_hedge(self):
+        with self._lock:
+            if self._budget < 1:
+                HEDGES_DENIED.inc(method=self.method)
+                return False
+            self._budget -= 1
+        return True
+
+    @staticmethod
+    def _remaining(deadline):
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _send(self, target, request, deadline, finished):
+        stub = channel_pool.get_stub(target, self.stub_cls)
+        sent = time.monotonic()
+
+        def on_done(future):
+            if not future.cancelled() and future.exception() is None:
+                self._observe(time.monotonic() - sent)
+            finished.put(future)
+
+        future = getattr(stub, self.method).future(
+            request, timeout=self._remaining(deadline))
+        future.add_done_callback(on_done)
+        return future
+
+    def call(self, request, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        primary, backup = self._replicas()
+        self._earn()
+        finished = queue.SimpleQueue()
+        attempts = [self._send(primary, request, deadline, finished)]
+        hedged = False
+        failed = []
+        while True:
+            try:
+                future = finished.get(timeout=None if hedged else self.latency.value)
+            except queue.Empty:
+                future = None
+            if future is not None and not future.cancelled() and future.exception() is None:
+                for other in attempts:
+                    if other is not future:
+                        other.cancel()
+                winner = 'primary' if future is attempts[0] else 'hedge'
+                HEDGE_CALLS.inc(method=self.method, winner=winner)
+                return future.result()
+            if future is not None:
+                if not future.cancelled() and not _retryable(future.exception()):
+                    for other in attempts:
+                        other.cancel()
+                    HEDGE_CALLS.inc(method=self.method, winner='failed')
+                    raise future.exception()
+                failed.append(future)
+            if not hedged:
+                # Slow or unreachable, try the other replica
+                hedged = True
+                if future is not None and _unavailable(future.exception()):
+                    attempts.append(self._send(backup, request, deadline, finished))
+                    HEDGE_FAILOVERS.inc(method=self.method)
+                elif self._may_hedge():
+                    attempts.append(self._send(backup, request, deadline, finished))
+                    HEDGES_SENT.inc(method=self.method)
+            if len(failed) == len(attempts):
+                HEDGE_CALLS.inc(method=self.method, winner='failed')
+                raise failed[0].exception()
+
+    async def _attempt_async(self, target, request, deadline):
+        stub = channel_pool.get_aio_stub(target, self.stub_cls)
+        sent = time.monotonic()
+        response = await getattr(stub, self.method)(
+            request, timeout=self._remaining(deadline))
+        self._observe(time.monotonic() - sent)
+        return response
+
+    async def call_async(self, request, timeout=None):
+        # grpc.aio flavour of call()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        primary, backup = self._replicas()
+        self._earn()
+        first = asyncio.ensure_future(self._attempt_async(primary, request, deadline))
+        attempts = [first]
+        pending = {first}
+        hedged = False
+        failed = []
+        try:
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, timeout=None if hedged else self.latency.value,
+                    return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = 'primary' if task is first else 'hedge'
+                        HEDGE_CALLS.inc(method=self.method, winner=winner)
+                        return task.result()
+                    if not _retryable(task.exception()):
+                        HEDGE_CALLS.inc(method=self.method, winner='failed')
+                        raise task.exception()
+                    failed.append(task)
+                if not hedged:
+                    hedged = True
+                    if done and _unavailable(first.exception()):
+                        HEDGE_FAILOVERS.inc(method=self.method)
+                        attempts.append(asyncio.ensure_future(
+                            self._attempt_async(backup, request, deadline)))
+                    elif self._may_hedge():
+                        HEDGES_SENT.inc(method=self.method)
+                        attempts.append(asyncio.ensure_future(
+                            self._attempt_async(backup, request, deadline)))
+                    pending.update(attempts[1:])
+                if not pending:
+                    HEDGE_CALLS.inc(method=self.method, winner='failed')
+                    raise failed[0].exception()
+        finally:
+            for task in attempts:
+                # A loser may fail meanwhile or while being cancelled, which
+                # is not worth a warning
+                task.cancel()
+                task.add_done_callback(_retrieve)
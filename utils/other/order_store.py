@@ -0,0 +1,161 @@
+"""
+Thread-safe, bounded per-order state container.
+
+Every entry expires after its TTL and the store never holds more than
+max_size entries; when it is full the least recently used entry is evicted.
+Each entry carries its own lock, so handlers working on different orders
+never contend, while updates to the same order (e.g. merging vector clocks
+from two event threads) are serialized.
+
+Usage:
+
+    orders = OrderStore(max_size=10000, ttl=300)
+    orders.put(order_id, {"data": data, "vc": [0, 0, 0]})
+    with orders.locked(order_id) as entry:
+        entry["vc"][0] += 1
+
+gRPC handlers use locked_or_abort(order_id, context), which aborts the call
+with NOT_FOUND for an unknown or expired order.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import grpc
+
+DEFAULT_MAX_SIZE = int(os.getenv('ORDER_STORE_MAX_SIZE', '10000'))
+DEFAULT_TTL = float(os.getenv('ORDER_STORE_TTL_SECONDS', '300'))
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'lock')
+
+    def __init__(self, value, expires_at):
+        self.value = value
+        self.expires_at = expires_at
+        self.lock = threading.RLock()
+
+
+class _LockedEntry:
+    def __init__(self, entry):
+        self._entry = entry
+
+    def __enter__(self):
+        self._entry.lock.acquire()
+        return self._entry.value
+
+    def __exit__(self, *exc):
+        self._entry.lock.release()
+
+
+class OrderStore:
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # order_id -> _Entry, oldest use first
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def put(self, order_id, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            self._insert(order_id, value, ttl, now)
+
+    def setdefault(self, order_id, value, ttl=None):
+        # Atomically returns the live value for order_id, storing value first
+        # if there is none
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(order_id)
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+            self._insert(order_id, value, ttl, now)
+            return value
+
+    def _insert(self, order_id, value, ttl, now):
+        # Called with self._lock held
+        self._entries[order_id] = _Entry(
+            value, now + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(order_id)
+        if now >= self._next_sweep:
+            self._sweep(now)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _sweep(self, now):
+        # Called with self._lock held
+        expired = [order_id for order_id, entry in self._entries.items()
+                   if entry.expires_at <= now]
+        for order_id in expired:
+            del self._entries[order_id]
+        self.expirations += len(expired)
+        self._next_sweep = now + max(self.ttl / 4, 1.0)
+
+    def _get_entry(self, order_id):
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                del self._entries[order_id]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(order_id)
+            self.hits += 1
+            return entry
+
+    def get(self, order_id, default=None):
+        entry = self._get_entry(order_id)
+        return default if entry is None else entry.value
+
+    def __getitem__(self, order_id):
+        entry = self._get_entry(order_id)
+        if entry is None:
+            raise KeyError(order_id)
+        return entry.value
+
+    def __contains__(self, order_id):
+        return self.get(order_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def locked(self, order_id):
+        # Context manager holding the order's own lock, raises KeyError if
+        # the order is unknown or expired
+        entry = self._get_entry(order_id)
+        if entry is None:
+            raise KeyError(order_id)
+        return _LockedEntry(entry)
+
+    def locked_or_abort(self, order_id, context):
+        # locked() for gRPC handlers, an unknown order ends the call
+        try:
+            return self.locked(order_id)
+        except KeyError:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Unknown order {order_id}")
+
+    def pop(self, order_id, default=None):
+        with self._lock:
+            entry = self._entries.pop(order_id, None)
+        return default if entry is None else entry.value
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self),
+        }
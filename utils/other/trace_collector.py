@@ -0,0 +1,94 @@
+"""
+Stand-in for an OTLP/HTTP trace collector.
+
+Accepts the OTLP/JSON export requests sent by tracing.py with
+TRACE_EXPORTER=otlp and appends every span as one JSON line to a file, in
+the same format as the file exporter. Enough to look at traces without
+running a real collector.
+
+Usage:
+
+python trace_collector.py [--port 4318] [--output traces.jsonl]
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _plain_value(value):
+    if 'arrayValue' in value:
+        return [_plain_value(v) for v in value['arrayValue'].get('values', [])]
+    if 'intValue' in value:
+        return int(value['intValue'])
+    for key in ('boolValue', 'doubleValue', 'stringValue'):
+        if key in value:
+            return value[key]
+    return None
+
+
+def flatten(export_request):
+    # OTLP/JSON export request -> list of flat span records
+    records = []
+    for resource_spans in export_request.get('resourceSpans', []):
+        service = ''
+        for attribute in resource_spans.get('resource', {}).get('attributes', []):
+            if attribute['key'] == 'service.name':
+                service = _plain_value(attribute['value'])
+        for scope_spans in resource_spans.get('scopeSpans', []):
+            for span in scope_spans.get('spans', []):
+                start, end = int(span['startTimeUnixNano']), int(span['endTimeUnixNano'])
+                status = span.get('status', {})
+                records.append({
+                    'traceId': span['traceId'],
+                    'spanId': span['spanId'],
+                    'parentSpanId': span.get('parentSpanId') or None,
+                    'name': span['name'],
+                    'kind': span.get('kind'),
+                    'service': service,
+                    'startTimeUnixNano': start,
+                    'durationMs': (end - start) / 1e6,
+                    'attributes': {a['key']: _plain_value(a['value'])
+                                   for a in span.get('attributes', [])},
+                    'error': status.get('message') if status.get('code') == 2 else None,
+                })
+    return records
+
+
+def serve(port, output):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/v1/traces':
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                records = flatten(json.loads(body))
+            except (ValueError, KeyError) as e:
+                self.send_error(400, str(e))
+                return
+            with lock, open(output, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    print(f"Trace collector listening on port {port}, writing to {output}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=4318)
+    parser.add_argument('--output', default='traces.jsonl')
+    args = parser.parse_args()
+    serve(args.port, args.output)
@@ -0,0 +1,381 @@
+"""
+Lightweight distributed tracing propagated through gRPC metadata.
+
+The trace context travels in a W3C `traceparent` metadata entry. Channels
+from channel_pool add it to every outgoing call made while a span is
+current, and services that install server_interceptor() record a span for
+every call they handle, annotated with the vector clocks of the request and
+the response. The first service of a trace decides whether it is sampled
+(TRACE_SAMPLE_RATE). Only sampled traces are propagated, so an unsampled
+checkout costs nothing beyond the interceptor calls.
+
+Finished spans are exported from a background thread, either appended to a
+JSON-lines file (TRACE_EXPORTER=file, TRACE_FILE) or posted as OTLP/JSON to
+a collector (TRACE_EXPORTER=otlp, TRACE_OTLP_ENDPOINT), for instance
+trace_collector.py in this folder.
+
+Usage:
+
+    server = grpc.server(futures.ThreadPoolExecutor(),
+                         interceptors=[tracing.server_interceptor('payment')])
+
+    with tracing.span('checkout', service='orchestrator') as span:
+        span.set('order_id', order_id)
+        stub.SayFraud(request)  # carries the span as its parent
+"""
+import asyncio
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+import grpc
+
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'file')  # file, otlp or none
+TRACE_FILE = os.getenv('TRACE_FILE', '/tmp/traces.jsonl')
+TRACE_OTLP_ENDPOINT = os.getenv(
+    'TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+# Spans are exported at least this often (seconds) or once this many are queued
+EXPORT_INTERVAL = 1.0
+EXPORT_BATCH_SIZE = 512
+
+INTERNAL, SERVER, CLIENT = 1, 2, 3  # OTLP span kinds
+TRACEPARENT = 'traceparent'
+
+_random = random.Random()
+_current = contextvars.ContextVar('tracing_current_span', default=None)
+
+
+class SpanContext:
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def extract(traceparent):
+    # SpanContext of a traceparent header, None if it is missing or malformed
+    if not traceparent:
+        return None
+    parts = traceparent.split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return SpanContext(parts[1], parts[2], sampled)
+
+
+class Span:
+    __slots__ = ('name', 'context', 'parent_id', 'kind', 'service',
+                 'start_ns', 'attributes', 'error')
+
+    def __init__(self, name, context, parent_id, kind, service):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.service = service
+        self.start_ns = time.time_ns()
+        self.attributes = {}
+        self.error = None
+
+    @property
+    def recording(self):
+        return self.context.sampled
+
+    def set(self, key, value):
+        if self.context.sampled:
+            self.attributes[key] = value
+
+    def set_vector_clock(self, key, message):
+        # Copies message.vector_clock.clocks, if the message carries one
+        if self.context.sampled and hasattr(message, 'vector_clock') and \
+                message.vector_clock.clocks:
+            self.attributes[key] = list(message.vector_clock.clocks)
+
+    def end(self, error=None):
+        if not self.context.sampled:
+            return
+        if error is not None:
+            code = getattr(error, 'code', None)
+            self.error = code().name if callable(code) else repr(error)
+        _exporter.submit(self, time.time_ns())
+
+
+def start_span(name, parent=None, kind=INTERNAL, service=None) -> Span:
+    # A child of parent (a Span or SpanContext), or of the current span, or
+    # the root of a new trace that is sampled with TRACE_SAMPLE_RATE
+    if parent is None:
+        parent = _current.get()
+    if isinstance(parent, Span):
+        service = service or parent.service
+        parent = parent.context
+    if parent is None:
+        trace_id = f'{_random.getrandbits(128):032x}'
+        context = SpanContext(trace_id, f'{_random.getrandbits(64):016x}',
+                              _random.random() < TRACE_SAMPLE_RATE)
+        return Span(name, context, None, kind, service or '')
+    context = SpanContext(parent.trace_id, f'{_random.getrandbits(64):016x}',
+                          parent.sampled)
+    return Span(name, context, parent.span_id, kind, service or '')
+
+
+@contextmanager
+def span(name, parent=None, kind=INTERNAL, service=None):
+    # Makes the span current for the block, calls made inside are its children
+    current = start_span(name, parent, kind, service)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    else:
+        current.end()
+    finally:
+        _current.reset(token)
+
+
+def current_span():
+    return _current.get()
+
+
+def current_traceparent():
+    # traceparent of the current span, None unless it is sampled
+    current = _current.get()
+    if current is None or not current.recording:
+        return None
+    return current.context.traceparent()
+
+
+class _ClientCallDetails(grpc.ClientCallDetails):
+    def __init__(self, details, metadata):
+        self.method = details.method
+        self.timeout = details.timeout
+        self.metadata = metadata
+        self.credentials = details.credentials
+        self.wait_for_ready = getattr(details, 'wait_for_ready', None)
+        self.compression = getattr(details, 'compression', None)
+
+
+def _method_name(method):
+    # '/fraud.FraudService/SayFraud' -> 'FraudService/SayFraud'
+    if isinstance(method, bytes):
+        method = method.decode()
+    return method.rsplit('.', 1)[-1].lstrip('/')
+
+
+class ClientInterceptor(grpc.UnaryUnaryClientInterceptor):
+    # Added to every channel_pool channel
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        parent = _current.get()
+        if parent is None or not parent.recording:
+            return continuation(client_call_details, request)
+        call_span = start_span(_method_name(client_call_details.method), parent, CLIENT)
+        call_span.set_vector_clock('vector_clock.sent', request)
+        metadata = list(client_call_details.metadata or ())
+        metadata.append((TRACEPARENT, call_span.context.traceparent()))
+        outcome = continuation(_ClientCallDetails(client_call_details, metadata), request)
+        outcome.add_done_callback(lambda done: call_span.end(done.exception()))
+        return outcome
+
+
+class AioClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    # Added to every channel_pool grpc.aio channel
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        parent = _current.get()
+        if parent is None or not parent.recording:
+            return await continuation(client_call_details, request)
+        call_span = start_span(_method_name(client_call_details.method), parent, CLIENT)
+        call_span.set_vector_clock('vector_clock.sent', request)
+        metadata = grpc.aio.Metadata(*(client_call_details.metadata or ()))
+        metadata.add(TRACEPARENT, call_span.context.traceparent())
+        try:
+            call = await continuation(grpc.aio.ClientCallDetails(
+                client_call_details.method, client_call_details.timeout, metadata,
+                client_call_details.credentials, client_call_details.wait_for_ready),
+                request)
+            # Call.code() is a coroutine here, so wait for the status in place
+            code = await call.code()
+        except asyncio.CancelledError:
+            call_span.end(_StatusError(grpc.StatusCode.CANCELLED))
+            raise
+        except BaseException as e:
+            call_span.end(e)
+            raise
+        call_span.end(None if code == grpc.StatusCode.OK else _StatusError(code))
+        return call
+
+
+class _StatusError(Exception):
+    def __init__(self, code):
+        super().__init__(code.name)
+        self._code = code
+
+    def code(self):
+        return self._code
+
+
+class _ServerInterceptor(grpc.ServerInterceptor):
+    def __init__(self, service):
+        self.service = service
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+        traceparent = None
+        for key, value in handler_call_details.invocation_metadata or ():
+            if key == TRACEPARENT:
+                traceparent = value
+        parent = extract(traceparent)
+        if parent is None:
+            # Not part of a trace, leave the call alone
+            return handler
+        behavior = handler.unary_unary
+        name = _method_name(handler_call_details.method)
+
+        def traced(request, context):
+            with span(name, parent, SERVER, self.service) as server_span:
+                server_span.set_vector_clock('vector_clock.received', request)
+                response = behavior(request, context)
+                server_span.set_vector_clock('vector_clock', response)
+                return response
+
+        return grpc.unary_unary_rpc_method_handler(
+            traced,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer)
+
+
+def server_interceptor(service):
+    return _ServerInterceptor(service)
+
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [_attribute_value(v) for v in value]}}
+    return {'stringValue': str(value)}
+
+
+class _Exporter:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._warned = False
+
+    def submit(self, span, end_ns):
+        if TRACE_EXPORTER == 'none':
+            return
+        self._queue.put((span, end_ns))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='trace-exporter', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(EXPORT_INTERVAL)
+            self.flush()
+
+    def _drain(self):
+        spans = []
+        while len(spans) < EXPORT_BATCH_SIZE:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return spans
+
+    def flush(self):
+        while True:
+            spans = self._drain()
+            if not spans:
+                return
+            try:
+                if TRACE_EXPORTER == 'otlp':
+                    self._post_otlp(spans)
+                else:
+                    self._append_file(spans)
+            except Exception as e:
+                if not self._warned:
+                    print(f"Tracing - Dropping spans, export failed: {e!r}")
+                    self._warned = True
+
+    @staticmethod
+    def _append_file(spans):
+        lines = []
+        for span, end_ns in spans:
+            lines.append(json.dumps({
+                'traceId': span.context.trace_id,
+                'spanId': span.context.span_id,
+                'parentSpanId': span.parent_id,
+                'name': span.name,
+                'kind': span.kind,
+                'service': span.service,
+                'startTimeUnixNano': span.start_ns,
+                'durationMs': (end_ns - span.start_ns) / 1e6,
+                'attributes': span.attributes,
+                'error': span.error,
+            }))
+        with open(TRACE_FILE, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    @staticmethod
+    def _post_otlp(spans):
+        by_service = {}
+        for span, end_ns in spans:
+            by_service.setdefault(span.service, []).append({
+                'traceId': span.context.trace_id,
+                'spanId': span.context.span_id,
+                'parentSpanId': span.parent_id or '',
+                'name': span.name,
+                'kind': span.kind,
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(end_ns),
+                'attributes': [{'key': key, 'value': _attribute_value(value)}
+                               for key, value in span.attributes.items()],
+                'status': {'code': 2, 'message': span.error} if span.error
+                else {'code': 1},
+            })
+        body = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': service}}]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': otlp_spans}],
+        } for service, otlp_spans in by_service.items()]}).encode()
+        request = urllib.request.Request(
+            TRACE_OTLP_ENDPOINT, data=body, method='POST',
+            headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=5) as resp:
+            resp.read()
+
+
+_exporter = _Exporter()
+
+
+def flush():
+    _exporter.flush()
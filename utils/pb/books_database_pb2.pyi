@@ -1,6 +1,7 @@
+from google.protobuf.internal import containers as _containers
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
@@ -16,6 +17,25 @@ class ReadResponse(_message.Message):
     stock: int
     def __init__(self, stock: _Optional[int] = ...) -> None: ...
 
+class ReadBatchRequest(_message.Message):
+    __slots__ = ("titles",)
+    TITLES_FIELD_NUMBER: _ClassVar[int]
+    titles: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, titles: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class ReadBatchResponse(_message.Message):
+    __slots__ = ("stock",)
+    class StockEntry(_message.Message):
+        __slots__ = ("key", "value")
+        KEY_FIELD_NUMBER: _ClassVar[int]
+        VALUE_FIELD_NUMBER: _ClassVar[int]
+        key: str
+        value: int
+        def __init__(self, key: _Optional[str] = ..., value: _Optional[int] = ...) -> None: ...
+    STOCK_FIELD_NUMBER: _ClassVar[int]
+    stock: _containers.ScalarMap[str, int]
+    def __init__(self, stock: _Optional[_Mapping[str, int]] = ...) -> None: ...
+
 class WriteRequest(_message.Message):
     __slots__ = ("title", "new_stock")
     TITLE_FIELD_NUMBER: _ClassVar[int]
@@ -39,6 +39,11 @@ class BooksDatabaseStub(object):
                 request_serializer=books__database__pb2.ReadRequest.SerializeToString,
                 response_deserializer=books__database__pb2.ReadResponse.FromString,
                 _registered_method=True)
+        self.ReadBatch = channel.unary_unary(
+                '/books_db.BooksDatabase/ReadBatch',
+                request_serializer=books__database__pb2.ReadBatchRequest.SerializeToString,
+                response_deserializer=books__database__pb2.ReadBatchResponse.FromString,
+                _registered_method=True)
         self.Write = channel.unary_unary(
                 '/books_db.BooksDatabase/Write',
                 request_serializer=books__database__pb2.WriteRequest.SerializeToString,
@@ -65,6 +70,12 @@ class BooksDatabaseServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def ReadBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def Write(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -91,6 +102,11 @@ def add_BooksDatabaseServicer_to_server(servicer, server):
                     request_deserializer=books__database__pb2.ReadRequest.FromString,
                     response_serializer=books__database__pb2.ReadResponse.SerializeToString,
             ),
+            'ReadBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReadBatch,
+                    request_deserializer=books__database__pb2.ReadBatchRequest.FromString,
+                    response_serializer=books__database__pb2.ReadBatchResponse.SerializeToString,
+            ),
             'Write': grpc.unary_unary_rpc_method_handler(
                     servicer.Write,
                     request_deserializer=books__database__pb2.WriteRequest.FromString,
@@ -144,6 +160,33 @@ class BooksDatabase(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def ReadBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/books_db.BooksDatabase/ReadBatch',
+            books__database__pb2.ReadBatchRequest.SerializeToString,
+            books__database__pb2.ReadBatchResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def Write(request,
             target,
@@ -25,17 +25,27 @@ _sym_db = _symbol_database.Default()
 import common_pb2 as common__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11order_queue.proto\x12\x05queue\x1a\x0c\x63ommon.proto\"\"\n\rLeaderRequest\x12\x11\n\tsender_id\x18\x01 \x01(\t2{\n\x11OrderQueueService\x12\x32\n\x07\x45nqueue\x12\x18.common.ItemsInitRequest\x1a\r.common.Empty\x12\x32\n\x07\x44\x65queue\x12\r.common.Empty\x1a\x18.common.ItemsInitRequest2\x86\x01\n\x15LeaderElectionService\x12\x36\n\x0f\x44\x65\x63lareElection\x12\x14.queue.LeaderRequest\x1a\r.common.Empty\x12\x35\n\x0e\x44\x65\x63lareVictory\x12\x14.queue.LeaderRequest\x1a\r.common.Emptyb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11order_queue.proto\x12\x05queue\x1a\x0c\x63ommon.proto\"?\n\x13\x45nqueueBatchRequest\x12(\n\x06orders\x18\x01 \x03(\x0b\x32\x18.common.ItemsInitRequest\"\xd5\x01\n\x0bOrderStatus\x12\x10\n\x08order_id\x18\x01 \x01(\t\x12\'\n\x05state\x18\x02 \x01(\x0e\x32\x18.queue.OrderStatus.State\x12\x0f\n\x07message\x18\x03 \x01(\t\x12\x12\n\nupdated_at\x18\x04 \x01(\x01\"f\n\x05State\x12\x0b\n\x07UNKNOWN\x10\x00\x12\x0c\n\x08\x41\x43\x43\x45PTED\x10\x01\x12\x0c\n\x08VERIFIED\x10\x02\x12\x0c\n\x08REJECTED\x10\x03\x12\n\n\x06QUEUED\x10\x04\x12\r\n\tCOMMITTED\x10\x05\x12\x0b\n\x07\x41\x42ORTED\x10\x06\"&\n\x12OrderStatusRequest\x12\x10\n\x08order_id\x18\x01 \x01(\t\"\"\n\rLeaderRequest\x12\x11\n\tsender_id\x18\x01 \x01(\t2\xb6\x01\n\x11OrderQueueService\x12\x32\n\x07\x45nqueue\x12\x18.common.ItemsInitRequest\x1a\r.common.Empty\x12\x39\n\x0c\x45nqueueBatch\x12\x1a.queue.EnqueueBatchRequest\x1a\r.common.Empty\x12\x32\n\x07\x44\x65queue\x12\r.common.Empty\x1a\x18.common.ItemsInitRequest2\x80\x01\n\x12OrderStatusService\x12.\n\tSetStatus\x12\x12.queue.OrderStatus\x1a\r.common.Empty\x12:\n\tGetStatus\x12\x19.queue.OrderStatusRequest\x1a\x12.queue.OrderStatus2\x86\x01\n\x15LeaderElectionService\x12\x36\n\x0f\x44\x65\x63lareElection\x12\x14.queue.LeaderRequest\x1a\r.common.Empty\x12\x35\n\x0e\x44\x65\x63lareVictory\x12\x14.queue.LeaderRequest\x1a\r.common.Emptyb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'order_queue_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_LEADERREQUEST']._serialized_start=42
-  _globals['_LEADERREQUEST']._serialized_end=76
-  _globals['_ORDERQUEUESERVICE']._serialized_start=78
-  _globals['_ORDERQUEUESERVICE']._serialized_end=201
-  _globals['_LEADERELECTIONSERVICE']._serialized_start=204
-  _globals['_LEADERELECTIONSERVICE']._serialized_end=338
+  _globals['_ENQUEUEBATCHREQUEST']._serialized_start=42
+  _globals['_ENQUEUEBATCHREQUEST']._serialized_end=105
+  _globals['_ORDERSTATUS']._serialized_start=108
+  _globals['_ORDERSTATUS']._serialized_end=321
+  _globals['_ORDERSTATUS_STATE']._serialized_start=219
+  _globals['_ORDERSTATUS_STATE']._serialized_end=321
+  _globals['_ORDERSTATUSREQUEST']._serialized_start=323
+  _globals['_ORDERSTATUSREQUEST']._serialized_end=361
+  _globals['_LEADERREQUEST']._serialized_start=363
+  _globals['_LEADERREQUEST']._serialized_end=397
+  _globals['_ORDERQUEUESERVICE']._serialized_start=400
+  _globals['_ORDERQUEUESERVICE']._serialized_end=582
+  _globals['_ORDERSTATUSSERVICE']._serialized_start=585
+  _globals['_ORDERSTATUSSERVICE']._serialized_end=713
+  _globals['_LEADERELECTIONSERVICE']._serialized_start=716
+  _globals['_LEADERELECTIONSERVICE']._serialized_end=850
 # @@protoc_insertion_point(module_scope)
@@ -1,10 +1,52 @@
 import common_pb2 as _common_pb2
+from google.protobuf.internal import containers as _containers
+from google.protobuf.internal import enum_type_wrapper as _enum_type_wrapper
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
+class EnqueueBatchRequest(_message.Message):
+    __slots__ = ("orders",)
+    ORDERS_FIELD_NUMBER: _ClassVar[int]
+    orders: _containers.RepeatedCompositeFieldContainer[_common_pb2.ItemsInitRequest]
+    def __init__(self, orders: _Optional[_Iterable[_Union[_common_pb2.ItemsInitRequest, _Mapping]]] = ...) -> None: ...
+
+class OrderStatus(_message.Message):
+    __slots__ = ("order_id", "state", "message", "updated_at")
+    class State(int, metaclass=_enum_type_wrapper.EnumTypeWrapper):
+        __slots__ = ()
+        UNKNOWN: _ClassVar[OrderStatus.State]
+        ACCEPTED: _ClassVar[OrderStatus.State]
+        VERIFIED: _ClassVar[OrderStatus.State]
+        REJECTED: _ClassVar[OrderStatus.State]
+        QUEUED: _ClassVar[OrderStatus.State]
+        COMMITTED: _ClassVar[OrderStatus.State]
+        ABORTED: _ClassVar[OrderStatus.State]
+    UNKNOWN: OrderStatus.State
+    ACCEPTED: OrderStatus.State
+    VERIFIED: OrderStatus.State
+    REJECTED: OrderStatus.State
+    QUEUED: OrderStatus.State
+    COMMITTED: OrderStatus.State
+    ABORTED: OrderStatus.State
+    ORDER_ID_FIELD_NUMBER: _ClassVar[int]
+    STATE_FIELD_NUMBER: _ClassVar[int]
+    MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    UPDATED_AT_FIELD_NUMBER: _ClassVar[int]
+    order_id: str
+    state: OrderStatus.State
+    message: str
+    updated_at: float
+    def __init__(self, order_id: _Optional[str] = ..., state: _Optional[_Union[OrderStatus.State, str]] = ..., message: _Optional[str] = ..., updated_at: _Optional[float] = ...) -> None: ...
+
+class OrderStatusRequest(_message.Message):
+    __slots__ = ("order_id",)
+    ORDER_ID_FIELD_NUMBER: _ClassVar[int]
+    order_id: str
+    def __init__(self, order_id: _Optional[str] = ...) -> None: ...
+
 class LeaderRequest(_message.Message):
     __slots__ = ("sender_id",)
     SENDER_ID_FIELD_NUMBER: _ClassVar[int]
@@ -40,6 +40,11 @@ class OrderQueueServiceStub(object):
                 request_serializer=common__pb2.ItemsInitRequest.SerializeToString,
                 response_deserializer=common__pb2.Empty.FromString,
                 _registered_method=True)
+        self.EnqueueBatch = channel.unary_unary(
+                '/queue.OrderQueueService/EnqueueBatch',
+                request_serializer=order__queue__pb2.EnqueueBatchRequest.SerializeToString,
+                response_deserializer=common__pb2.Empty.FromString,
+                _registered_method=True)
         self.Dequeue = channel.unary_unary(
                 '/queue.OrderQueueService/Dequeue',
                 request_serializer=common__pb2.Empty.SerializeToString,
@@ -56,6 +61,12 @@ class OrderQueueServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def EnqueueBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def Dequeue(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -70,6 +81,11 @@ def add_OrderQueueServiceServicer_to_server(servicer, server):
                     request_deserializer=common__pb2.ItemsInitRequest.FromString,
                     response_serializer=common__pb2.Empty.SerializeToString,
             ),
+            'EnqueueBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.EnqueueBatch,
+                    request_deserializer=order__queue__pb2.EnqueueBatchRequest.FromString,
+                    response_serializer=common__pb2.Empty.SerializeToString,
+            ),
             'Dequeue': grpc.unary_unary_rpc_method_handler(
                     servicer.Dequeue,
                     request_deserializer=common__pb2.Empty.FromString,
@@ -113,6 +129,33 @@ class OrderQueueService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def EnqueueBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/queue.OrderQueueService/EnqueueBatch',
+            order__queue__pb2.EnqueueBatchRequest.SerializeToString,
+            common__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def Dequeue(request,
             target,
@@ -141,6 +184,124 @@ class OrderQueueService(object):
             _registered_method=True)
 
 
+class OrderStatusServiceStub(object):
+    """Where an order is, set by the orchestrator, the queue and the executor
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.SetStatus = channel.unary_unary(
+                '/queue.OrderStatusService/SetStatus',
+                request_serializer=order__queue__pb2.OrderStatus.SerializeToString,
+                response_deserializer=common__pb2.Empty.FromString,
+                _registered_method=True)
+        self.GetStatus = channel.unary_unary(
+                '/queue.OrderStatusService/GetStatus',
+                request_serializer=order__queue__pb2.OrderStatusRequest.SerializeToString,
+                response_deserializer=order__queue__pb2.OrderStatus.FromString,
+                _registered_method=True)
+
+
+class OrderStatusServiceServicer(object):
+    """Where an order is, set by the orchestrator, the queue and the executor
+    """
+
+    def SetStatus(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetStatus(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_OrderStatusServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'SetStatus': grpc.unary_unary_rpc_method_handler(
+                    servicer.SetStatus,
+                    request_deserializer=order__queue__pb2.OrderStatus.FromString,
+                    response_serializer=common__pb2.Empty.SerializeToString,
+            ),
+            'GetStatus': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetStatus,
+                    request_deserializer=order__queue__pb2.OrderStatusRequest.FromString,
+                    response_serializer=order__queue__pb2.OrderStatus.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'queue.OrderStatusService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('queue.OrderStatusService', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class OrderStatusService(object):
+    """Where an order is, set by the orchestrator, the queue and the executor
+    """
+
+    @staticmethod
+    def SetStatus(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/queue.OrderStatusService/SetStatus',
+            order__queue__pb2.OrderStatus.SerializeToString,
+            common__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetStatus(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/queue.OrderStatusService/GetStatus',
+            order__queue__pb2.OrderStatusRequest.SerializeToString,
+            order__queue__pb2.OrderStatus.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+
 class LeaderElectionServiceStub(object):
     """Missing associated documentation comment in .proto file."""
 